@@ -16,3 +16,26 @@ ALLOWED_IDS = parse_ids("TELEGRAM_ALLOWED_IDS")
 ADMIN_IDS = parse_ids("TELEGRAM_ADMIN_IDS")
 
 ENABLED_PATH = "enabled.json"
+
+# Очередь генерации документов
+GENERATION_WORKERS = int(os.getenv("GENERATION_WORKERS", "2"))
+GENERATION_PER_USER_LIMIT = int(os.getenv("GENERATION_PER_USER_LIMIT", "1"))
+
+# Хранилище состояния мастера заполнения: sqlite (по умолчанию), redis, memory
+FSM_STORAGE = os.getenv("FSM_STORAGE", "sqlite").lower()
+FSM_SQLITE_PATH = os.getenv("FSM_SQLITE_PATH", str(Path(__file__).parent / "fsm.sqlite3"))
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+
+# Картинка первой страницы на шаге предпросмотра (нужен pypdfium2)
+PREVIEW_IMAGES = os.getenv("PREVIEW_IMAGES", "1") not in {"0", "false", "no"}
+PREVIEW_DPI = int(os.getenv("PREVIEW_DPI", "60"))
+
+# Сохранённые профили пользователей (автозаполнение полей)
+PROFILES_PATH = os.getenv("PROFILES_PATH", str(Path(__file__).parent / "profiles.sqlite3"))
+
+# Песочница: рендер и конвертация в отдельных процессах с лимитами (0 воркеров — в потоках бота)
+SANDBOX_WORKERS = int(os.getenv("SANDBOX_WORKERS", str(GENERATION_WORKERS)))
+SANDBOX_MEMORY_MB = int(os.getenv("SANDBOX_MEMORY_MB", "2048"))
+SANDBOX_CPU_SECONDS = int(os.getenv("SANDBOX_CPU_SECONDS", "60"))
+RENDER_TIMEOUT = float(os.getenv("RENDER_TIMEOUT", "60"))
+CONVERT_TIMEOUT = float(os.getenv("CONVERT_TIMEOUT", "120"))
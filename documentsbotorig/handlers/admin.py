@@ -1,7 +1,8 @@
 from aiogram import Router, F, types
 from aiogram.filters import Command
 from config import ADMIN_IDS
-from utils.file_utils import load_enabled, save_enabled
+from utils import tracing
+from utils.file_utils import load_enabled, template_registry
 from keyboards import admin_menu_kb
 
 router = Router()
@@ -25,15 +26,40 @@ async def toggle_template(callback: types.CallbackQuery):
         return
 
     template_name = callback.data.split(":", 1)[1]
-    enabled = load_enabled()
 
-    if template_name in enabled:
-        enabled[template_name] = not enabled[template_name]
-        save_enabled(enabled)
+    if template_registry.toggle(template_name) is not None:
         await callback.message.edit_text(
             "🔑 Панель администратора:\nНажми на шаблон, чтобы переключить:",
-            reply_markup=admin_menu_kb(enabled)
+            reply_markup=admin_menu_kb(load_enabled())
         )
         await callback.answer(f"Шаблон {template_name} переключен!")
     else:
         await callback.answer("❌ Шаблон не найден", show_alert=True)
+
+
+PHASE_ORDER = ["render", "inject_tables", "save", "convert_pdf", "send"]
+
+
+@router.message(Command("stats"))
+async def stats_handler(message: types.Message):
+    if message.from_user.id not in ADMIN_IDS:
+        await message.answer("🚫 У вас нет доступа.")
+        return
+
+    summary = tracing.phase_stats.summary()
+    if not summary:
+        await message.answer(
+            "📊 Пока нет замеров генерации "
+            f"(в выборку попадает {tracing.TRACE_SAMPLE_RATE:.0%} документов)."
+        )
+        return
+
+    lines = [f"📊 Время генерации, p50 / p95 (выборка {tracing.TRACE_SAMPLE_RATE:.0%}):"]
+    for template in sorted(summary):
+        phases = summary[template]
+        count = max(p["count"] for p in phases.values())
+        lines.append(f"\n{template} (n={count})")
+        for phase in sorted(phases, key=lambda p: (PHASE_ORDER.index(p) if p in PHASE_ORDER else len(PHASE_ORDER), p)):
+            p = phases[phase]
+            lines.append(f"  {phase}: {p['p50_ms']:.0f} / {p['p95_ms']:.0f} мс")
+    await message.answer("\n".join(lines))
@@ -1,15 +1,65 @@
 from aiogram import Router, F, types
 from aiogram.filters import Command
-from aiogram.types import FSInputFile
-from config import ALLOWED_IDS
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.state import State, StatesGroup
+from aiogram.types import BufferedInputFile
+from config import ALLOWED_IDS, ADMIN_IDS
 from utils.state import get_nested_value, set_nested_value
 from utils.validators import validate_field
-from utils.file_utils import generate_files, load_templates
-from keyboards import templates_kb, confirm_kb, table_row_kb, select_kb, bool_kb
-import json
+from utils.file_utils import load_templates, load_packages, get_template_entry, template_registry
+from utils.packages import package_fields
+from utils.table_input import (
+    looks_like_table, parse_text_rows, parse_table_file, check_table_file, validate_rows, MAX_ROWS, MAX_FILE_SIZE,
+)
+from utils.jobs import generation_queue, QueueLimitError, PRIORITY_HIGH, PRIORITY_NORMAL
+from utils.preview import prepared_documents
+from utils.profiles import profile_store, extract_profile, profile_name, apply_profile
+from keyboards import (
+    templates_kb, confirm_kb, table_row_kb, select_kb, bool_kb, keep_value_kb, profile_pick_kb, profiles_kb,
+)
+from copy import deepcopy
+from datetime import datetime
+import asyncio
+import io
+import logging
 
 router = Router()
-user_states = {}
+logger = logging.getLogger(__name__)
+
+# ссылки на фоновые задачи, чтобы их не собрал сборщик мусора
+_background_tasks = set()
+
+
+class WizardForm(StatesGroup):
+    filling = State()
+
+
+def wizard_fields(data):
+    """Поля шаблона в той версии, с которой начат мастер (шаблон мог обновиться на лету).
+    Для пакета — общий список полей всех его шаблонов."""
+    if data.get("package"):
+        return package_fields(data["package"]["templates"])
+    return get_template_entry(data["template"], data.get("template_version"))["config"]["fields"]
+
+
+def with_wizard_data(handler):
+    """Передаёт обработчику данные мастера из FSM-хранилища и сохраняет их после обработки.
+    Обработчик меняет data на месте; очистка data завершает мастер.
+    Чтение-изменение-запись не гонится с соседними апдейтами того же пользователя:
+    диспетчер обрабатывает их по очереди (events_isolation, см. utils.storage).
+    """
+    async def wrapper(event, state: FSMContext):
+        data = await state.get_data()
+        snapshot = deepcopy(data)
+        try:
+            await handler(event, state, data)
+        finally:
+            # пишем в хранилище только если что-то изменилось
+            if data != snapshot:
+                await state.set_data(data)
+
+    wrapper.__name__ = handler.__name__
+    return wrapper
 
 @router.message(Command("start"))
 async def start_handler(message: types.Message):
@@ -17,58 +67,114 @@ async def start_handler(message: types.Message):
         await message.answer("🚫 У вас нет доступа к боту")
         return
 
-    kb = templates_kb(load_templates())
+    kb = templates_kb(load_templates(), load_packages())
     await message.reply("📄 Выберите шаблон:", reply_markup=kb)
 
 @router.callback_query(F.data.startswith("template:"))
-async def template_select_handler(callback: types.CallbackQuery):
+@with_wizard_data
+async def template_select_handler(callback: types.CallbackQuery, state: FSMContext, data: dict):
     if callback.from_user.id not in ALLOWED_IDS:
         await callback.answer("🚫 Нет доступа", show_alert=True)
         return
 
     slug = callback.data.split(":")[1]
-    user_states[callback.from_user.id] = {
+    try:
+        version_id = get_template_entry(slug)["version_id"]
+    except FileNotFoundError:
+        await callback.answer("❌ Шаблон не найден", show_alert=True)
+        return
+    await start_wizard(callback, state, data, slug, version_id)
+
+
+@router.callback_query(F.data.startswith("package:"))
+@with_wizard_data
+async def package_select_handler(callback: types.CallbackQuery, state: FSMContext, data: dict):
+    if callback.from_user.id not in ALLOWED_IDS:
+        await callback.answer("🚫 Нет доступа", show_alert=True)
+        return
+
+    package = template_registry.snapshot.packages.get(callback.data.split(":", 1)[1])
+    if package is None:
+        await callback.answer("❌ Пакет не найден", show_alert=True)
+        return
+    # версии всех шаблонов пакета фиксируются на старте мастера
+    versions = {slug: get_template_entry(slug)["version_id"] for slug in package["templates"]}
+    first = package["templates"][0]
+    await start_wizard(
+        callback, state, data, first, versions[first],
+        package={"id": package["id"], "name": package["name"], "templates": versions},
+    )
+
+
+async def start_wizard(callback, state, data, slug, version_id, package=None):
+    prepared_documents.discard(callback.from_user.id)
+    data.clear()
+    data.update({
         "template": slug,
+        "template_version": version_id,
+        "package": package,
         "fields": {},
         "step": 0,
         "array": None,  # прогресс заполнения массива (таблицы)
-    }
-    await ask_next_field(callback.from_user.id, callback.message)
+    })
+    await state.set_state(WizardForm.filling)
+    if await profile_store.search(callback.from_user.id, limit=1):
+        await callback.message.answer(
+            "👤 Данные можно заполнить из сохранённого профиля:", reply_markup=profile_pick_kb()
+        )
+    await ask_next_field(data, callback.message)
     await callback.answer()
 
-async def ask_next_field(user_id, message):
-    state = user_states[user_id]
-    slug = state["template"]
-
-    import json
-    with open(f"templates/{slug}/fields.json", "r", encoding="utf-8") as f:
-        template = json.load(f)
-    fields = template["fields"]
-
-    if state["step"] >= len(fields):
-        preview = "\n".join([f"{f['label']}: {get_nested_value(state['fields'], f['key'])}" for f in fields])
-        await message.answer(f"Предпросмотр:\n{preview}", reply_markup=confirm_kb())
+async def ask_next_field(data, message):
+    slug = data["template"]
+    fields = wizard_fields(data)
+
+    user_id = message.chat.id
+    if data["step"] >= len(fields):
+        # последний ответ получен: документ начинает готовиться ещё до отправки предпросмотра
+        # (пакеты рендерятся только после подтверждения)
+        prepared, started = None, False
+        if not data.get("package"):
+            prepared, started = prepared_documents.start(
+                user_id, slug, deepcopy(data["fields"]), data.get("template_version")
+            )
+        preview = "\n".join([f"{f['label']}: {get_nested_value(data['fields'], f['key'])}" for f in fields])
+        can_save = bool(extract_profile(fields, data["fields"]))
+        await message.answer(f"Предпросмотр:\n{preview}", reply_markup=confirm_kb(save_profile=can_save))
+        if started:
+            task = asyncio.create_task(send_preview_image(message, prepared))
+            _background_tasks.add(task)
+            task.add_done_callback(_background_tasks.discard)
         return
+    # мастер снова на незаполненном поле — заготовка устарела
+    prepared_documents.discard(user_id)
 
-    f = fields[state["step"]]
+    f = fields[data["step"]]
     # обработка массива (табличных строк)
     if f.get("type") == "array":
         items = f.get("items") or f.get("item_fields")
         if not items or not isinstance(items, list):
             await message.answer("⚠️ Ошибка конфигурации: для array требуется items[]")
-            state["step"] += 1
-            await ask_next_field(user_id, message)
+            data["step"] += 1
+            await ask_next_field(data, message)
             return
         # инициализируем прогресс массива, если ещё нет
-        if not state.get("array") or state["array"].get("field_key") != f["key"]:
-            state["array"] = {
+        if not data.get("array") or data["array"].get("field_key") != f["key"]:
+            data["array"] = {
                 "field_key": f["key"],
                 "items": items,
                 "rows": [],
                 "row_index": 0,
                 "col_index": 0,
             }
-        arr = state["array"]
+        arr = data["array"]
+        if arr["row_index"] == 0 and arr["col_index"] == 0 and not arr["rows"]:
+            columns = " | ".join(c["label"] for c in arr["items"])
+            await message.answer(
+                f"💡 Таблицу «{f['label']}» можно отправить целиком: одна строка таблицы на строку "
+                f"сообщения, колонки через Tab или «;», либо файлом CSV/XLSX (до {MAX_ROWS} строк).\n"
+                f"Порядок колонок: {columns}\n\nИли заполняйте по одной ячейке:"
+            )
         col = arr["items"][arr["col_index"]]
         prompt = f"{f['label']} → Строка {arr['row_index'] + 1}. {col['label']} (пример: {col.get('placeholder','')})"
         # Поддержка select/bool внутри массивов
@@ -81,44 +187,134 @@ async def ask_next_field(user_id, message):
         await message.answer(prompt)
         return
 
-    # обычное поле
+    # обычное поле; значение из профиля показывается как подсказка, его можно заменить
     required_mark = " (обязательно)" if f.get("required") else ""
     prompt = f"{f['label']}{required_mark} (пример: {f.get('placeholder','')})"
+    current = get_nested_value(data["fields"], f["key"])
+    keep = current not in (None, "")
+    if keep:
+        prompt += f"\nСейчас: {current}"
     if f.get("type") == "select" and isinstance(f.get("options"), list) and f.get("options"):
-        await message.answer(prompt, reply_markup=select_kb(f["options"]))
+        await message.answer(prompt, reply_markup=select_kb(f["options"], keep=keep))
         return
     if f.get("type") == "bool":
-        await message.answer(prompt, reply_markup=bool_kb())
+        await message.answer(prompt, reply_markup=bool_kb(keep=keep))
+        return
+    await message.answer(prompt, reply_markup=keep_value_kb() if keep else None)
+
+async def send_preview_image(message, prepared):
+    """Отправляет картинку первой страницы, когда фоновая подготовка документа закончится."""
+    try:
+        _, _, png_bytes = await prepared.task
+    except asyncio.CancelledError:
+        return
+    except Exception as e:
+        logger.warning("Background preview for %s failed: %s", prepared.template_slug, e)
+        return
+    if png_bytes:
+        await message.answer_photo(
+            BufferedInputFile(png_bytes, filename="preview.png"),
+            caption="🖼 Первая страница документа",
+        )
+
+
+async def apply_bulk_rows(data, f, raw_rows, message):
+    """Добавляет в массив сразу много строк (вставка/файл) и переходит к следующему полю."""
+    arr = data["array"]
+    rows, errors = validate_rows(raw_rows, arr["items"], limit=MAX_ROWS - len(arr["rows"]))
+    if errors:
+        shown = "\n".join(errors[:20])
+        more = f"\n…и ещё {len(errors) - 20}" if len(errors) > 20 else ""
+        await message.reply(f"⚠️ Таблица не принята:\n{shown}{more}\n\nИсправьте и отправьте снова.")
         return
-    await message.answer(prompt)
+    arr["rows"].extend(rows)
+    set_nested_value(data["fields"], f["key"], arr["rows"])
+    data["array"] = None
+    data["step"] += 1
+    await message.answer(f"✅ Добавлено строк: {len(rows)}")
+    await ask_next_field(data, message)
+
+
+@router.message(WizardForm.filling, Command("profile"))
+@with_wizard_data
+async def use_profile_handler(message: types.Message, state: FSMContext, data: dict):
+    """/profile <id> — приходит из inline-поиска профилей, заполняет поля одним шагом."""
+    if not data.get("template"):
+        return
+    parts = (message.text or "").split()
+    profile = None
+    if len(parts) > 1 and parts[1].isdigit():
+        profile = await profile_store.get(message.from_user.id, int(parts[1]))
+    if profile is None:
+        await message.reply("Профиль не найден.")
+        return
+    fields = wizard_fields(data)
+    filled = apply_profile(fields, data["fields"], profile["data"])
+    await message.answer(f"✅ Из профиля «{profile['name']}» заполнено полей: {filled}")
+    await ask_next_field(data, message)
+
 
-@router.message()
-async def handle_answer(message: types.Message):
-    user_id = message.from_user.id
-    if user_id not in user_states:
+@router.message(WizardForm.filling, F.document)
+@with_wizard_data
+async def handle_table_file(message: types.Message, state: FSMContext, data: dict):
+    if not data.get("template"):
+        return
+    fields = wizard_fields(data)
+    if data["step"] >= len(fields):
+        return
+    f = fields[data["step"]]
+    arr = data.get("array")
+    if not arr or arr.get("field_key") != f["key"] or arr["col_index"] != 0:
+        await message.reply("Файл можно прислать только в начале заполнения таблицы.")
         return
 
-    state = user_states[user_id]
-    slug = state["template"]
+    doc = message.document
+    try:
+        check_table_file(doc.file_name)
+    except ValueError as e:
+        await message.reply(f"⚠️ {e}")
+        return
+    if doc.file_size and doc.file_size > MAX_FILE_SIZE:
+        await message.reply(f"⚠️ Файл слишком большой (максимум {MAX_FILE_SIZE // 1024} КБ).")
+        return
 
-    with open(f"templates/{slug}/fields.json", "r", encoding="utf-8") as f:
-        template = json.load(f)
+    buf = io.BytesIO()
+    await message.bot.download(doc, destination=buf)
+    try:
+        # openpyxl и csv — синхронные, разбор не должен блокировать цикл событий
+        raw_rows = await asyncio.to_thread(parse_table_file, doc.file_name, buf.getvalue())
+    except Exception:
+        logger.exception("Не удалось разобрать таблицу %r", doc.file_name)
+        await message.reply("⚠️ Не удалось прочитать файл. Проверьте, что это CSV или XLSX с таблицей.")
+        return
+    await apply_bulk_rows(data, f, raw_rows, message)
+
+
+@router.message(WizardForm.filling)
+@with_wizard_data
+async def handle_answer(message: types.Message, state: FSMContext, data: dict):
+    if not data.get("template"):
+        return
 
-    fields = template["fields"]
+    fields = wizard_fields(data)
 
     # если все поля уже пройдены
-    if state["step"] >= len(fields):
-        await ask_next_field(user_id, message)
+    if data["step"] >= len(fields):
+        await ask_next_field(data, message)
         return
 
-    f = fields[state["step"]]
+    f = fields[data["step"]]
 
     # если сейчас заполняется массив
-    if state.get("array") and state["array"].get("field_key") == f["key"]:
-        arr = state["array"]
+    if data.get("array") and data["array"].get("field_key") == f["key"]:
+        arr = data["array"]
         items = arr["items"]
         col = items[arr["col_index"]]
         text = (message.text or "").strip()
+        # вся таблица одним сообщением
+        if arr["col_index"] == 0 and looks_like_table(text, items):
+            await apply_bulk_rows(data, f, parse_text_rows(text), message)
+            return
         # Особая обработка select/bool как текстовый ввод (fallback)
         if col.get("type") == "select" and isinstance(col.get("options"), list) and col.get("options"):
             if text in col["options"]:
@@ -181,7 +377,7 @@ async def handle_answer(message: types.Message):
         if text not in f["options"]:
             await message.reply("Пожалуйста, выберите вариант с кнопок.")
             return
-        set_nested_value(state["fields"], f["key"], text)
+        set_nested_value(data["fields"], f["key"], text)
     elif f.get("type") == "bool":
         t = text.lower()
         if t in {"да","yes","y","true","1","д"}:
@@ -191,63 +387,168 @@ async def handle_answer(message: types.Message):
         else:
             await message.reply("Пожалуйста, выберите 'Да' или 'Нет' с кнопок.")
             return
-        set_nested_value(state["fields"], f["key"], val)
+        set_nested_value(data["fields"], f["key"], val)
     else:
         if not validate_field(text, f["type"]):
             await message.reply("⚠️ Неверный формат, попробуйте снова.")
             return
-        set_nested_value(state["fields"], f["key"], text)
+        set_nested_value(data["fields"], f["key"], text)
 
-    state["step"] += 1
-    await ask_next_field(user_id, message)
+    data["step"] += 1
+    await ask_next_field(data, message)
 
 
 @router.callback_query(F.data == "confirm")
-async def confirm_handler(callback: types.CallbackQuery):
+@with_wizard_data
+async def confirm_handler(callback: types.CallbackQuery, state: FSMContext, data: dict):
     user_id = callback.from_user.id
-    if user_id not in user_states or user_id not in ALLOWED_IDS:
+    if not data.get("template") or user_id not in ALLOWED_IDS:
         await callback.answer("🚫 Нет доступа", show_alert=True)
         return
 
-    state = user_states[user_id]
-    docx_path, pdf_path = generate_files(state["template"], state["fields"])
+    slug = data["template"]
+    message = callback.message
+    package = data.get("package")
+    priority = PRIORITY_HIGH if user_id in ADMIN_IDS else PRIORITY_NORMAL
+
+    if package:
+        async def deliver_package(zip_bytes):
+            ts = datetime.now().strftime("%Y%m%d_%H%M")
+            await message.answer_document(BufferedInputFile(zip_bytes, filename=f"{package['id']}_{ts}.zip"))
+
+        try:
+            await generation_queue.submit(
+                message, user_id, package["id"], deepcopy(data["fields"]), deliver_package,
+                priority=priority, package=package["templates"],
+            )
+        except QueueLimitError:
+            await callback.answer("⏳ Дождитесь завершения предыдущей генерации", show_alert=True)
+            return
+        await message.edit_reply_markup(reply_markup=None)
+        await callback.answer()
+        data.clear()
+        await state.clear()
+        return
 
-    # Понятные имена файлов при отправке
-    from datetime import datetime
-    ts = datetime.now().strftime("%Y%m%d_%H%M")
-    slug = state["template"]
-    docx_name = f"{slug}_{ts}.docx"
-    pdf_name = f"{slug}_{ts}.pdf"
+    async def deliver(docx_bytes, pdf_bytes):
+        # Понятные имена файлов при отправке
+        ts = datetime.now().strftime("%Y%m%d_%H%M")
+        docx_name = f"{slug}_{ts}.docx"
+        pdf_name = f"{slug}_{ts}.pdf"
+        await message.answer_document(BufferedInputFile(docx_bytes, filename=docx_name))
+        if pdf_bytes:
+            await message.answer_document(BufferedInputFile(pdf_bytes, filename=pdf_name))
 
-    await callback.message.answer_document(FSInputFile(docx_path, filename=docx_name))
-    if pdf_path and isinstance(pdf_path, str):
-        await callback.message.answer_document(FSInputFile(pdf_path, filename=pdf_name))
+    try:
+        await generation_queue.submit(
+            message, user_id, slug, deepcopy(data["fields"]), deliver, priority=priority,
+            template_version=data.get("template_version"),
+            prepared=prepared_documents.get(user_id, slug, data["fields"], data.get("template_version")),
+        )
+    except QueueLimitError:
+        await callback.answer("⏳ Дождитесь завершения предыдущей генерации", show_alert=True)
+        return
+    prepared_documents.release(user_id)
 
-    import os
-    os.remove(docx_path)
-    if pdf_path and os.path.exists(pdf_path):
-        os.remove(pdf_path)
+    await message.edit_reply_markup(reply_markup=None)
+    await callback.answer()
+    data.clear()
+    await state.clear()
 
-    await callback.message.answer("✅ Файлы сгенерированы и отправлены.")
-    del user_states[user_id]
+
+@router.callback_query(F.data == "profile:save")
+@with_wizard_data
+async def save_profile_handler(callback: types.CallbackQuery, state: FSMContext, data: dict):
+    user_id = callback.from_user.id
+    if not data.get("template") or user_id not in ALLOWED_IDS:
+        await callback.answer("🚫 Нет доступа", show_alert=True)
+        return
+    fields = wizard_fields(data)
+    profile = extract_profile(fields, data["fields"])
+    name = profile_name(profile)
+    if not name:
+        await callback.answer("Нечего сохранять", show_alert=True)
+        return
+    await profile_store.save(user_id, name, profile)
+    await callback.answer(f"💾 Профиль «{name}» сохранён")
+
+
+@router.message(Command("profiles"))
+async def profiles_handler(message: types.Message):
+    if message.from_user.id not in ALLOWED_IDS:
+        await message.answer("🚫 У вас нет доступа к боту")
+        return
+    profiles = await profile_store.search(message.from_user.id, limit=50)
+    if not profiles:
+        await message.answer("Сохранённых профилей нет. Профиль сохраняется кнопкой на шаге предпросмотра.")
+        return
+    await message.answer("👤 Ваши профили (нажмите, чтобы удалить):", reply_markup=profiles_kb(profiles))
+
+
+@router.callback_query(F.data.startswith("profile:del:"))
+async def delete_profile_handler(callback: types.CallbackQuery):
+    try:
+        profile_id = int(callback.data.rsplit(":", 1)[1])
+    except ValueError:
+        await callback.answer()
+        return
+    user_id = callback.from_user.id
+    if not await profile_store.delete(user_id, profile_id):
+        await callback.answer("Профиль не найден", show_alert=True)
+        return
+    profiles = await profile_store.search(user_id, limit=50)
+    if profiles:
+        await callback.message.edit_reply_markup(reply_markup=profiles_kb(profiles))
+    else:
+        await callback.message.edit_text("Сохранённых профилей нет.")
+    await callback.answer("Удалено")
+
+
+@router.inline_query()
+async def profile_inline_query(query: types.InlineQuery):
+    """Автодополнение профилей: поиск по началу имени."""
+    if query.from_user.id not in ALLOWED_IDS:
+        await query.answer([], cache_time=60, is_personal=True)
+        return
+    profiles = await profile_store.search(query.from_user.id, query.query.strip())
+    results = [
+        types.InlineQueryResultArticle(
+            id=str(p["id"]),
+            title=p["name"],
+            description=", ".join(str(v) for k, v in p["data"].items() if v != p["name"])[:100],
+            input_message_content=types.InputTextMessageContent(message_text=f"/profile {p['id']}"),
+        )
+        for p in profiles
+    ]
+    await query.answer(results, cache_time=1, is_personal=True)
+
+
+@router.callback_query(F.data.startswith("job:cancel:"))
+async def cancel_job_handler(callback: types.CallbackQuery):
+    try:
+        job_id = int(callback.data.rsplit(":", 1)[1])
+    except ValueError:
+        await callback.answer()
+        return
+    if await generation_queue.cancel(job_id, callback.from_user.id):
+        await callback.answer("Отменено")
+    else:
+        await callback.answer("Задание уже выполнено или не найдено", show_alert=True)
 
 
 @router.callback_query(F.data.startswith("opt:"))
-async def select_option(callback: types.CallbackQuery):
+@with_wizard_data
+async def select_option(callback: types.CallbackQuery, state: FSMContext, data: dict):
     user_id = callback.from_user.id
-    if user_id not in user_states or user_id not in ALLOWED_IDS:
+    if not data.get("template") or user_id not in ALLOWED_IDS:
         await callback.answer("🚫 Нет доступа", show_alert=True)
         return
 
-    state = user_states[user_id]
-    slug = state["template"]
-    with open(f"templates/{slug}/fields.json", "r", encoding="utf-8") as f:
-        template = json.load(f)
-    fields = template["fields"]
-    if state["step"] >= len(fields):
+    fields = wizard_fields(data)
+    if data["step"] >= len(fields):
         await callback.answer()
         return
-    f = fields[state["step"]]
+    f = fields[data["step"]]
 
     # Индекс выбранной опции
     try:
@@ -257,8 +558,8 @@ async def select_option(callback: types.CallbackQuery):
         return
 
     # Массив (таблица) в процессе?
-    if state.get("array") and state["array"].get("field_key") == f.get("key"):
-        arr = state["array"]
+    if data.get("array") and data["array"].get("field_key") == f.get("key"):
+        arr = data["array"]
         items = arr["items"]
         col = items[arr["col_index"]]
         options = col.get("options") or []
@@ -293,36 +594,33 @@ async def select_option(callback: types.CallbackQuery):
     if not isinstance(options, list) or idx < 0 or idx >= len(options):
         await callback.answer("Некорректный выбор", show_alert=True)
         return
-    set_nested_value(state["fields"], f["key"], options[idx])
-    state["step"] += 1
+    set_nested_value(data["fields"], f["key"], options[idx])
+    data["step"] += 1
     await callback.message.edit_reply_markup(reply_markup=None)
-    await ask_next_field(user_id, callback.message)
+    await ask_next_field(data, callback.message)
     await callback.answer("Выбрано")
 
 
 @router.callback_query(F.data.startswith("bool:"))
-async def choose_bool(callback: types.CallbackQuery):
+@with_wizard_data
+async def choose_bool(callback: types.CallbackQuery, state: FSMContext, data: dict):
     user_id = callback.from_user.id
-    if user_id not in user_states or user_id not in ALLOWED_IDS:
+    if not data.get("template") or user_id not in ALLOWED_IDS:
         await callback.answer("🚫 Нет доступа", show_alert=True)
         return
 
-    state = user_states[user_id]
-    slug = state["template"]
-    with open(f"templates/{slug}/fields.json", "r", encoding="utf-8") as f:
-        template = json.load(f)
-    fields = template["fields"]
-    if state["step"] >= len(fields):
+    fields = wizard_fields(data)
+    if data["step"] >= len(fields):
         await callback.answer()
         return
-    f = fields[state["step"]]
+    f = fields[data["step"]]
 
     val_token = callback.data.split(":", 1)[1]
     value = "Да" if val_token == "1" else "Нет"
 
     # Массив (таблица) в процессе?
-    if state.get("array") and state["array"].get("field_key") == f.get("key"):
-        arr = state["array"]
+    if data.get("array") and data["array"].get("field_key") == f.get("key"):
+        arr = data["array"]
         items = arr["items"]
         col = items[arr["col_index"]]
         if arr.get("current_row") is None:
@@ -348,30 +646,50 @@ async def choose_bool(callback: types.CallbackQuery):
         return
 
     # Обычное поле bool
-    set_nested_value(state["fields"], f["key"], value)
-    state["step"] += 1
+    set_nested_value(data["fields"], f["key"], value)
+    data["step"] += 1
     await callback.message.edit_reply_markup(reply_markup=None)
-    await ask_next_field(user_id, callback.message)
+    await ask_next_field(data, callback.message)
     await callback.answer("Выбрано")
 
 
+@router.callback_query(F.data == "field:keep")
+@with_wizard_data
+async def keep_value(callback: types.CallbackQuery, state: FSMContext, data: dict):
+    """Оставляет значение поля, заполненное из профиля, и переходит к следующему."""
+    user_id = callback.from_user.id
+    if not data.get("template") or user_id not in ALLOWED_IDS:
+        await callback.answer("🚫 Нет доступа", show_alert=True)
+        return
+
+    fields = wizard_fields(data)
+    if data["step"] >= len(fields):
+        await callback.answer()
+        return
+    f = fields[data["step"]]
+    if f.get("type") == "array" or get_nested_value(data["fields"], f["key"]) in (None, ""):
+        await callback.answer()
+        return
+    data["step"] += 1
+    await callback.message.edit_reply_markup(reply_markup=None)
+    await ask_next_field(data, callback.message)
+    await callback.answer()
+
+
 @router.callback_query(F.data.in_({"row:add", "row:done"}))
-async def rows_control(callback: types.CallbackQuery):
+@with_wizard_data
+async def rows_control(callback: types.CallbackQuery, state: FSMContext, data: dict):
     user_id = callback.from_user.id
-    if user_id not in user_states or user_id not in ALLOWED_IDS:
+    if not data.get("template") or user_id not in ALLOWED_IDS:
         await callback.answer("🚫 Нет доступа", show_alert=True)
         return
 
-    state = user_states[user_id]
-    slug = state["template"]
-    with open(f"templates/{slug}/fields.json", "r", encoding="utf-8") as f:
-        template = json.load(f)
-    fields = template["fields"]
-    if state["step"] >= len(fields):
+    fields = wizard_fields(data)
+    if data["step"] >= len(fields):
         await callback.answer()
         return
-    f = fields[state["step"]]
-    arr = state.get("array")
+    f = fields[data["step"]]
+    arr = data.get("array")
     if not arr or arr.get("field_key") != f.get("key"):
         await callback.answer()
         return
@@ -387,11 +705,11 @@ async def rows_control(callback: types.CallbackQuery):
             arr["current_row"] = None
         # Сохранить массив в итоговые поля и продолжить
         print(f"[DEBUG] Сохраняем массив с {len(arr['rows'])} строками для поля {f['key']}")
-        set_nested_value(state["fields"], f["key"], arr["rows"])
-        state["array"] = None
-        state["step"] += 1
+        set_nested_value(data["fields"], f["key"], arr["rows"])
+        data["array"] = None
+        data["step"] += 1
         await callback.message.edit_reply_markup(reply_markup=None)
-        await ask_next_field(user_id, callback.message)
+        await ask_next_field(data, callback.message)
         await callback.answer("Готово")
         return
 
@@ -408,11 +726,11 @@ async def rows_control(callback: types.CallbackQuery):
                 arr["rows"].append(arr["current_row"])
                 arr["current_row"] = None
             # как будто нажали done
-            set_nested_value(state["fields"], f["key"], arr["rows"])
-            state["array"] = None
-            state["step"] += 1
+            set_nested_value(data["fields"], f["key"], arr["rows"])
+            data["array"] = None
+            data["step"] += 1
             await callback.message.edit_reply_markup(reply_markup=None)
-            await ask_next_field(user_id, callback.message)
+            await ask_next_field(data, callback.message)
             return
         # Зафиксировать предыдущую строку
         if arr.get("current_row") and len(arr["current_row"]) == len(arr["items"]):
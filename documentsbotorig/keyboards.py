@@ -13,16 +13,20 @@ def admin_menu_kb(enabled):
         ]
     )
 
-def confirm_kb():
-    return InlineKeyboardMarkup(
-        inline_keyboard=[[InlineKeyboardButton(text="✅ Подтвердить", callback_data="confirm")]]
-    )
+def confirm_kb(save_profile=False):
+    rows = [[InlineKeyboardButton(text="✅ Подтвердить", callback_data="confirm")]]
+    if save_profile:
+        rows.append([InlineKeyboardButton(text="💾 Сохранить профиль", callback_data="profile:save")])
+    return InlineKeyboardMarkup(inline_keyboard=rows)
 
-def templates_kb(templates):
+def templates_kb(templates, packages=()):
     return InlineKeyboardMarkup(
         inline_keyboard=[
             [InlineKeyboardButton(text=t['name'], callback_data=f"template:{t['slug']}")]
             for t in templates
+        ] + [
+            [InlineKeyboardButton(text=f"📦 {p['name']}", callback_data=f"package:{p['id']}")]
+            for p in packages
         ]
     )
 
@@ -38,17 +42,22 @@ def table_row_kb():
     )
 
 
-def select_kb(options):
-    """Клавиатура для выбора значения из списка (type=select)."""
+def _keep_row(keep):
+    return [[InlineKeyboardButton(text="↩️ Оставить как есть", callback_data="field:keep")]] if keep else []
+
+
+def select_kb(options, keep=False):
+    """Клавиатура для выбора значения из списка (type=select).
+    keep — добавить кнопку, оставляющую уже заполненное значение."""
     return InlineKeyboardMarkup(
         inline_keyboard=[
             [InlineKeyboardButton(text=str(opt), callback_data=f"opt:{i}")]
             for i, opt in enumerate(options)
-        ]
+        ] + _keep_row(keep)
     )
 
 
-def bool_kb():
+def bool_kb(keep=False):
     """Клавиатура для булевых значений (Да/Нет)."""
     return InlineKeyboardMarkup(
         inline_keyboard=[
@@ -56,5 +65,34 @@ def bool_kb():
                 InlineKeyboardButton(text="Да", callback_data="bool:1"),
                 InlineKeyboardButton(text="Нет", callback_data="bool:0"),
             ]
+        ] + _keep_row(keep)
+    )
+
+
+def keep_value_kb():
+    """Кнопка «оставить» для поля, уже заполненного из профиля."""
+    return InlineKeyboardMarkup(inline_keyboard=_keep_row(True))
+
+
+def job_cancel_kb(job_id):
+    """Кнопка отмены задания генерации."""
+    return InlineKeyboardMarkup(
+        inline_keyboard=[[InlineKeyboardButton(text="✖️ Отменить", callback_data=f"job:cancel:{job_id}")]]
+    )
+
+
+def profile_pick_kb():
+    """Кнопка поиска сохранённого профиля (inline-режим в текущем чате)."""
+    return InlineKeyboardMarkup(
+        inline_keyboard=[[InlineKeyboardButton(text="👤 Выбрать профиль", switch_inline_query_current_chat="")]]
+    )
+
+
+def profiles_kb(profiles):
+    """Список профилей с кнопками удаления."""
+    return InlineKeyboardMarkup(
+        inline_keyboard=[
+            [InlineKeyboardButton(text=f"🗑 {p['name']}", callback_data=f"profile:del:{p['id']}")]
+            for p in profiles
         ]
     )
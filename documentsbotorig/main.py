@@ -1,14 +1,29 @@
 import asyncio
+import logging
 from aiogram import Bot, Dispatcher
 from config import BOT_TOKEN
 from handlers import admin, user
+from utils.jobs import generation_queue
+from utils.sandbox import sandbox_pool
+from utils.storage import create_storage, create_event_isolation
+from utils.file_utils import preload_templates, template_registry
 bot = Bot(token=BOT_TOKEN)
-dp = Dispatcher()
+storage = create_storage()
+dp = Dispatcher(storage=storage, events_isolation=create_event_isolation(storage))
 
 dp.include_router(admin.router)
 dp.include_router(user.router)
 
+dp.startup.register(preload_templates)
+dp.startup.register(template_registry.start_watching)
+dp.startup.register(sandbox_pool.start)
+dp.startup.register(generation_queue.start)
+dp.shutdown.register(generation_queue.stop)
+dp.shutdown.register(sandbox_pool.stop)
+dp.shutdown.register(template_registry.stop_watching)
+
 if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
     try:
         asyncio.run(dp.start_polling(bot))
     except KeyboardInterrupt:
@@ -0,0 +1,214 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Бенчмарк генерации документов по фазам: render (Jinja), inject_tables, save, convert_pdf.
+
+    python scripts/benchmark.py                         # все включённые шаблоны, 1/10/50 строк
+    python scripts/benchmark.py -t add_agreement_OOO --rows 1 50 -n 5
+    python scripts/benchmark.py --no-pdf --compare benchmarks/abc1234.json
+
+Каждый случай (шаблон × число строк) выполняется в отдельном процессе, чтобы пиковый
+RSS относился только к нему. Отчёт пишется в benchmarks/<commit>.json и .md;
+с --compare в markdown добавляется колонка изменения относительно прошлого отчёта.
+"""
+import argparse
+import contextlib
+import io
+import json
+import multiprocessing
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from utils.file_utils import (
+    TEMPLATES_DIR, get_template_entry, render_template, build_tables, save_docx, convert_to_pdf,
+)
+
+PHASES = ["render", "inject_tables", "save", "convert_pdf"]
+
+SAMPLE_VALUES = {
+    "number": "12345",
+    "date": "01.01.2025",
+    "email": "test@example.com",
+    "phone": "+79990000000",
+    "bool": "Да",
+}
+
+
+def _sample_value(field, n=0):
+    options = field.get("options")
+    if field.get("type") == "select" and isinstance(options, list) and options:
+        return options[n % len(options)]
+    if field.get("type") in SAMPLE_VALUES:
+        return SAMPLE_VALUES[field["type"]]
+    return f"{field.get('label', field.get('key'))} {n + 1}"
+
+
+def synthetic_context(cfg, rows):
+    """Контекст с заполненными полями и `rows` строками в каждом массиве."""
+    ctx = {}
+    for f in cfg.get("fields", []):
+        if f.get("type") == "array":
+            items = f.get("items") or f.get("item_fields") or []
+            ctx[f["key"]] = [{i["key"]: _sample_value(i, n) for i in items} for n in range(rows)]
+        else:
+            ctx[f["key"]] = _sample_value(f)
+    return ctx
+
+
+def _peak_rss_mb():
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux — КБ, macOS — байты
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def run_case(args):
+    """Выполняется в отдельном процессе: repeats прогонов одного случая."""
+    slug, rows, repeats, with_pdf = args
+    entry = get_template_entry(slug)
+    ctx = synthetic_context(entry["config"], rows)
+    timings = {p: [] for p in PHASES}
+    docx_size = pdf_size = None
+    for _ in range(repeats):
+        with contextlib.redirect_stdout(io.StringIO()):
+            t0 = time.perf_counter()
+            entry, doc = render_template(slug, ctx)
+            t1 = time.perf_counter()
+            build_tables(doc, entry, ctx)
+            t2 = time.perf_counter()
+            docx_bytes = save_docx(doc)
+            t3 = time.perf_counter()
+            pdf_bytes = convert_to_pdf(docx_bytes, slug) if with_pdf else None
+            t4 = time.perf_counter()
+        timings["render"].append(t1 - t0)
+        timings["inject_tables"].append(t2 - t1)
+        timings["save"].append(t3 - t2)
+        if with_pdf and pdf_bytes is not None:
+            timings["convert_pdf"].append(t4 - t3)
+        docx_size = len(docx_bytes)
+        pdf_size = len(pdf_bytes) if pdf_bytes else None
+
+    phases = {}
+    for phase, values in timings.items():
+        if values:
+            phases[phase] = {
+                "median_ms": round(statistics.median(values) * 1000, 2),
+                "min_ms": round(min(values) * 1000, 2),
+            }
+    return {
+        "template": slug,
+        "rows": rows,
+        "phases": phases,
+        "total_ms": round(sum(p["median_ms"] for p in phases.values()), 2),
+        "peak_rss_mb": _peak_rss_mb(),
+        "docx_bytes": docx_size,
+        "pdf_bytes": pdf_size,
+    }
+
+
+def _git_commit():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, stderr=subprocess.DEVNULL, text=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def _enabled_templates():
+    path = ROOT / "enabled.json"
+    enabled = json.loads(path.read_text(encoding="utf-8")) if path.exists() else {}
+    return sorted(slug for slug, flag in enabled.items() if flag and (TEMPLATES_DIR / slug).is_dir())
+
+
+def to_markdown(report, baseline=None):
+    base = {}
+    if baseline:
+        base = {(r["template"], r["rows"]): r for r in baseline["results"]}
+    meta = report["meta"]
+    lines = [
+        f"# Benchmark {meta['commit']} ({meta['date']})",
+        "",
+        f"python {meta['python']}, repeats={meta['repeats']}, median ms"
+        + (f", compared to {baseline['meta']['commit']}" if baseline else ""),
+        "",
+    ]
+    header = ["template", "rows", *PHASES, "total", "peak RSS MB"]
+    if baseline:
+        header.append("Δ total")
+    lines.append("| " + " | ".join(header) + " |")
+    lines.append("|" + "---|" * len(header))
+    for r in report["results"]:
+        cells = [r["template"], str(r["rows"])]
+        cells += [str(r["phases"].get(p, {}).get("median_ms", "—")) for p in PHASES]
+        cells += [str(r["total_ms"]), str(r["peak_rss_mb"] if r["peak_rss_mb"] is not None else "—")]
+        if baseline:
+            old = base.get((r["template"], r["rows"]))
+            if old and old["total_ms"]:
+                cells.append(f"{(r['total_ms'] - old['total_ms']) / old['total_ms'] * 100:+.1f}%")
+            else:
+                cells.append("—")
+        lines.append("| " + " | ".join(cells) + " |")
+    return "\n".join(lines) + "\n"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк генерации документов")
+    parser.add_argument("-t", "--templates", nargs="*", help="шаблоны (по умолчанию включённые)")
+    parser.add_argument("--rows", nargs="*", type=int, default=[1, 10, 50])
+    parser.add_argument("-n", "--repeats", type=int, default=3)
+    parser.add_argument("--no-pdf", action="store_true", help="не замерять конвертацию в PDF")
+    parser.add_argument("--out", default=str(ROOT / "benchmarks"), help="папка для отчётов")
+    parser.add_argument("--compare", help="JSON-отчёт прошлого прогона для сравнения")
+    args = parser.parse_args()
+
+    slugs = args.templates or _enabled_templates()
+    cases = [(slug, rows, args.repeats, not args.no_pdf) for slug in slugs for rows in args.rows]
+    # новый процесс на каждый случай — честный пиковый RSS
+    with multiprocessing.Pool(processes=1, maxtasksperchild=1) as pool:
+        results = []
+        for r in pool.imap(run_case, cases):
+            print(f"{r['template']:40} rows={r['rows']:<3} total={r['total_ms']:>9.2f} ms  "
+                  f"rss={r['peak_rss_mb']} MB")
+            results.append(r)
+
+    commit = _git_commit()
+    report = {
+        "meta": {
+            "commit": commit,
+            "date": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "repeats": args.repeats,
+            "pdf": not args.no_pdf,
+        },
+        "results": results,
+    }
+    baseline = None
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+
+    out_dir = Path(args.out)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    json_path = out_dir / f"{commit}.json"
+    md_path = out_dir / f"{commit}.md"
+    json_path.write_text(json.dumps(report, ensure_ascii=False, indent=2), encoding="utf-8")
+    md_path.write_text(to_markdown(report, baseline), encoding="utf-8")
+    print(f"\nJSON: {json_path}\nMarkdown: {md_path}")
+
+
+if __name__ == "__main__":
+    main()
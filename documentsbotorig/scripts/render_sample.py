@@ -48,6 +48,12 @@ context = {
     ],
 }
 
-docx_path, pdf_path = generate_files("add_agreement_OOO", context, output_dir=str(TPL_DIR))
+docx_bytes, pdf_bytes = generate_files("add_agreement_OOO", context)
+docx_path = TPL_DIR / "sample.docx"
+docx_path.write_bytes(docx_bytes)
 print("DOCX:", docx_path)
+pdf_path = None
+if pdf_bytes:
+    pdf_path = TPL_DIR / "sample.pdf"
+    pdf_path.write_bytes(pdf_bytes)
 print("PDF:", pdf_path)
@@ -0,0 +1,244 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Сборка и проверка шаблонов одним проходом (параллельно по всем шаблонам).
+
+    python scripts/templates.py build            # собрать все шаблоны
+    python scripts/templates.py build add_agreement_OOO -j 4
+    python scripts/templates.py check            # только проверить, ничего не записывая
+
+Для каждого шаблона:
+- компилирует Jinja во всех частях (body, header*, footer*, footnotes);
+- части с TemplateSyntaxError автоматически чинит (fix_templates.fix_xml) и проверяет снова;
+- собирает объявленные переменные и сверяет их с fields.json;
+- находит таблицы/маркеры __TABLE_<key>__ для полей-массивов;
+- пишет артефакт templates/<slug>/build/ (исправленный template.docx и compiled.json
+  с результатом patch_xml и метаданными), который бот загружает при старте.
+Исходные template.docx не изменяются.
+"""
+import argparse
+import io
+import json
+import os
+import sys
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+SCRIPTS_DIR = Path(__file__).resolve().parent
+for p in (ROOT, SCRIPTS_DIR):
+    if str(p) not in sys.path:
+        sys.path.insert(0, str(p))
+
+import docxtpl
+from docx import Document
+from jinja2 import Environment, TemplateSyntaxError, meta
+
+from fix_templates import fix_xml
+from utils.file_utils import (
+    TEMPLATES_DIR, TEMPLATE_NAMES, _arrays_meta, _build_table_profiles, _locate_markers, _match_table,
+)
+from utils.precompiled import (
+    ARTIFACT_FORMAT, BUILD_DIR_NAME, COMPILED_NAME, PrecompiledDocxTemplate, file_digest, xml_digest,
+)
+
+FOOTNOTES_TYPE = "application/vnd.openxmlformats-officedocument.wordprocessingml.footnotes+xml"
+
+
+def _iter_parts(tpl):
+    """(имя части, исходный XML) в том виде, в каком их видит docxtpl при рендере."""
+    tpl.init_docx()
+    yield "/word/document.xml", tpl.get_xml()
+    for uri in (tpl.HEADER_URI, tpl.FOOTER_URI):
+        for _, part in tpl.get_headers_footers(uri):
+            yield str(part.partname), tpl.get_part_xml(part)
+    for part in tpl.docx.part.package.parts:
+        if part.content_type == FOOTNOTES_TYPE:
+            blob = part.blob.decode("utf-8") if isinstance(part.blob, bytes) else part.blob
+            yield str(part.partname), blob
+
+
+def _compile_parts(docx_bytes):
+    """Патчит и компилирует все части. Возвращает (patched, variables, errors)."""
+    tpl = PrecompiledDocxTemplate(io.BytesIO(docx_bytes))
+    env = Environment()
+    patched, variables, errors = {}, set(), {}
+    for name, src in _iter_parts(tpl):
+        xml = tpl.patch_xml(src)
+        try:
+            env.from_string(xml)
+            variables |= meta.find_undeclared_variables(env.parse(xml))
+        except TemplateSyntaxError as e:
+            errors[name] = f"line {e.lineno}: {e.message}"
+            continue
+        patched[xml_digest(src)] = xml
+    return patched, variables, errors
+
+
+def _fix_parts(docx_bytes, part_names):
+    """Применяет fix_xml к указанным частям docx. Возвращает (новые байты, статистика)."""
+    fixes = []
+    out = io.BytesIO()
+    with zipfile.ZipFile(io.BytesIO(docx_bytes)) as zin, \
+            zipfile.ZipFile(out, "w", compression=zipfile.ZIP_DEFLATED) as zout:
+        for info in zin.infolist():
+            data = zin.read(info.filename)
+            if "/" + info.filename in part_names:
+                xml = data.decode("utf-8", errors="ignore")
+                fixed, stats = fix_xml(xml)
+                if fixed != xml:
+                    fixes.append({"part": info.filename, **stats})
+                    data = fixed.encode("utf-8")
+            zout.writestr(info, data)
+    return out.getvalue(), fixes
+
+
+def _table_plan(docx_bytes, arrays):
+    """Куда попадёт каждая таблица-массив: существующая таблица, маркер, якорь или конец документа."""
+    doc = Document(io.BytesIO(docx_bytes))
+    profiles = _build_table_profiles(doc)
+    markers = _locate_markers(doc, [a["key"] for a in arrays])
+    plan = {}
+    for a in arrays:
+        idx = next((i for i, p in enumerate(profiles) if _match_table(p, a) is not None), None)
+        if idx is not None:
+            plan[a["key"]] = f"existing table #{idx}"
+        elif a["key"] in markers:
+            kind, loc = markers[a["key"]]
+            plan[a["key"]] = f"{kind} at {loc[0]}"
+        else:
+            plan[a["key"]] = "end of document"
+    return plan, markers
+
+
+def _remove_artifact(build_dir):
+    for name in (COMPILED_NAME, "template.docx"):
+        (build_dir / name).unlink(missing_ok=True)
+
+
+def build_template(slug_dir, autofix=True, write=True):
+    """Собирает один шаблон. Возвращает отчёт (dict)."""
+    slug_dir = Path(slug_dir)
+    report = {"slug": slug_dir.name, "errors": [], "warnings": [], "fixes": []}
+    source = next((slug_dir / n for n in TEMPLATE_NAMES if (slug_dir / n).exists()), None)
+    if source is None:
+        report["errors"].append("template.docx not found")
+        return report
+    fields_path = slug_dir / "fields.json"
+    cfg = {}
+    if fields_path.exists():
+        with open(fields_path, "r", encoding="utf-8") as f:
+            cfg = json.load(f)
+    else:
+        report["warnings"].append("fields.json not found")
+
+    docx_bytes = source.read_bytes()
+    patched, variables, errors = _compile_parts(docx_bytes)
+    if errors and autofix:
+        docx_bytes, report["fixes"] = _fix_parts(docx_bytes, set(errors))
+        patched, variables, errors = _compile_parts(docx_bytes)
+    for part, err in errors.items():
+        report["errors"].append(f"TemplateSyntaxError in {part}: {err}")
+
+    # сверка переменных шаблона с fields.json
+    arrays = _arrays_meta(cfg)
+    array_keys = {a["key"] for a in arrays}
+    field_keys = {str(f.get("key", "")).split(".")[0] for f in cfg.get("fields", [])}
+    missing = sorted(variables - field_keys)
+    unused = sorted(field_keys - variables - array_keys)
+    if missing:
+        report["warnings"].append("variables not in fields.json: " + ", ".join(missing))
+    if unused:
+        report["warnings"].append("fields not used in template: " + ", ".join(unused))
+
+    plan, markers = _table_plan(docx_bytes, arrays) if arrays else ({}, {})
+    for key, where in plan.items():
+        if where == "end of document":
+            report["warnings"].append(f"array '{key}': no table or marker, table goes to the end")
+    report["variables"] = sorted(variables)
+    report["tables"] = plan
+
+    if not write:
+        return report
+    build_dir = slug_dir / BUILD_DIR_NAME
+    if report["errors"]:
+        # устаревший артефакт не должен подхватываться ботом
+        _remove_artifact(build_dir)
+        return report
+
+    build_dir.mkdir(exist_ok=True)
+    (build_dir / "template.docx").write_bytes(docx_bytes)
+    compiled = {
+        "format": ARTIFACT_FORMAT,
+        "slug": slug_dir.name,
+        "built_at": datetime.now().isoformat(timespec="seconds"),
+        "docxtpl": docxtpl.__version__,
+        "source": {"name": source.name, "sha256": file_digest(source)},
+        "fields_sha256": file_digest(fields_path) if fields_path.exists() else None,
+        "fixes": report["fixes"],
+        "variables": report["variables"],
+        "missing_fields": missing,
+        "unused_fields": unused,
+        "tables": plan,
+        "markers": markers,
+        "patched": patched,
+    }
+    tmp = build_dir / (COMPILED_NAME + ".tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(compiled, f, ensure_ascii=False)
+    os.replace(tmp, build_dir / COMPILED_NAME)
+    report["written"] = str(build_dir)
+    return report
+
+
+def _print_report(r):
+    status = "BAD" if r["errors"] else ("WARN" if r["warnings"] else "OK")
+    print(f"{status}: {r['slug']}")
+    for fix in r["fixes"]:
+        print(f"  fixed {fix['part']}: stray_open={fix['stray_open']} stray_close={fix['stray_close']} "
+              f"triple_open={fix['triple_open']} triple_close={fix['triple_close']}")
+    for e in r["errors"]:
+        print(f"  ERROR {e}")
+    for w in r["warnings"]:
+        print(f"  warn  {w}")
+    for key, where in r.get("tables", {}).items():
+        print(f"  table {key}: {where}")
+    if r.get("written"):
+        print(f"  -> {r['written']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Сборка и проверка DOCX-шаблонов")
+    parser.add_argument("command", choices=["build", "check"])
+    parser.add_argument("slugs", nargs="*", help="шаблоны (по умолчанию все)")
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--no-fix", action="store_true", help="не исправлять скобки автоматически")
+    args = parser.parse_args()
+
+    if not TEMPLATES_DIR.exists():
+        print(f"❌ Templates dir not found: {TEMPLATES_DIR}")
+        sys.exit(1)
+    slug_dirs = sorted(
+        d for d in TEMPLATES_DIR.iterdir()
+        if d.is_dir() and (not args.slugs or d.name in args.slugs)
+    )
+    write = args.command == "build"
+    with ProcessPoolExecutor(max_workers=max(1, args.jobs)) as pool:
+        reports = list(pool.map(
+            build_template, slug_dirs,
+            [not args.no_fix] * len(slug_dirs), [write] * len(slug_dirs),
+        ))
+
+    for r in reports:
+        _print_report(r)
+    bad = [r["slug"] for r in reports if r["errors"]]
+    if bad:
+        print(f"\nSummary: {len(bad)} template(s) failed: {', '.join(bad)}")
+        sys.exit(1)
+    print(f"\nSummary: {len(reports)} template(s) OK.")
+
+
+if __name__ == "__main__":
+    main()
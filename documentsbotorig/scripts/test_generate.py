@@ -14,6 +14,6 @@ ctx={
 }
 
 docx, pdf = generate_files('add_agreement_OOO', ctx)
-print('DOCX:', docx)
-print('PDF :', pdf)
+print('DOCX:', len(docx), 'bytes')
+print('PDF :', len(pdf) if pdf else None, 'bytes')
 
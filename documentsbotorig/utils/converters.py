@@ -0,0 +1,331 @@
+import io
+import logging
+import os
+import queue
+import shutil
+import signal
+import subprocess
+import tempfile
+import threading
+from abc import ABC, abstractmethod
+from pathlib import Path
+from xml.sax.saxutils import escape
+
+from docx import Document as DocxDocument
+from docx.enum.text import WD_ALIGN_PARAGRAPH
+from docx.table import Table
+from docx.text.paragraph import Paragraph
+
+logger = logging.getLogger(__name__)
+
+# Настройки читаются из окружения напрямую: модуль используется и ботом, и скриптами
+# (scripts/*), которым не нужен config.py с обязательным токеном.
+SOFFICE_MAX_PROCESSES = int(os.getenv("SOFFICE_MAX_PROCESSES", "2"))
+SOFFICE_WAIT_SECONDS = float(os.getenv("SOFFICE_WAIT_SECONDS", "30"))
+# сколько ждать один процесс soffice, прежде чем убить его вместе с дочерними
+SOFFICE_TIMEOUT = float(os.getenv("SOFFICE_TIMEOUT", "60"))
+PDF_FALLBACK = os.getenv("PDF_FALLBACK", "1") not in {"0", "false", "no"}
+PDF_FONT_PATH = os.getenv("PDF_FONT_PATH", "")
+PDF_FONT_BOLD_PATH = os.getenv("PDF_FONT_BOLD_PATH", "")
+
+DEFAULT_FONTS = [
+    ("/usr/share/fonts/truetype/dejavu/DejaVuSerif.ttf", "/usr/share/fonts/truetype/dejavu/DejaVuSerif-Bold.ttf"),
+    ("/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf", "/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf"),
+    (r"C:\Windows\Fonts\times.ttf", r"C:\Windows\Fonts\timesbd.ttf"),
+    (r"C:\Windows\Fonts\arial.ttf", r"C:\Windows\Fonts\arialbd.ttf"),
+]
+
+
+class PdfConverter(ABC):
+    """Интерфейс конвертера DOCX -> PDF."""
+
+    name = ""
+
+    @abstractmethod
+    def available(self) -> bool:
+        ...
+
+    @abstractmethod
+    def convert(self, docx_bytes: bytes):
+        """Возвращает байты PDF или None, если конвертация не удалась."""
+
+
+class LibreOfficeConverter(PdfConverter):
+    """Конвертация через soffice --headless.
+
+    Одновременно работает не больше max_processes процессов; у каждого слота свой
+    профиль LibreOffice, иначе параллельные soffice мешают друг другу.
+    Если свободного слота нет дольше wait_seconds, конвертер считается перегруженным
+    и возвращает None (PDF сделает запасной бэкенд). Зависший soffice убивается
+    через timeout секунд вместе со всей группой процессов (soffice.bin и т.п.).
+    """
+
+    name = "libreoffice"
+
+    def __init__(self, max_processes=SOFFICE_MAX_PROCESSES, wait_seconds=SOFFICE_WAIT_SECONDS,
+                 timeout=SOFFICE_TIMEOUT):
+        self.wait_seconds = wait_seconds
+        self.timeout = timeout
+        self._slots = queue.Queue()
+        for i in range(max(1, max_processes)):
+            self._slots.put(i)
+        self._profiles_dir = Path(tempfile.gettempdir()) / "documentsbot_lo_profiles"
+
+    @staticmethod
+    def find_soffice():
+        soffice_path = shutil.which("soffice")
+        if not soffice_path and os.name == "nt":
+            possible_path = r"C:\Program Files\LibreOffice\program\soffice.exe"
+            if os.path.exists(possible_path):
+                soffice_path = possible_path
+        return soffice_path
+
+    def available(self):
+        return self.find_soffice() is not None
+
+    def busy(self):
+        return self._slots.empty()
+
+    def convert(self, docx_bytes):
+        soffice_path = self.find_soffice()
+        if not soffice_path:
+            logger.warning("LibreOffice (soffice) не найден")
+            return None
+
+        try:
+            slot = self._slots.get(timeout=self.wait_seconds)
+        except queue.Empty:
+            logger.warning("LibreOffice перегружен, нет свободного слота для конвертации")
+            return None
+        try:
+            profile = (self._profiles_dir / f"slot{slot}").as_uri()
+            # Диск используется только здесь: soffice умеет работать лишь с файлами,
+            # поэтому пишем во временную папку, которая удаляется в любом случае.
+            with tempfile.TemporaryDirectory() as tmp_dir:
+                src = os.path.join(tmp_dir, "document.docx")
+                with open(src, "wb") as f:
+                    f.write(docx_bytes)
+                process = subprocess.Popen([
+                    soffice_path,
+                    f"-env:UserInstallation={profile}",
+                    "--headless",
+                    "--convert-to", "pdf",
+                    "--outdir", tmp_dir,
+                    src
+                ], start_new_session=os.name != "nt")
+                try:
+                    returncode = process.wait(timeout=self.timeout)
+                except subprocess.TimeoutExpired:
+                    self._kill(process)
+                    logger.warning("LibreOffice не уложился в %.0f с, процесс остановлен", self.timeout)
+                    return None
+                if returncode != 0:
+                    logger.warning("Ошибка при конвертации в PDF: soffice завершился с кодом %s", returncode)
+                    return None
+                pdf_path = os.path.join(tmp_dir, "document.pdf")
+                if not os.path.exists(pdf_path):
+                    return None
+                with open(pdf_path, "rb") as f:
+                    return f.read()
+        finally:
+            self._slots.put(slot)
+
+    @staticmethod
+    def _kill(process):
+        """Убивает soffice вместе с группой: сам soffice — лишь обёртка над soffice.bin."""
+        if os.name != "nt":
+            try:
+                os.killpg(process.pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+        else:
+            process.kill()
+        process.wait()
+
+
+_ALIGNMENTS = {
+    WD_ALIGN_PARAGRAPH.CENTER: 1,   # TA_CENTER
+    WD_ALIGN_PARAGRAPH.RIGHT: 2,    # TA_RIGHT
+    WD_ALIGN_PARAGRAPH.JUSTIFY: 4,  # TA_JUSTIFY
+}
+
+
+class ReportlabConverter(PdfConverter):
+    """Быстрый конвертер на чистом Python (python-docx -> reportlab).
+
+    Переносит абзацы (жирный/курсив/подчёркивание, выравнивание, размер шрифта)
+    и таблицы с объединёнными ячейками. Колонтитулы, картинки и сложная вёрстка
+    не поддерживаются — подходит для простых шаблонов (pdf_backend: "reportlab"
+    в fields.json) и как запасной вариант, когда LibreOffice нет.
+    """
+
+    name = "reportlab"
+    font = "DocFont"
+
+    def __init__(self, font_path=PDF_FONT_PATH, bold_font_path=PDF_FONT_BOLD_PATH):
+        self.font_path = font_path
+        self.bold_font_path = bold_font_path
+        self._registered = False
+        self._lock = threading.Lock()
+
+    def _fonts(self):
+        if self.font_path:
+            return self.font_path, self.bold_font_path or self.font_path
+        for regular, bold in DEFAULT_FONTS:
+            if os.path.exists(regular):
+                return regular, bold if os.path.exists(bold) else regular
+        return None, None
+
+    def available(self):
+        try:
+            import reportlab  # noqa: F401
+        except ImportError:
+            return False
+        return self._fonts()[0] is not None
+
+    def _register_fonts(self):
+        with self._lock:
+            if self._registered:
+                return
+            from reportlab.lib.fonts import addMapping
+            from reportlab.pdfbase import pdfmetrics
+            from reportlab.pdfbase.ttfonts import TTFont
+
+            regular, bold = self._fonts()
+            pdfmetrics.registerFont(TTFont(self.font, regular))
+            pdfmetrics.registerFont(TTFont(self.font + "-Bold", bold))
+            for b, i, name in ((0, 0, self.font), (1, 0, self.font + "-Bold"),
+                               (0, 1, self.font), (1, 1, self.font + "-Bold")):
+                addMapping(self.font, b, i, name)
+            self._registered = True
+
+    def _markup(self, paragraph):
+        parts = []
+        for run in paragraph.runs:
+            text = escape(run.text or "").replace("\n", "<br/>").replace("\t", "&nbsp;&nbsp;&nbsp;&nbsp;")
+            if not text:
+                continue
+            if run.bold:
+                text = f"<b>{text}</b>"
+            if run.italic:
+                text = f"<i>{text}</i>"
+            if run.underline:
+                text = f"<u>{text}</u>"
+            parts.append(text)
+        return "".join(parts)
+
+    def _paragraph(self, paragraph, base_style):
+        from reportlab.lib.styles import ParagraphStyle
+        from reportlab.platypus import Paragraph as RLParagraph
+
+        size = next((r.font.size.pt for r in paragraph.runs if r.font.size), base_style.fontSize)
+        style = ParagraphStyle(
+            "p", parent=base_style, fontSize=size, leading=size * 1.25,
+            alignment=_ALIGNMENTS.get(paragraph.alignment, 0),
+        )
+        return RLParagraph(self._markup(paragraph) or "&nbsp;", style)
+
+    def _table(self, table, base_style, width):
+        from reportlab.lib import colors
+        from reportlab.platypus import Table as RLTable, TableStyle
+
+        rows = table.rows
+        grid = [[cell._tc for cell in row.cells] for row in rows]
+        n_cols = max((len(r) for r in grid), default=0)
+        if not n_cols:
+            return None
+        data = [["" for _ in range(n_cols)] for _ in grid]
+        commands = [
+            ("GRID", (0, 0), (-1, -1), 0.5, colors.black),
+            ("VALIGN", (0, 0), (-1, -1), "TOP"),
+        ]
+        seen = set()
+        for r, row in enumerate(rows):
+            cells = row.cells
+            for c, cell in enumerate(cells):
+                tc = grid[r][c]
+                if id(tc) in seen:
+                    continue
+                seen.add(id(tc))
+                # размер объединённой области: вправо и вниз, пока та же ячейка
+                c2 = c
+                while c2 + 1 < len(grid[r]) and grid[r][c2 + 1] is tc:
+                    c2 += 1
+                r2 = r
+                while r2 + 1 < len(grid) and c < len(grid[r2 + 1]) and grid[r2 + 1][c] is tc:
+                    r2 += 1
+                if (r2, c2) != (r, c):
+                    commands.append(("SPAN", (c, r), (c2, r2)))
+                data[r][c] = [self._paragraph(p, base_style) for p in cell.paragraphs]
+
+        widths = None
+        grid_cols = table._tbl.tblGrid.gridCol_lst if table._tbl.tblGrid is not None else []
+        if len(grid_cols) == n_cols and all(g.w for g in grid_cols):
+            total = sum(g.w for g in grid_cols)
+            widths = [width * g.w / total for g in grid_cols]
+        else:
+            widths = [width / n_cols] * n_cols
+        tbl = RLTable(data, colWidths=widths, repeatRows=0)
+        tbl.setStyle(TableStyle(commands))
+        return tbl
+
+    def convert(self, docx_bytes):
+        from reportlab.lib.pagesizes import A4
+        from reportlab.lib.styles import ParagraphStyle
+        from reportlab.lib.units import cm
+        from reportlab.platypus import SimpleDocTemplate
+
+        self._register_fonts()
+        doc = DocxDocument(io.BytesIO(docx_bytes))
+        base_style = ParagraphStyle("base", fontName=self.font, fontSize=11, leading=14)
+
+        section = doc.sections[0] if doc.sections else None
+        margins = {
+            "leftMargin": section.left_margin.pt if section and section.left_margin else 2 * cm,
+            "rightMargin": section.right_margin.pt if section and section.right_margin else 2 * cm,
+            "topMargin": section.top_margin.pt if section and section.top_margin else 2 * cm,
+            "bottomMargin": section.bottom_margin.pt if section and section.bottom_margin else 2 * cm,
+        }
+        buf = io.BytesIO()
+        pdf = SimpleDocTemplate(buf, pagesize=A4, **margins)
+
+        story = []
+        for block in doc.iter_inner_content():
+            if isinstance(block, Paragraph):
+                story.append(self._paragraph(block, base_style))
+            elif isinstance(block, Table):
+                tbl = self._table(block, base_style, pdf.width)
+                if tbl is not None:
+                    story.append(tbl)
+        pdf.build(story)
+        return buf.getvalue()
+
+
+libreoffice_converter = LibreOfficeConverter()
+reportlab_converter = ReportlabConverter()
+CONVERTERS = {c.name: c for c in (libreoffice_converter, reportlab_converter)}
+
+
+def convert_to_pdf(docx_bytes: bytes, prefer=None):
+    """Конвертирует DOCX в PDF, выбирая бэкенд.
+
+    prefer="reportlab" — шаблон помечен как простой: сначала быстрый конвертер.
+    Иначе — LibreOffice, а при его отсутствии или ошибке (если PDF_FALLBACK) — reportlab.
+    Возвращает (pdf_bytes | None, имя бэкенда | None).
+    """
+    if prefer in CONVERTERS and prefer != libreoffice_converter.name:
+        order = [CONVERTERS[prefer], libreoffice_converter]
+    else:
+        order = [libreoffice_converter] + ([reportlab_converter] if PDF_FALLBACK else [])
+    for converter in order:
+        if not converter.available():
+            continue
+        try:
+            pdf = converter.convert(docx_bytes)
+        except Exception:
+            logger.exception("Ошибка конвертации в PDF (%s)", converter.name)
+            continue
+        if pdf:
+            return pdf, converter.name
+    logger.warning("Ни один конвертер PDF не сработал, PDF не будет создан")
+    return None, None
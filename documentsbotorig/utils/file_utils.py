@@ -1,308 +1,765 @@
+import asyncio
+import hashlib
+import io
 import os
 import json
 import re
-import tempfile
-import subprocess
+import threading
+from collections import OrderedDict
 from pathlib import Path
-from docxtpl import DocxTemplate
-import shutil
 from docx import Document as DocxDocument
 from docx.shared import Pt
 from docx.enum.text import WD_ALIGN_PARAGRAPH
 from jinja2 import exceptions as jinja2_exceptions
-import sys
+import logging
 from copy import deepcopy
+from docx.table import _Cell
+from docx.oxml import OxmlElement
+from docx.oxml.ns import qn
+from utils import converters, tracing
+from utils.precompiled import (
+    BUILD_DIR_NAME, COMPILED_NAME, PrecompiledDocxTemplate, jinja_env, load_artifact,
+)
+
+logger = logging.getLogger(__name__)
 
 # Папка с включёнными шаблонами
 ENABLED_PATH = "enabled.json"  # путь к твоему JSON с включёнными шаблонами
+# Пакеты: несколько шаблонов, заполняемых одним мастером (см. README)
+PACKAGES_PATH = "packages.json"
 
 BASE_DIR = Path(__file__).resolve().parent.parent
 TEMPLATES_DIR = BASE_DIR / "templates"
 
-def load_enabled():
-    if not os.path.exists(ENABLED_PATH):
+def _read_json(path):
+    if not os.path.exists(path):
         return {}
-    with open(ENABLED_PATH, "r", encoding="utf-8") as f:
+    with open(path, "r", encoding="utf-8") as f:
         return json.load(f)
 
-def save_enabled(data):
-    with open(ENABLED_PATH, "w", encoding="utf-8") as f:
+
+def _write_enabled(data, path=ENABLED_PATH):
+    # атомарная запись: читатели никогда не видят наполовину записанный файл
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
         json.dump(data, f, indent=2, ensure_ascii=False)
+    os.replace(tmp, path)
+
+
+def load_enabled():
+    """Флаги включённых шаблонов из текущего снимка реестра (без чтения диска)."""
+    return dict(template_registry.snapshot.enabled)
+
+
+def save_enabled(data):
+    template_registry.save_enabled(data)
+
 
 def load_templates():
-    templates = []
-    enabled = load_enabled()
+    """fields.json включённых шаблонов из текущего снимка реестра."""
     if not TEMPLATES_DIR.exists():
         raise FileNotFoundError(f"❌ Папка с шаблонами не найдена: {TEMPLATES_DIR}")
-    for slug in os.listdir(TEMPLATES_DIR):
-        if not enabled.get(slug, False):
-            continue
-        t_path = TEMPLATES_DIR / slug
-        if t_path.is_dir():
-            fields_file = t_path / "fields.json"
-            if fields_file.exists():
-                with open(fields_file, "r", encoding="utf-8") as f:
-                    templates.append(json.load(f))
-    return templates
-
-def generate_files(template_slug, context, output_dir=None):
+    return list(template_registry.snapshot.templates)
+
+
+def load_packages():
+    """Пакеты шаблонов из packages.json (только те, где все шаблоны включены)."""
+    return list(template_registry.snapshot.packages.values())
+
+
+TEMPLATE_NAMES = ["template.docx", "template11.docx", "template1.docx"]
+
+# Как часто проверять изменения enabled.json и папки templates/ (секунды)
+TEMPLATES_WATCH_INTERVAL = float(os.getenv("TEMPLATES_WATCH_INTERVAL", "2"))
+# Сколько прежних версий шаблонов держать для мастеров, начатых до изменения
+TEMPLATES_KEEP_VERSIONS = 20
+
+
+def _arrays_meta(cfg):
+    arrays = []
+    for fld in cfg.get("fields", []):
+        if fld.get("type") == "array":
+            items = fld.get("items") or fld.get("item_fields") or []
+            if isinstance(items, list) and items:
+                arrays.append({
+                    "key": fld.get("key"),
+                    "headers": [i.get("label", i.get("key", "")) for i in items],
+                    "col_keys": [i.get("key") for i in items],
+                })
+    return arrays
+
+
+def _template_path(slug_dir):
     # поддержка нескольких названий шаблонов
-    candidates = [
-        TEMPLATES_DIR / template_slug / "template.docx",
-        TEMPLATES_DIR / template_slug / "template11.docx",
-        TEMPLATES_DIR / template_slug / "template1.docx",
-    ]
-    t_path = next((p for p in candidates if p.exists()), None)
-    if not t_path:
-        raise FileNotFoundError(
-            "❌ Шаблон не найден. Ожидались файлы: "
-            + ", ".join(str(p) for p in candidates)
-        )
+    return next((slug_dir / n for n in TEMPLATE_NAMES if (slug_dir / n).exists()), None)
 
-    doc = DocxTemplate(str(t_path))
-    try:
-        print(f"[tpl] Rendering slug={template_slug}, path={t_path}")
-        sys.stdout.flush()
-        doc.render(context)
-    except jinja2_exceptions.TemplateSyntaxError as e:
-        print(f"[tpl] TemplateSyntaxError in slug={template_slug}, path={t_path}: {e}")
-        sys.stdout.flush()
-        raise
-
-    tmp_docx = tempfile.NamedTemporaryFile(delete=False, suffix=".docx", dir=output_dir)
-    doc.save(tmp_docx.name)
-
-    # Пост-обработка: автоматически строим таблицы для полей-массивов
+
+def _mtime(path):
     try:
-        fields_cfg_path = TEMPLATES_DIR / template_slug / "fields.json"
-        if fields_cfg_path.exists():
-            with open(fields_cfg_path, "r", encoding="utf-8") as f:
-                cfg = json.load(f)
-            arrays = []
-            for fld in cfg.get("fields", []):
-                if fld.get("type") == "array":
-                    items = fld.get("items") or fld.get("item_fields") or []
-                    if isinstance(items, list) and items:
-                        arrays.append({
-                            "key": fld.get("key"),
-                            "headers": [i.get("label", i.get("key", "")) for i in items],
-                            "col_keys": [i.get("key") for i in items],
-                        })
-            if arrays:
-                _inject_tables_into_docx(tmp_docx.name, arrays, context)
-    except Exception as e:
-        print(f"⚠ Ошибка автосборки таблиц: {e}")
-
-    pdf_path = None
-    soffice_path = shutil.which("soffice")
-    if not soffice_path and os.name == "nt":
-        possible_path = r"C:\Program Files\LibreOffice\program\soffice.exe"
-        if os.path.exists(possible_path):
-            soffice_path = possible_path
-
-    if soffice_path:
+        return path.stat().st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+
+def _template_signature(slug_dir):
+    """Отпечаток файлов шаблона: меняется при любом изменении template.docx, fields.json или сборки."""
+    t_path = _template_path(slug_dir)
+    if t_path is None:
+        return None
+    return (
+        str(t_path),
+        _mtime(t_path),
+        _mtime(slug_dir / "fields.json"),
+        _mtime(slug_dir / BUILD_DIR_NAME / COMPILED_NAME),
+    )
+
+
+def _load_entry(slug_dir, signature):
+    """Читает шаблон в память и собирает запись реестра (поля, массивы, кэш разметки)."""
+    t_path = Path(signature[0])
+    fields_cfg_path = slug_dir / "fields.json"
+    fields_raw = fields_cfg_path.read_bytes() if fields_cfg_path.exists() else b""
+    cfg = json.loads(fields_raw.decode("utf-8")) if fields_raw else {}
+    source_bytes = t_path.read_bytes()
+    entry = {
+        "version": signature,
+        # версия по содержимому: одинакова после перезапуска, если файлы не менялись
+        "version_id": hashlib.sha1(source_bytes + b"\0" + fields_raw).hexdigest()[:12],
+        "path": t_path,
+        "render_path": t_path,
+        "render_bytes": source_bytes,  # шаблон в памяти: старая версия переживает замену файла
+        "config": cfg,
+        "arrays": _arrays_meta(cfg),
+        "compiled": None,  # метаданные артефакта сборки, если он актуален
+        "patched": {},     # sha1 исходного XML -> результат patch_xml
+        "tables": None,    # профили колонок таблиц (строятся при первом рендере)
+        "markers": {},     # key -> расположение маркера/якоря (только найденные)
+    }
+    artifact = load_artifact(slug_dir, t_path, fields_cfg_path)
+    if artifact is not None:
+        build_path, compiled = artifact
+        entry["render_path"] = build_path
+        entry["render_bytes"] = build_path.read_bytes()
+        entry["patched"] = compiled.get("patched") or {}
+        entry["compiled"] = {k: v for k, v in compiled.items() if k != "patched"}
+        for key, loc in (compiled.get("markers") or {}).items():
+            if loc:
+                # расположения в JSON — списки, в кэше — кортежи
+                entry["markers"][key] = (loc[0], tuple(loc[1]))
+    return entry
+
+
+class RegistrySnapshot:
+    """Неизменяемый снимок реестра: флаги enabled.json, пакеты и записи всех шаблонов."""
+
+    __slots__ = ("enabled", "enabled_mtime", "entries", "templates", "packages", "packages_mtime")
+
+    def __init__(self, enabled, enabled_mtime, entries, packages=None, packages_mtime=None):
+        self.enabled = enabled
+        self.enabled_mtime = enabled_mtime
+        self.entries = entries
+        # fields.json включённых шаблонов — то, что показывается в /start
+        self.templates = [
+            entries[slug]["config"] for slug in sorted(entries)
+            if enabled.get(slug, False) and entries[slug]["config"]
+        ]
+        # пакеты, все шаблоны которых есть и включены
+        self.packages = {}
+        for package_id, pkg in (packages or {}).items():
+            slugs = pkg.get("templates") or []
+            if slugs and all(enabled.get(slug, False) and slug in entries for slug in slugs):
+                self.packages[package_id] = {
+                    "id": package_id, "name": pkg.get("name", package_id), "templates": list(slugs),
+                }
+        self.packages_mtime = packages_mtime
+
+
+class TemplateRegistry:
+    """Реестр шаблонов с горячей перезагрузкой.
+
+    Читатели берут текущий снимок одной операцией, без блокировок, и не видят
+    частично обновлённого состояния. Писатели (наблюдатель за файлами и переключение
+    шаблонов в админке) под блокировкой собирают новый снимок и подменяют ссылку целиком;
+    неизменившиеся шаблоны переиспользуются вместе с кэшем разметки.
+    Прежние версии шаблонов остаются доступны по version_id, чтобы мастер, начатый
+    до изменения, дошёл до конца с теми же полями и тем же документом.
+    """
+
+    def __init__(self, templates_dir=TEMPLATES_DIR, enabled_path=ENABLED_PATH,
+                 packages_path=PACKAGES_PATH, keep_versions=TEMPLATES_KEEP_VERSIONS):
+        self.templates_dir = Path(templates_dir)
+        self.enabled_path = enabled_path
+        self.packages_path = packages_path
+        self._snapshot = None
+        self._write_lock = threading.Lock()
+        self._retired = OrderedDict()  # (slug, version_id) -> запись прежней версии
+        self._keep_versions = keep_versions
+        self._watch_task = None
+
+    @property
+    def snapshot(self):
+        snap = self._snapshot
+        if snap is None:
+            snap = self.reload()
+        return snap
+
+    def entry(self, slug, version_id=None):
+        """Запись шаблона: текущая или (если указана и ещё хранится) прежняя версия."""
+        current = self.snapshot.entries.get(slug)
+        if version_id and (current is None or current["version_id"] != version_id):
+            old = self._retired.get((slug, version_id))
+            if old is not None:
+                return old
+        if current is None:
+            slug_dir = self.templates_dir / slug
+            raise FileNotFoundError(
+                "❌ Шаблон не найден. Ожидались файлы: "
+                + ", ".join(str(slug_dir / name) for name in TEMPLATE_NAMES)
+            )
+        return current
+
+    def has_version(self, slug, version_id):
+        """Есть ли в реестре именно эта версия шаблона (текущая или прежняя)."""
+        current = self.snapshot.entries.get(slug)
+        if current is not None and current["version_id"] == version_id:
+            return True
+        return (slug, version_id) in self._retired
+
+    def adopt(self, slug, entry):
+        """Добавляет версию шаблона, загруженную другим процессом (см. utils.sandbox):
+        рабочий процесс мог не застать версию, с которой начат мастер."""
+        with self._write_lock:
+            if not self.has_version(slug, entry["version_id"]):
+                self._retire(slug, entry)
+
+    def _signatures(self):
+        if not self.templates_dir.exists():
+            return {}
+        return {
+            d.name: sig for d in self.templates_dir.iterdir()
+            if d.is_dir() and (sig := _template_signature(d)) is not None
+        }
+
+    def changed(self):
+        """Изменились ли файлы с момента последнего снимка."""
+        snap = self._snapshot
+        if snap is None:
+            return True
+        if _mtime(Path(self.enabled_path)) != snap.enabled_mtime:
+            return True
+        if _mtime(Path(self.packages_path)) != snap.packages_mtime:
+            return True
+        signatures = self._signatures()
+        return signatures.keys() != snap.entries.keys() or any(
+            snap.entries[slug]["version"] != sig for slug, sig in signatures.items()
+        )
+
+    def reload(self, enabled=None):
+        """Перечитывает изменившиеся шаблоны и публикует новый снимок."""
+        with self._write_lock:
+            old = self._snapshot
+            old_entries = old.entries if old else {}
+            entries = {}
+            for slug, sig in self._signatures().items():
+                entry = old_entries.get(slug)
+                if entry is None or entry["version"] != sig:
+                    try:
+                        entry = _load_entry(self.templates_dir / slug, sig)
+                    except (OSError, ValueError) as e:
+                        # файл ещё дописывается или сломан — оставляем прежнюю версию
+                        logger.warning("Template %s not reloaded: %s", slug, e)
+                        entry = old_entries.get(slug)
+                        if entry is None:
+                            continue
+                    else:
+                        if slug in old_entries:
+                            logger.info("Template %s reloaded", slug)
+                entries[slug] = entry
+            for slug, entry in old_entries.items():
+                if entries.get(slug) is not entry:
+                    self._retire(slug, entry)
+            enabled_mtime = _mtime(Path(self.enabled_path))
+            if enabled is None:
+                try:
+                    enabled = _read_json(self.enabled_path)
+                except ValueError as e:
+                    logger.warning("enabled.json not reloaded: %s", e)
+                    enabled = old.enabled if old else {}
+            packages_mtime = _mtime(Path(self.packages_path))
+            try:
+                packages = _read_json(self.packages_path)
+            except ValueError as e:
+                logger.warning("packages.json not reloaded: %s", e)
+                packages = {p["id"]: p for p in old.packages.values()} if old else {}
+            snap = RegistrySnapshot(enabled, enabled_mtime, entries, packages, packages_mtime)
+            self._snapshot = snap
+            return snap
+
+    def _retire(self, slug, entry):
+        self._retired[(slug, entry["version_id"])] = entry
+        while len(self._retired) > self._keep_versions:
+            self._retired.popitem(last=False)
+
+    def save_enabled(self, data):
+        with self._write_lock:
+            _write_enabled(data, self.enabled_path)
+        self.reload(enabled=dict(data))
+
+    def toggle(self, slug):
+        """Переключает шаблон в enabled.json. Возвращает новое значение или None, если его нет.
+        Чтение-изменение-запись идут под одной блокировкой: одновременные
+        переключения из админки не теряют друг друга.
+        """
+        if self._snapshot is None:
+            # snapshot при первом обращении вызывает reload(), который берёт ту же
+            # (нереентерабельную) блокировку, — загружаем его до неё
+            self.reload()
+        with self._write_lock:
+            enabled = dict(self._snapshot.enabled)
+            if slug not in enabled:
+                return None
+            enabled[slug] = not enabled[slug]
+            _write_enabled(enabled, self.enabled_path)
+        self.reload(enabled=enabled)
+        return enabled[slug]
+
+    async def _watch(self, interval):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                if await asyncio.to_thread(self.changed):
+                    await asyncio.to_thread(self.reload)
+            except Exception:
+                logger.exception("Template registry reload failed")
+
+    async def start_watching(self, interval=TEMPLATES_WATCH_INTERVAL):
+        if self._watch_task is None:
+            self._watch_task = asyncio.create_task(self._watch(interval))
+
+    async def stop_watching(self):
+        if self._watch_task is not None:
+            self._watch_task.cancel()
+            self._watch_task = None
+
+
+template_registry = TemplateRegistry()
+
+
+def get_template_entry(template_slug, version_id=None):
+    """Возвращает запись реестра для шаблона (путь, поля, массивы, кэш разметки).
+    version_id — версия, с которой начат мастер (если она ещё хранится)."""
+    return template_registry.entry(template_slug, version_id)
+
+
+def preload_templates():
+    """Загружает в реестр все шаблоны (и их артефакты сборки) при старте бота."""
+    snap = template_registry.reload()
+    for slug, flag in snap.enabled.items():
+        if not flag:
+            continue
+        entry = snap.entries.get(slug)
+        if entry is None:
+            logger.warning("Template %s is enabled but not found", slug)
+            continue
+        logger.info("Template %s loaded (%s)", slug,
+                    "precompiled" if entry["compiled"] else "not precompiled")
+
+
+def generate_files(template_slug, context, version_id=None):
+    """Рендерит шаблон и возвращает (docx_bytes, pdf_bytes | None)."""
+    with tracing.trace(template_slug):
+        docx_bytes = render_docx(template_slug, context, version_id)
+        return docx_bytes, convert_to_pdf(docx_bytes, template_slug)
+
+
+def render_docx(template_slug, context, version_id=None):
+    """Рендерит шаблон, собирает таблицы и возвращает DOCX в виде байтов."""
+    entry, doc = render_template(template_slug, context, version_id)
+    build_tables(doc, entry, context)
+    return save_docx(doc)
+
+
+def render_template(template_slug, context, version_id=None):
+    """Фаза Jinja: возвращает (запись реестра, отрендеренный DocxTemplate)."""
+    entry = get_template_entry(template_slug, version_id)
+    t_path = entry["render_path"]
+
+    with tracing.span("render", precompiled=bool(entry["compiled"])):
+        doc = PrecompiledDocxTemplate(io.BytesIO(entry["render_bytes"]), entry["patched"])
         try:
-            output_dir_final = output_dir or os.path.dirname(tmp_docx.name)
-            subprocess.run([
-                soffice_path,
-                "--headless",
-                "--convert-to", "pdf",
-                "--outdir", output_dir_final,
-                tmp_docx.name
-            ], check=True)
-            candidate_pdf = os.path.splitext(tmp_docx.name)[0] + ".pdf"
-            if os.path.exists(candidate_pdf):
-                pdf_path = candidate_pdf
-        except subprocess.CalledProcessError as e:
-            print(f"⚠ Ошибка при конвертации в PDF: {e}")
-    else:
-        print("⚠ LibreOffice (soffice) не найден. PDF не будет создан.")
+            logger.debug("Rendering slug=%s, path=%s", template_slug, t_path)
+            doc.render(context, jinja_env=jinja_env)
+        except jinja2_exceptions.TemplateSyntaxError as e:
+            logger.error("TemplateSyntaxError in slug=%s, path=%s: %s", template_slug, t_path, e)
+            raise
+    return entry, doc
+
+
+def build_tables(doc, entry, context):
+    """Пост-обработка: автоматически строим таблицы для полей-массивов
+    (прямо в объекте документа, без промежуточного сохранения на диск)."""
+    if not entry["arrays"]:
+        return
+    rows = sum(len(v) for v in (context.get(a["key"]) for a in entry["arrays"]) if isinstance(v, list))
+    with tracing.span("inject_tables", tables=len(entry["arrays"]), rows=rows):
+        try:
+            _inject_tables_into_docx(doc.docx, entry["arrays"], context, entry)
+        except Exception as e:
+            logger.warning("Ошибка автосборки таблиц: %s", e)
 
-    return tmp_docx.name, pdf_path
 
+def save_docx(doc):
+    with tracing.span("save") as s:
+        buf = io.BytesIO()
+        doc.save(buf)
+        data = buf.getvalue()
+        s.set(bytes=len(data))
+    return data
 
-def _inject_tables_into_docx(doc_path: str, arrays_meta: list, context: dict):
-    """
-    Вставляет таблицы для полей-массивов.
-    Если в документе есть параграф с текстом {{__TABLE_<key>__}} (или __TABLE_<key>__ / <<TABLE_<key>>>),
-    таблица будет вставлена сразу после этого параграфа. Сам параграф не удаляется целиком —
-    маркер просто очищается.
 
-    Если маркер не найден — пытаемся найти "якорь" по заголовку (например, содержит "перечень произведений")
-    и вставить после него. Если и якоря нет — добавим таблицу в конец документа.
+def convert_to_pdf(docx_bytes: bytes, template_slug=None):
+    """Конвертирует DOCX (байты) в PDF (байты).
+    Бэкенд выбирается в utils.converters: шаблоны с "pdf_backend": "reportlab"
+    в fields.json идут в быстрый конвертер на Python, остальные — в LibreOffice
+    (с запасным вариантом, если soffice нет или он упал).
+    Возвращает None, если конвертация не удалась.
     """
-    docx = DocxDocument(doc_path)
+    prefer = None
+    if template_slug:
+        try:
+            prefer = get_template_entry(template_slug)["config"].get("pdf_backend")
+        except FileNotFoundError:
+            pass
+    with tracing.span("convert_pdf") as s:
+        pdf_bytes, backend = converters.convert_to_pdf(docx_bytes, prefer)
+        s.set(backend=backend, bytes=len(pdf_bytes) if pdf_bytes else 0)
+    if backend:
+        logger.info("PDF for %s converted by %s", template_slug or "document", backend)
+    return pdf_bytes
+
+
+# Ключевые слова заголовков колонок с приоритетами (primary проверяются первыми)
+COLUMN_KEYWORDS = {
+    "title": {"primary": ["назван"], "secondary": ["произвед", "исполнен", "фонограм"]},
+    "music_fio": {"primary": ["автор музык"], "secondary": ["муз", "автор"]},
+    "text_fio": {"primary": ["автор текст"], "secondary": ["текст", "слов"]},
+    "pseudonym": {"primary": ["исполнител"], "secondary": ["псевдоним", "творческ"]},
+    "fonog_fio": {"primary": ["изготовител"], "secondary": ["фонограм", "производител"]},
+    "author_rights": {"primary": ["авторск"], "secondary": ["передаваем", "объем"]},
+    "neighboring_rights": {"primary": ["смежн"], "secondary": ["передаваем", "объем"]},
+    "year": {"primary": ["год"], "secondary": ["выпуск", "дата"]},
+}
+# Стандартный порядок колонок после "№" — если заголовки не распознались
+DEFAULT_COLUMN_ORDER = [
+    "title", "music_fio", "text_fio", "pseudonym",
+    "fonog_fio", "author_rights", "neighboring_rights", "year",
+]
+
+ANCHOR_KEYWORDS = [
+    "перечень произведений (таблица)",
+    "перечень произведений/исполнений/фонограмм",
+    "перечень произведений/исполнений",
+    "перечень произведений",
+    "перечень работ",
+]
+
+
+def _map_columns(col_texts):
+    """Сопоставляет колонки таблицы ключам по тексту заголовков."""
+    mapping = {}
+    used = set()
+    # Сначала ищем точные соответствия (primary)
+    for idx, low in enumerate(col_texts):
+        for k, kw_dict in COLUMN_KEYWORDS.items():
+            if k in mapping or idx in used:
+                continue
+            if any(kw in low for kw in kw_dict["primary"]):
+                mapping[k] = idx
+                used.add(idx)
+                break
+    # Затем ищем по secondary, если не нашли primary
+    for idx, low in enumerate(col_texts):
+        for k, kw_dict in COLUMN_KEYWORDS.items():
+            if k in mapping or idx in used:
+                continue
+            if any(kw in low for kw in kw_dict["secondary"]):
+                # Дополнительная проверка для конфликтующих полей
+                if k == "text_fio" and "музык" in low:
+                    continue
+                if k == "music_fio" and "текст" in low:
+                    continue
+                if k in ["pseudonym", "fonog_fio"] and "назван" in low and "title" not in mapping:
+                    continue
+                mapping[k] = idx
+                used.add(idx)
+                break
+    return mapping
 
-    def normalize(text: str):
-        return (text or "").strip()
 
-    # Собираем все параграфы верхнего уровня
-    paragraphs = list(docx.paragraphs)
+def _grid_to_tc(tr):
+    """Индекс колонки сетки -> индекс <w:tc> в строке (с учётом gridSpan)."""
+    result = []
+    for tc_idx, tc in enumerate(tr.tc_lst):
+        result.extend([tc_idx] * tc.grid_span)
+    return result
 
-    def _try_fill_existing_table(docx_obj: DocxDocument, meta: dict, rows_data: list) -> bool:
-        """Пытается заполнить СУЩЕСТВУЮЩУЮ таблицу в шаблоне.
-        Возвращает True, если получилось, иначе False (тогда будет создана новая таблица).
-        Логика:
-        - ищем таблицу, где верхние строки содержат ключевые слова колонок
-        - определяем строку начала данных (первая строка, где в первом столбце число '1')
-        - клонируем шаблон строки данных и заполняем N строк
-        """
-        # Более точные ключевые слова с приоритетами
-        key_words = {
-            "title": {"primary": ["назван"], "secondary": ["произвед", "исполнен", "фонограм"]},
-            "music_fio": {"primary": ["автор музык"], "secondary": ["муз", "автор"]},
-            "text_fio": {"primary": ["автор текст"], "secondary": ["текст", "слов"]},
-            "pseudonym": {"primary": ["исполнител"], "secondary": ["псевдоним", "творческ"]},
-            "fonog_fio": {"primary": ["изготовител"], "secondary": ["фонограм", "производител"]},
-            "author_rights": {"primary": ["авторск"], "secondary": ["передаваем", "объем"]},
-            "neighboring_rights": {"primary": ["смежн"], "secondary": ["передаваем", "объем"]},
-            "year": {"primary": ["год"], "secondary": ["выпуск", "дата"]},
-        }
-        for tbl in docx_obj.tables:
-            if not tbl.rows or not tbl.columns:
+
+def _build_table_profiles(docx):
+    """Один проход по всем таблицам документа: строка начала данных и маппинг колонок."""
+    profiles = []
+    for tbl in docx.tables:
+        rows = tbl.rows
+        if not len(rows) or not len(tbl.columns):
+            profiles.append(None)
+            continue
+        # определяем строку начала данных (первая строка, где первый столбец == '1')
+        data_start = None
+        for r, row in enumerate(rows):
+            tcs = row._tr.tc_lst
+            cell0 = _Cell(tcs[0], tbl).text.strip() if tcs else ""
+            if cell0.startswith("1"):
+                data_start = r
+                break
+        if data_start is not None:
+            # заголовки - это всё, что выше строки данных
+            header_rows_cnt = data_start
+        else:
+            header_rows_cnt = min(4, len(rows))
+            data_start = header_rows_cnt
+
+        # агрегируем текст только заголовочных строк по колонкам
+        header_cells = [rows[r].cells for r in range(header_rows_cnt)]
+        cols_n = len(rows[0].cells)
+        col_texts = []
+        for c in range(cols_n):
+            col_texts.append(" ".join(
+                (cells[c].text or "").lower() for cells in header_cells if c < len(cells)
+            ))
+
+        mapping = _map_columns(col_texts)
+        logger.debug("[tpl] Column texts: %s -> %s", col_texts, mapping)
+        profiles.append({
+            "rows": len(rows),
+            "cols": cols_n,
+            "data_start": data_start,
+            "mapping": mapping,
+        })
+    return profiles
+
+
+def _match_table(profile, meta):
+    """Возвращает маппинг колонок, если таблица подходит под массив, иначе None."""
+    if profile is None:
+        return None
+    mapping = profile["mapping"]
+    if len([k for k in meta["col_keys"] if k in mapping]) >= 2:
+        return mapping
+    # слабое совпадение — пробуем стандартный порядок колонок после №
+    mapping = dict(mapping)
+    for i, k in enumerate(DEFAULT_COLUMN_ORDER, start=1):
+        if i < profile["cols"]:
+            mapping[k] = i
+    if len([k for k in meta["col_keys"] if k in mapping]) >= 2:
+        return mapping
+    return None
+
+
+def _table_profiles(docx, entry):
+    """Профили таблиц из реестра шаблона; перестраиваются, если структура документа другая."""
+    tables = docx.tables
+    profiles = entry.get("tables") if entry is not None else None
+    if profiles is None or len(profiles) != len(tables) or any(
+        p is not None and p["rows"] != len(t.rows) for p, t in zip(profiles, tables)
+    ):
+        profiles = _build_table_profiles(docx)
+        if entry is not None:
+            entry["tables"] = profiles
+    return tables, profiles
+
+
+def _fill_existing_table(tbl, profile, mapping, meta, rows_data):
+    """Заполняет существующую таблицу: клонирует шаблонную строку данных N раз."""
+    data_start = profile["data_start"]
+    if data_start >= len(tbl.rows):
+        # нет строки данных — добавим одну
+        tbl.add_row()
+        data_start = len(tbl.rows) - 1
+
+    tbl_el = tbl._tbl
+    template_tr = tbl_el.tr_lst[data_start]
+    # удалим все строки ниже шаблонной (оставим одну шаблонную строку)
+    for tr in tbl_el.tr_lst[data_start + 1:]:
+        tbl_el.remove(tr)
+
+    grid = _grid_to_tc(template_tr)
+    targets = []
+    for k in meta["col_keys"]:
+        col_i = mapping.get(k)
+        if col_i is None or col_i >= len(grid):
+            logger.debug("[tpl] Key '%s' has no column in table", k)
+            continue
+        targets.append((k, grid[col_i]))
+
+    # Готовим шаблон строки один раз: в заполняемых ячейках остаётся
+    # единственный <w:t>, которому потом просто присваивается текст
+    base_tr = deepcopy(template_tr)
+    base_tcs = base_tr.tc_lst
+    slots = ([0] if base_tcs else []) + [tc_idx for _, tc_idx in targets]
+    for tc_idx in dict.fromkeys(slots):
+        _Cell(base_tcs[tc_idx], tbl).text = ""
+        t = OxmlElement("w:t")
+        t.set(qn("xml:space"), "preserve")
+        base_tcs[tc_idx].p_lst[0].r_lst[0].append(t)
+    w_t = qn("w:t")
+
+    def set_text(tc, value):
+        if "\n" in value or "\t" in value:
+            # переносы/табуляции python-docx превращает в <w:br/>/<w:tab/>
+            _Cell(tc, tbl).text = value
+        else:
+            next(tc.iter(w_t)).text = value
+
+    new_trs = []
+    for i, item in enumerate(rows_data):
+        new_tr = deepcopy(base_tr)
+        tcs = new_tr.tc_lst
+        if tcs:
+            set_text(tcs[0], str(i + 1))
+        item = item or {}
+        for k, tc_idx in targets:
+            set_text(tcs[tc_idx], str(item.get(k, "")))
+        new_trs.append(new_tr)
+    # шаблонная строка заменяется заполненными строками одной вставкой
+    tbl_el.remove(template_tr)
+    tbl_el.extend(new_trs)
+    return len(targets)
+
+
+def _iter_cell_paragraphs(docx):
+    for t_idx, t in enumerate(docx.tables):
+        for r_idx, row in enumerate(t.rows):
+            for c_idx, cell in enumerate(row.cells):
+                for p_idx, p in enumerate(cell.paragraphs):
+                    yield ("cell", t_idx, r_idx, c_idx, p_idx), p
+
+
+def _marker_variants(key):
+    # Поддерживаем несколько вариантов маркеров, с нечувствительностью к регистру
+    return [
+        f"{{{{__TABLE_{key}__}}}}",
+        f"__TABLE_{key}__",
+        f"<<TABLE_{key}>>",
+    ]
+
+
+def _locate_markers(docx, keys):
+    """Один проход по документу: для каждого ключа находит параграф-маркер или якорь.
+    Приоритет: точное совпадение параграфа верхнего уровня, вхождение маркера
+    в параграф верхнего уровня, якорь верхнего уровня, маркер/якорь в ячейках таблиц.
+    Возвращает {key: (kind, location)}, где kind — "marker" или "anchor".
+    """
+    markers_low = {k: [m.lower() for m in _marker_variants(k)] for k in keys}
+    exact, substr, anchor = {}, {}, None
+    for i, p in enumerate(docx.paragraphs):
+        low = (p.text or "").strip().lower()
+        if not low:
+            continue
+        for k, mls in markers_low.items():
+            if k not in exact and low in mls:
+                exact[k] = ("body", i)
+            if k not in substr and any(m in low for m in mls):
+                substr[k] = ("body", i)
+        if anchor is None and any(a in low for a in ANCHOR_KEYWORDS):
+            anchor = ("body", i)
+
+    found = {}
+    pending = []
+    for k in keys:
+        loc = exact.get(k) or substr.get(k)
+        if loc is not None:
+            found[k] = ("marker", loc)
+        elif anchor is not None:
+            found[k] = ("anchor", anchor)
+        else:
+            pending.append(k)
+
+    # Дополнительно ищем маркер/якорь внутри таблиц (ячейки)
+    if pending:
+        cell_anchor = None
+        for loc, p in _iter_cell_paragraphs(docx):
+            low = (p.text or "").strip().lower()
+            if not low:
                 continue
-            # определяем строку начала данных (первая строка, где первый столбец == '1')
-            data_start = None
-            for r in range(len(tbl.rows)):
-                try:
-                    cell0 = (tbl.rows[r].cells[0].text or "").strip()
-                except Exception:
-                    cell0 = ""
-                if cell0 == "1" or cell0.startswith("1"):
-                    data_start = r
-                    break
-            
-            # если нашли строку с данными, то заголовки - это всё, что выше неё
-            if data_start is not None:
-                header_rows_cnt = data_start
-            else:
-                # если не нашли строку с '1', ищем по заголовкам
-                header_rows_cnt = min(4, len(tbl.rows))
-                data_start = header_rows_cnt
-            
-            if data_start >= len(tbl.rows):
-                # нет строки данных — добавим одну
-                tbl.add_row()
-                data_start = len(tbl.rows) - 1
-            
-            # агрегируем текст только заголовочных строк по колонкам
-            cols_n = len(tbl.rows[0].cells)
-            col_texts = []
-            for c in range(cols_n):
-                agg = []
-                for r in range(header_rows_cnt):
-                    try:
-                        agg.append((tbl.rows[r].cells[c].text or "").lower())
-                    except Exception:
-                        pass
-                col_texts.append(" ".join(agg))
-
-            # построить маппинг колонок по заголовкам с приоритетами
-            mapping = {}
-            print(f"[tpl] Debug: Column texts: {col_texts}")
-            
-            # Сначала ищем точные соответствия (primary)
-            for idx, txt in enumerate(col_texts):
-                low = txt.lower()
-                for k, kw_dict in key_words.items():
-                    if k in mapping or idx in mapping.values():
-                        continue
-                    primary_kws = kw_dict.get("primary", [])
-                    # Проверяем все primary ключевые слова
-                    if any(kw in low for kw in primary_kws):
-                        mapping[k] = idx
-                        print(f"[tpl] Debug: Primary match - mapped column {idx} ('{txt}') to key '{k}'")
-                        break
-            
-            # Затем ищем по secondary, если не нашли primary
-            for idx, txt in enumerate(col_texts):
-                low = txt.lower()
-                for k, kw_dict in key_words.items():
-                    if k in mapping or idx in mapping.values():
-                        continue
-                    secondary_kws = kw_dict.get("secondary", [])
-                    # Для secondary требуем больше совпадений или специфичные слова
-                    if any(kw in low for kw in secondary_kws):
-                        # Дополнительная проверка для конфликтующих полей
-                        if k == "text_fio" and "музык" in low:
-                            continue
-                        if k == "music_fio" and "текст" in low:
-                            continue
-                        if k in ["pseudonym", "fonog_fio"] and "назван" in low and "title" not in mapping:
-                            continue
-                        mapping[k] = idx
-                        print(f"[tpl] Debug: Secondary match - mapped column {idx} ('{txt}') to key '{k}'")
-                        break
-            found_cols = len([k for k in meta["col_keys"] if k in mapping])
-            if found_cols < 2:
-                # слабое совпадение — попробуем использовать стандартный порядок колонок после №
-                # 0: №, 1:title, 2:music_fio, 3:text_fio, 4:pseudonym, 5:fonog_fio, 6:author_rights, 7:neighboring_rights, 8:year
-                default_order = ["title","music_fio","text_fio","pseudonym","fonog_fio","author_rights","neighboring_rights","year"]
-                for i, k in enumerate(default_order, start=1):
-                    if i < cols_n:
-                        mapping[k] = i
-                found_cols = len([k for k in meta["col_keys"] if k in mapping])
-                if found_cols < 2:
-                    # совсем не похоже на нужную таблицу — ищем дальше
-                    continue
+            for k in pending:
+                if k not in found and any(m in low for m in markers_low[k]):
+                    found[k] = ("marker", loc)
+            if cell_anchor is None and any(a in low for a in ANCHOR_KEYWORDS):
+                cell_anchor = loc
+            if all(k in found for k in pending):
+                break
+        for k in pending:
+            if k not in found and cell_anchor is not None:
+                found[k] = ("anchor", cell_anchor)
+    return found
 
-            # возьмём шаблон строки данных
-            template_row_idx = min(data_start, len(tbl.rows) - 1)
-            template_row = tbl.rows[template_row_idx]
-            base_tr = deepcopy(template_row._tr)
 
-            # удалим все строки ниже шаблонной (оставим одну шаблонную строку)
-            while len(tbl.rows) > template_row_idx + 1:
-                tr = tbl.rows[-1]._tr
-                tbl._tbl.remove(tr)
+def _resolve_location(docx, kind, loc, key):
+    """Находит параграф по сохранённому расположению и проверяет, что он всё ещё подходит."""
+    try:
+        if loc[0] == "body":
+            p = docx.paragraphs[loc[1]]
+        else:
+            _, t_idx, r_idx, c_idx, p_idx = loc
+            p = docx.tables[t_idx].rows[r_idx].cells[c_idx].paragraphs[p_idx]
+    except IndexError:
+        return None
+    low = (p.text or "").strip().lower()
+    if kind == "marker":
+        ok = any(m.lower() in low for m in _marker_variants(key))
+    else:
+        ok = any(a in low for a in ANCHOR_KEYWORDS)
+    return p if ok else None
+
+
+def _find_insert_point(docx, key, all_keys, entry):
+    """Параграф для вставки таблицы: (paragraph | None, is_marker)."""
+    cached = entry["markers"] if entry is not None else {}
+    hit = cached.get(key)
+    if hit is not None:
+        kind, loc = hit
+        p = _resolve_location(docx, kind, loc, key)
+        if p is not None:
+            return p, kind == "marker"
+
+    # кэшируем только найденные расположения: маркер может стоять в блоке {% if %},
+    # и его отсутствие в одном рендере ничего не говорит о следующих
+    # (устаревшее расположение безопасно — оно проверяется перед использованием)
+    located = _locate_markers(docx, all_keys)
+    cached.update(located)
+    hit = located.get(key)
+    if hit is None:
+        return None, False
+    kind, loc = hit
+    return _resolve_location(docx, kind, loc, key), kind == "marker"
+
+
+def _inject_tables_into_docx(docx: DocxDocument, arrays_meta: list, context: dict, entry=None):
+    """
+    Вставляет таблицы для полей-массивов.
+    Сначала пытается заполнить существующую таблицу шаблона (по заголовкам колонок).
+    Если в документе есть параграф с текстом {{__TABLE_<key>__}} (или __TABLE_<key>__ / <<TABLE_<key>>>),
+    таблица будет вставлена сразу после этого параграфа. Сам параграф не удаляется целиком —
+    маркер просто очищается.
 
-            # функция заполнения строки по mapping
-            def fill_row(row, i, item):
-                cells = row.cells
-                if len(cells) > 0:
-                    try:
-                        cells[0].text = str(i + 1)
-                    except Exception as ex:
-                        print(f"[tpl] Warning: Could not set row number: {ex}")
-                for k in meta["col_keys"]:
-                    if k not in mapping:
-                        print(f"[tpl] Debug: Key '{k}' not found in mapping")
-                        continue
-                    col_i = mapping[k]
-                    if col_i >= len(cells):
-                        print(f"[tpl] Debug: Column index {col_i} out of range (cells: {len(cells)})")
-                        continue
-                    try:
-                        value = str((item or {}).get(k, ""))
-                        cells[col_i].text = value
-                        print(f"[tpl] Debug: Set cell[{col_i}] (key={k}) = '{value}'")
-                    except Exception as ex:
-                        print(f"[tpl] Warning: Could not set cell[{col_i}] for key '{k}': {ex}")
-
-            # Проверяем, достаточно ли строк, и нужны ли дополнительные
-            if len(rows_data) > 0:
-                print(f"[tpl] Debug: Filling {len(rows_data)} rows of data")
-                print(f"[tpl] Debug: Template row index: {template_row_idx}")
-                print(f"[tpl] Debug: First row data: {rows_data[0]}")
-                
-                # заполняем первую строку данных (если она есть)
-                fill_row(tbl.rows[template_row_idx], 0, rows_data[0])
-                
-                # добавляем и заполняем остальные строки
-                for i in range(1, len(rows_data)):
-                    print(f"[tpl] Debug: Adding row {i+1} with data: {rows_data[i]}")
-                    # Клонируем шаблонную строку с сохранением форматирования
-                    new_tr = deepcopy(base_tr)
-                    # Вставляем новую строку после последней строки таблицы
-                    tbl._tbl.append(new_tr)
-                    # Получаем новую строку и заполняем её
-                    new_row = tbl.rows[-1]
-                    fill_row(new_row, i, rows_data[i])
-
-            print(f"[tpl] Populated existing table (heuristic) for key={meta['key']}, rows={len(rows_data)}, cols_mapped={found_cols}")
-            return True
-        return False
+    Если маркер не найден — пытаемся найти "якорь" по заголовку (например, содержит "перечень произведений")
+    и вставить после него. Если и якоря нет — добавим таблицу в конец документа.
 
+    entry — запись реестра шаблона: в ней кэшируются профили таблиц и расположение маркеров.
+    """
+    all_keys = [m["key"] for m in arrays_meta]
+    # профили из реестра описывают только что отрендеренный документ;
+    # после первой вставки/заполнения документ меняется и профили строятся заново
+    dirty = False
     for meta in arrays_meta:
         key = meta["key"]
         rows = context.get(key) or []
@@ -312,69 +769,27 @@ def _inject_tables_into_docx(doc_path: str, arrays_meta: list, context: dict):
 
         # Сначала пытаемся заполнить существующую таблицу
         try:
-            if _try_fill_existing_table(docx, meta, rows):
-                print(f"[tpl] Populated existing table for key={key}, rows={len(rows)}")
+            if dirty:
+                tables, profiles = docx.tables, _build_table_profiles(docx)
+            else:
+                tables, profiles = _table_profiles(docx, entry)
+            filled = False
+            for tbl, profile in zip(tables, profiles):
+                mapping = _match_table(profile, meta)
+                if mapping is None:
+                    continue
+                cols_mapped = _fill_existing_table(tbl, profile, mapping, meta, rows)
+                dirty = True
+                logger.info("[tpl] Populated existing table for key=%s, rows=%d, cols_mapped=%d",
+                            key, len(rows), cols_mapped)
+                filled = True
+                break
+            if filled:
                 continue
         except Exception as e:
-            print(f"[tpl] Existing table fill failed for key={key}: {e}")
+            logger.warning("[tpl] Existing table fill failed for key=%s: %s", key, e)
 
-        # Поддерживаем несколько вариантов маркеров, с нечувствительностью к регистру
-        markers = [
-            f"{{{{__TABLE_{key}__}}}}",
-            f"__TABLE_{key}__",
-            f"<<TABLE_{key}>>",
-        ]
-        markers_low = [m.lower() for m in markers]
-
-        target_para = None
-        anchor_para = None
-        anchor_keywords = [
-            "перечень произведений (таблица)",
-            "перечень произведений/исполнений/фонограмм",
-            "перечень произведений/исполнений",
-            "перечень произведений",
-            "перечень работ",
-        ]
-        anchor_keywords_low = [a.lower() for a in anchor_keywords]
-
-        # Ищем маркер (точное совпадение параграфа)
-        for p in paragraphs:
-            txt = normalize(p.text)
-            low_txt = txt.lower()
-            if low_txt in markers_low:
-                target_para = p
-                break
-        # Если не нашли — ищем вхождение токена как подстроки
-        if target_para is None:
-            for p in paragraphs:
-                txt = normalize(p.text)
-                low = txt.lower()
-                if any(m in low for m in markers_low):
-                    target_para = p
-                    break
-                if anchor_para is None and any(a in low for a in anchor_keywords_low):
-                    anchor_para = p
-
-        # Дополнительно ищем якорь внутри таблиц (ячейки)
-        if target_para is None and anchor_para is None:
-            try:
-                for t in docx.tables:
-                    for row in t.rows:
-                        for cell in row.cells:
-                            for p in cell.paragraphs:
-                                txt = normalize(p.text)
-                                low = txt.lower()
-                                if any(m in low for m in markers_low):
-                                    target_para = p
-                                    raise StopIteration
-                                if anchor_para is None and any(a in low for a in anchor_keywords_low):
-                                    anchor_para = p
-                # fallthrough
-            except StopIteration:
-                pass
-
-        # Определяем точку вставки
-        insert_after = target_para or anchor_para
+        insert_after, is_marker = _find_insert_point(docx, key, all_keys, entry)
 
         # Создаём таблицу: +1 колонка для номера
         cols_count = 1 + len(meta["col_keys"])  # No + headers
@@ -390,7 +805,7 @@ def _inject_tables_into_docx(doc_path: str, arrays_meta: list, context: dict):
         for i, header in enumerate(meta["headers"], start=1):
             hdr_cells[i].text = str(header)
 
-        # Данные (если нет строк, будет только заголовок)
+        # Данные
         for ridx in range(len(rows)):
             row_cells = table.rows[ridx + 1].cells
             row_cells[0].text = str(ridx + 1)
@@ -411,7 +826,7 @@ def _inject_tables_into_docx(doc_path: str, arrays_meta: list, context: dict):
             try:
                 insert_after._element.addnext(tbl_el)
                 placed = True
-            except Exception as e:
+            except Exception:
                 # Не удалось вставить рядом с параграфом (например, внутри сложной таблицы)
                 placed = False
         if not placed:
@@ -421,20 +836,17 @@ def _inject_tables_into_docx(doc_path: str, arrays_meta: list, context: dict):
                 placed = True
             except Exception:
                 placed = False
+        dirty = True
 
         # Очистить маркер в параграфе (если он был), без удаления параграфа
-        if placed and target_para is not None:
+        if placed and is_marker:
             try:
-                txt = target_para.text or ""
-                low = txt.lower()
-                for m, ml in zip(markers, markers_low):
-                    if ml in low:
-                        pattern = re.compile(re.escape(m), re.IGNORECASE)
-                        txt = pattern.sub("", txt)
-                target_para.text = txt
+                txt = insert_after.text or ""
+                for m in _marker_variants(key):
+                    txt = re.sub(re.escape(m), "", txt, flags=re.IGNORECASE)
+                insert_after.text = txt
             except Exception:
                 pass
 
-        print(f"[tpl] Injected table for key={key}, rows={len(rows)}, placed={'yes' if placed else 'no'}")
-
-    docx.save(doc_path)
+        logger.info("[tpl] Injected table for key=%s, rows=%d, placed=%s",
+                    key, len(rows), "yes" if placed else "no")
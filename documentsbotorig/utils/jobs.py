@@ -0,0 +1,209 @@
+import asyncio
+import itertools
+import logging
+
+from aiogram.exceptions import TelegramBadRequest
+
+from config import GENERATION_WORKERS, GENERATION_PER_USER_LIMIT
+from keyboards import job_cancel_kb
+from utils import tracing
+from utils.packages import render_package
+from utils.sandbox import render_docx, convert_to_pdf, SandboxCrashed, SandboxTimeout
+
+logger = logging.getLogger(__name__)
+
+# Приоритеты заданий: меньше — раньше
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 10
+
+STATUS_TEXTS = {
+    "queued": "⏳ В очереди на генерацию…",
+    "rendering": "📝 Формирую документ…",
+    "converting": "📄 Конвертирую в PDF…",
+    "sending": "📤 Отправляю файлы…",
+    "done": "✅ Файлы сгенерированы и отправлены.",
+    "done_no_pdf": "✅ DOCX отправлен, но PDF создать не удалось.",
+    "cancelled": "❌ Генерация отменена.",
+    "failed": "⚠️ Не удалось сгенерировать документ. Попробуйте ещё раз или обратитесь к администратору.",
+}
+FINAL_STATUSES = {"done", "done_no_pdf", "cancelled", "failed"}
+
+
+class QueueLimitError(Exception):
+    """Пользователь превысил лимит одновременных заданий."""
+
+
+class GenerationJob:
+    def __init__(self, job_id, user_id, template_slug, context, priority, deliver, prepared=None,
+                 template_version=None, package=None):
+        self.id = job_id
+        self.user_id = user_id
+        self.template_slug = template_slug
+        # версия шаблона, с которой заполнялся мастер (см. TemplateRegistry)
+        self.template_version = template_version
+        self.context = context
+        self.priority = priority
+        # deliver(docx_bytes, pdf_bytes) — корутина отправки результата пользователю;
+        # для пакета — deliver(zip_bytes)
+        self.deliver = deliver
+        # пакет шаблонов {slug: version_id}: все документы уходят одним ZIP
+        self.package = package
+        # PreparedDocument из utils.preview: файлы, подготовленные на шаге предпросмотра
+        self.prepared = prepared
+        self.status = "queued"
+        self.status_message = None
+        self.error = None
+
+    @property
+    def cancelled(self):
+        return self.status == "cancelled"
+
+
+class GenerationQueue:
+    """Очередь генерации документов.
+
+    Ограничивает число одновременно работающих генераций (workers),
+    упорядочивает задания по приоритету и не даёт одному пользователю
+    занять очередь больше чем per_user_limit заданиями.
+    Рендер и конвертация идут в песочнице (utils.sandbox): в отдельных процессах
+    с лимитами памяти и времени, не блокируя event loop.
+    """
+
+    def __init__(self, workers=2, per_user_limit=1):
+        self.workers = max(1, workers)
+        self.per_user_limit = max(1, per_user_limit)
+        self._queue = None
+        self._tasks = []
+        self._jobs = {}
+        self._ids = itertools.count(1)
+        self._seq = itertools.count()
+
+    async def start(self):
+        if self._tasks:
+            return
+        self._queue = asyncio.PriorityQueue()
+        self._tasks = [asyncio.create_task(self._worker(i)) for i in range(self.workers)]
+        logger.info("Generation queue started: workers=%d, per_user_limit=%d",
+                    self.workers, self.per_user_limit)
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def active_jobs(self, user_id):
+        return [j for j in self._jobs.values() if j.user_id == user_id]
+
+    async def submit(self, message, user_id, template_slug, context, deliver, priority=PRIORITY_NORMAL,
+                     prepared=None, template_version=None, package=None):
+        """Ставит задание в очередь и отправляет статусное сообщение с кнопкой отмены."""
+        if len(self.active_jobs(user_id)) >= self.per_user_limit:
+            raise QueueLimitError()
+        await self.start()
+
+        job = GenerationJob(
+            next(self._ids), user_id, template_slug, context, priority, deliver, prepared, template_version,
+            package,
+        )
+        self._jobs[job.id] = job
+        job.status_message = await message.answer(
+            STATUS_TEXTS["queued"], reply_markup=job_cancel_kb(job.id)
+        )
+        await self._queue.put((priority, next(self._seq), job))
+        return job
+
+    async def cancel(self, job_id, user_id):
+        """Отменяет задание пользователя. Уже идущий этап дорабатывает, но результат не отправляется."""
+        job = self._jobs.get(job_id)
+        if job is None or job.user_id != user_id:
+            return False
+        if job.status in FINAL_STATUSES or job.status == "sending":
+            return False
+        await self._set_status(job, "cancelled")
+        self._jobs.pop(job.id, None)
+        return True
+
+    async def _set_status(self, job, status):
+        job.status = status
+        if job.status_message is None:
+            return
+        text = STATUS_TEXTS[status]
+        if status == "failed" and job.error:
+            text = f"{text}\n{job.error}"
+        markup = None if status in FINAL_STATUSES else job_cancel_kb(job.id)
+        try:
+            await job.status_message.edit_text(text, reply_markup=markup)
+        except TelegramBadRequest:
+            # сообщение не изменилось или уже удалено
+            pass
+
+    async def _worker(self, n):
+        while True:
+            _, _, job = await self._queue.get()
+            try:
+                if not job.cancelled:
+                    await self._run(job)
+            except Exception as e:
+                logger.exception("Generation job %s failed", job.id)
+                # пользователю — только понятные причины (таймаут, сбой песочницы): текст
+                # остальных исключений может содержать пути к шаблонам и детали сервера
+                job.error = str(e) if isinstance(e, (SandboxTimeout, SandboxCrashed)) else None
+                await self._set_status(job, "failed")
+            finally:
+                self._jobs.pop(job.id, None)
+                self._queue.task_done()
+
+    async def _run(self, job):
+        if job.package:
+            await self._run_package(job)
+            return
+        files = await self._prepared_files(job) if job.prepared is not None else None
+        if job.cancelled:
+            return
+        with tracing.trace(job.template_slug, job_id=job.id, priority=job.priority):
+            if files is not None:
+                docx_bytes, pdf_bytes = files
+            else:
+                await self._set_status(job, "rendering")
+                docx_bytes = await render_docx(job.template_slug, job.context, job.template_version)
+                if job.cancelled:
+                    return
+                await self._set_status(job, "converting")
+                pdf_bytes = await convert_to_pdf(docx_bytes, job.template_slug)
+                if job.cancelled:
+                    return
+            await self._set_status(job, "sending")
+            with tracing.span("send", bytes=len(docx_bytes) + len(pdf_bytes or b"")):
+                await job.deliver(docx_bytes, pdf_bytes)
+            await self._set_status(job, "done" if pdf_bytes else "done_no_pdf")
+
+    async def _run_package(self, job):
+        with tracing.trace(job.template_slug, job_id=job.id, priority=job.priority, package=len(job.package)):
+            await self._set_status(job, "rendering")
+            zip_bytes = await render_package(job.package, job.context)
+            if job.cancelled:
+                return
+            await self._set_status(job, "sending")
+            with tracing.span("send", bytes=len(zip_bytes)):
+                await job.deliver(zip_bytes)
+            await self._set_status(job, "done")
+
+    async def _prepared_files(self, job):
+        """Файлы, подготовленные в фоне; None — если подготовка не удалась и нужно рендерить заново."""
+        if not job.prepared.task.done():
+            await self._set_status(job, "rendering")
+        try:
+            return await job.prepared.files()
+        except asyncio.CancelledError:
+            if not job.prepared.task.cancelled():
+                raise
+        except Exception as e:
+            logger.warning("Prepared document for job %s failed, rendering again: %s", job.id, e)
+        return None
+
+
+generation_queue = GenerationQueue(
+    workers=GENERATION_WORKERS,
+    per_user_limit=GENERATION_PER_USER_LIMIT,
+)
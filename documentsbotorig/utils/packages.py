@@ -0,0 +1,50 @@
+import asyncio
+import io
+import zipfile
+from copy import deepcopy
+from datetime import datetime
+
+from utils.file_utils import get_template_entry
+from utils.sandbox import render_docx, convert_to_pdf
+
+
+def package_fields(versions):
+    """Общий список полей пакета: поля всех шаблонов по порядку, одинаковые ключи — один раз.
+    versions — {slug: version_id} в порядке шаблонов пакета.
+    """
+    fields, seen = [], set()
+    for slug, version_id in versions.items():
+        for f in get_template_entry(slug, version_id)["config"].get("fields", []):
+            if f["key"] not in seen:
+                seen.add(f["key"])
+                fields.append(f)
+    return fields
+
+
+async def _render_one(slug, version_id, context):
+    docx_bytes = await render_docx(slug, deepcopy(context), version_id)
+    pdf_bytes = await convert_to_pdf(docx_bytes, slug)
+    return slug, docx_bytes, pdf_bytes
+
+
+async def render_package(versions, context):
+    """Рендерит все шаблоны пакета параллельно и складывает DOCX/PDF в один ZIP в памяти.
+    Документы пишутся в архив по мере готовности. Возвращает байты ZIP.
+    """
+    buf = io.BytesIO()
+    stamp = datetime.now().timetuple()[:6]
+    tasks = [asyncio.create_task(_render_one(s, v, context)) for s, v in versions.items()]
+    try:
+        with zipfile.ZipFile(buf, "w") as zf:
+            for done in asyncio.as_completed(tasks):
+                slug, docx_bytes, pdf_bytes = await done
+                # DOCX уже сжат внутри, повторно не сжимаем
+                zf.writestr(zipfile.ZipInfo(f"{slug}.docx", stamp), docx_bytes, compress_type=zipfile.ZIP_STORED)
+                if pdf_bytes:
+                    zf.writestr(zipfile.ZipInfo(f"{slug}.pdf", stamp), pdf_bytes, compress_type=zipfile.ZIP_DEFLATED)
+    finally:
+        # ошибка одного документа (или отмена задания) останавливает остальные рендеры
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+    return buf.getvalue()
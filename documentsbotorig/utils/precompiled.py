@@ -0,0 +1,102 @@
+"""Предсобранные шаблоны (артефакты `python scripts/templates.py build`).
+
+Артефакт лежит в templates/<slug>/build/:
+  - template.docx  — шаблон после автоисправления фигурных скобок;
+  - compiled.json  — результат docxtpl.patch_xml для каждой части документа
+                     (по sha1 исходного XML) и метаданные сборки.
+Бот подхватывает артефакт, только если хэши исходного шаблона и fields.json совпадают.
+"""
+import hashlib
+import json
+import logging
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+from docxtpl import DocxTemplate
+from jinja2 import Environment
+
+logger = logging.getLogger(__name__)
+
+BUILD_DIR_NAME = "build"
+COMPILED_NAME = "compiled.json"
+ARTIFACT_FORMAT = 1
+
+
+def xml_digest(xml: str) -> str:
+    return hashlib.sha1(xml.encode("utf-8")).hexdigest()
+
+
+def file_digest(path: Path) -> str:
+    return hashlib.sha256(Path(path).read_bytes()).hexdigest()
+
+
+def load_artifact(slug_dir: Path, source_path: Path, fields_path: Path):
+    """Возвращает (путь к собранному docx, данные compiled.json) или None, если артефакт устарел."""
+    build_dir = slug_dir / BUILD_DIR_NAME
+    compiled_path = build_dir / COMPILED_NAME
+    docx_path = build_dir / "template.docx"
+    if not compiled_path.exists() or not docx_path.exists():
+        return None
+    try:
+        with open(compiled_path, "r", encoding="utf-8") as f:
+            compiled = json.load(f)
+    except (OSError, ValueError) as e:
+        logger.warning("Broken template artifact %s: %s", compiled_path, e)
+        return None
+    if compiled.get("format") != ARTIFACT_FORMAT:
+        return None
+    source = compiled.get("source") or {}
+    if source.get("name") != source_path.name or source.get("sha256") != file_digest(source_path):
+        logger.info("Template artifact for %s is stale (template changed)", slug_dir.name)
+        return None
+    fields_sha = file_digest(fields_path) if fields_path.exists() else None
+    if compiled.get("fields_sha256") != fields_sha:
+        logger.info("Template artifact for %s is stale (fields.json changed)", slug_dir.name)
+        return None
+    return docx_path, compiled
+
+
+class PrecompiledDocxTemplate(DocxTemplate):
+    """DocxTemplate, который берёт результат patch_xml из артефакта сборки.
+    Если XML части не совпал с собранным (другая версия python-docx и т.п.) —
+    выполняется обычный patch_xml.
+    """
+
+    def __init__(self, template_file, patched=None):
+        super().__init__(template_file)
+        self.patched = patched or {}
+
+    def patch_xml(self, src_xml):
+        patched = self.patched.get(xml_digest(src_xml)) if self.patched else None
+        if patched is None:
+            return super().patch_xml(src_xml)
+        return patched
+
+
+class CachingEnvironment(Environment):
+    """Jinja-окружение, которое компилирует каждый исходник один раз."""
+
+    def __init__(self, *args, cache_size=64, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._compiled = OrderedDict()
+        self._compiled_lock = threading.Lock()
+        self._compiled_size = cache_size
+
+    def from_string(self, source, globals=None, template_class=None):
+        if globals or template_class or not isinstance(source, str):
+            return super().from_string(source, globals, template_class)
+        with self._compiled_lock:
+            template = self._compiled.get(source)
+            if template is not None:
+                self._compiled.move_to_end(source)
+                return template
+        template = super().from_string(source)
+        with self._compiled_lock:
+            self._compiled[source] = template
+            while len(self._compiled) > self._compiled_size:
+                self._compiled.popitem(last=False)
+        return template
+
+
+jinja_env = CachingEnvironment()
@@ -0,0 +1,135 @@
+import asyncio
+import hashlib
+import io
+import json
+import logging
+from collections import OrderedDict
+
+from config import PREVIEW_IMAGES, PREVIEW_DPI
+from utils import tracing
+from utils.sandbox import render_docx, convert_to_pdf
+
+logger = logging.getLogger(__name__)
+
+# сколько подготовленных документов держать в памяти одновременно
+PREPARED_LIMIT = 100
+
+
+def render_first_page_png(pdf_bytes, dpi=PREVIEW_DPI):
+    """Первая страница PDF в PNG (низкое разрешение для предпросмотра).
+    Возвращает None, если pypdfium2 не установлен или PDF не читается.
+    """
+    try:
+        import pypdfium2 as pdfium
+    except ImportError:
+        return None
+    pdf = pdfium.PdfDocument(pdf_bytes)
+    try:
+        if len(pdf) == 0:
+            return None
+        page = pdf[0]
+        image = page.render(scale=dpi / 72).to_pil()
+        page.close()
+    finally:
+        pdf.close()
+    buf = io.BytesIO()
+    image.save(buf, format="PNG", optimize=True)
+    return buf.getvalue()
+
+
+def context_key(template_slug, context, version_id=None):
+    """Хэш шаблона (и его версии) и ответов пользователя: одинаковый контекст — одинаковый документ."""
+    raw = json.dumps([template_slug, version_id, context], sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+
+class PreparedDocument:
+    """Документ, который готовится в фоне, пока пользователь смотрит предпросмотр."""
+
+    def __init__(self, template_slug, key, task):
+        self.template_slug = template_slug
+        self.key = key
+        self.task = task  # -> (docx_bytes, pdf_bytes | None, png_bytes | None)
+
+    def failed(self):
+        return self.task.done() and (self.task.cancelled() or self.task.exception() is not None)
+
+    async def files(self):
+        docx_bytes, pdf_bytes, _ = await self.task
+        return docx_bytes, pdf_bytes
+
+
+class PreparedDocuments:
+    """Спекулятивная подготовка документов, кэш по хэшу контекста.
+
+    Рендер и конвертация запускаются, как только получен ответ на последнее поле.
+    У пользователя один текущий документ: если ответы изменились, старый результат
+    отбрасывается (задача отменяется), а подтверждение получает файлы, только если
+    хэш контекста совпал.
+    """
+
+    def __init__(self, limit=PREPARED_LIMIT):
+        self._items = OrderedDict()  # key -> PreparedDocument
+        self._users = {}  # user_id -> key
+        self._limit = limit
+
+    def start(self, user_id, template_slug, context, version_id=None):
+        """Запускает подготовку (или возвращает уже идущую для того же контекста).
+        Возвращает (PreparedDocument, True если подготовка только что запущена).
+        """
+        key = context_key(template_slug, context, version_id)
+        if self._users.get(user_id, key) != key:
+            self.discard(user_id)
+        self._users[user_id] = key
+        prepared = self._items.get(key)
+        if prepared is not None and not prepared.failed():
+            self._items.move_to_end(key)
+            return prepared, False
+        task = asyncio.create_task(self._prepare(template_slug, context, version_id))
+        prepared = PreparedDocument(template_slug, key, task)
+        self._items[key] = prepared
+        while len(self._items) > self._limit:
+            old_key, old = self._items.popitem(last=False)
+            old.task.cancel()
+            for uid in [u for u, k in self._users.items() if k == old_key]:
+                del self._users[uid]
+        return prepared, True
+
+    def get(self, user_id, template_slug, context, version_id=None):
+        """Подготовленный документ пользователя, если он сделан ровно для этого контекста."""
+        key = self._users.get(user_id)
+        if key is None or key != context_key(template_slug, context, version_id):
+            return None
+        return self._items.get(key)
+
+    def release(self, user_id):
+        """Убирает документ из реестра, не отменяя подготовку (его забрала очередь генерации)."""
+        key = self._users.pop(user_id, None)
+        if key is not None and key not in self._users.values():
+            self._items.pop(key, None)
+
+    def discard(self, user_id):
+        """Отбрасывает документ пользователя (ответы изменились или мастер начат заново)."""
+        key = self._users.pop(user_id, None)
+        if key is None or key in self._users.values():
+            return
+        prepared = self._items.pop(key, None)
+        if prepared is not None:
+            prepared.task.cancel()
+
+    async def _prepare(self, template_slug, context, version_id=None):
+        with tracing.trace(template_slug, prepared=True):
+            docx_bytes = await render_docx(template_slug, context, version_id)
+            pdf_bytes = await convert_to_pdf(docx_bytes, template_slug)
+            png_bytes = None
+            if PREVIEW_IMAGES and pdf_bytes:
+                with tracing.span("preview_png") as s:
+                    try:
+                        png_bytes = await asyncio.to_thread(render_first_page_png, pdf_bytes)
+                    except Exception as e:
+                        logger.warning("Preview image for %s failed: %s", template_slug, e)
+                    s.set(bytes=len(png_bytes) if png_bytes else 0)
+        return docx_bytes, pdf_bytes, png_bytes
+
+
+prepared_documents = PreparedDocuments()
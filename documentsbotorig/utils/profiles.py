@@ -0,0 +1,160 @@
+import asyncio
+import json
+import sqlite3
+import threading
+import time
+
+from config import PROFILES_PATH
+from utils.state import get_nested_value, set_nested_value
+from utils.validators import validate_field
+
+# Из какого поля берётся имя профиля (первое заполненное)
+PROFILE_NAME_KEYS = ["fio", "music_fio", "text_fio", "fonog_fio"]
+SEARCH_LIMIT = 20
+
+
+def profile_fields(fields):
+    """Поля шаблона, которые сохраняются в профиль и заполняются из него.
+    Только поля человека, явно отмеченные "profile": true в fields.json:
+    по типу их не отличить от полей договора (название трека, дата).
+    """
+    return [f for f in fields if f.get("type") != "array" and f.get("profile") is True]
+
+
+def extract_profile(fields, values):
+    """Значения профильных полей из ответов мастера: {key: value}."""
+    profile = {}
+    for f in profile_fields(fields):
+        value = get_nested_value(values, f["key"])
+        if value not in (None, ""):
+            profile[f["key"]] = value
+    return profile
+
+
+def profile_name(profile):
+    for key in PROFILE_NAME_KEYS:
+        if profile.get(key):
+            return str(profile[key])
+    return next((str(v) for v in profile.values() if isinstance(v, str) and v), None)
+
+
+def apply_profile(fields, values, profile):
+    """Заполняет пустые ответы значениями профиля (только подходящие по типу/вариантам);
+    уже введённые пользователем значения не меняются. Мастер всё равно спрашивает эти поля,
+    предлагая значение из профиля по умолчанию. Возвращает число заполненных полей.
+    """
+    filled = 0
+    for f in profile_fields(fields):
+        value = profile.get(f["key"])
+        if value in (None, "") or get_nested_value(values, f["key"]) not in (None, ""):
+            continue
+        options = f.get("options")
+        if f.get("type") == "select" and isinstance(options, list) and options:
+            if value not in options:
+                continue
+        elif f.get("type") == "bool":
+            if value not in ("Да", "Нет"):
+                continue
+        elif not validate_field(str(value), f.get("type", "string")):
+            continue
+        set_nested_value(values, f["key"], value)
+        filled += 1
+    return filled
+
+
+class ProfileStore:
+    """Сохранённые профили (ФИО, паспорт и т.п.) каждого пользователя Telegram в SQLite.
+
+    Имя профиля хранится ещё и в нормализованном виде (name_key) с индексом
+    (user_id, name_key): поиск по префиксу — это диапазонный проход по индексу.
+    """
+
+    def __init__(self, path: str):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS profiles ("
+            " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+            " user_id INTEGER NOT NULL,"
+            " name TEXT NOT NULL,"
+            " name_key TEXT NOT NULL,"
+            " data TEXT NOT NULL,"
+            " updated_at REAL NOT NULL"
+            ")"
+        )
+        self._conn.execute(
+            "CREATE UNIQUE INDEX IF NOT EXISTS profiles_user_name ON profiles (user_id, name_key)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS profiles_user_updated ON profiles (user_id, updated_at)"
+        )
+
+    @staticmethod
+    def _key(name):
+        return " ".join(name.casefold().split())
+
+    @staticmethod
+    def _row(row):
+        return {"id": row[0], "name": row[1], "data": json.loads(row[2])}
+
+    def _save(self, user_id, name, data):
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO profiles (user_id, name, name_key, data, updated_at) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT(user_id, name_key) DO UPDATE SET "
+                " name = excluded.name, data = excluded.data, updated_at = excluded.updated_at",
+                (user_id, name, self._key(name), json.dumps(data, ensure_ascii=False), time.time()),
+            )
+            row = self._conn.execute(
+                "SELECT id FROM profiles WHERE user_id = ? AND name_key = ?", (user_id, self._key(name))
+            ).fetchone()
+        return row[0]
+
+    def _search(self, user_id, prefix, limit):
+        key = self._key(prefix)
+        with self._lock:
+            if key:
+                rows = self._conn.execute(
+                    "SELECT id, name, data FROM profiles"
+                    " WHERE user_id = ? AND name_key >= ? AND name_key < ?"
+                    " ORDER BY name_key LIMIT ?",
+                    (user_id, key, key + "\uffff", limit),
+                ).fetchall()
+            else:
+                rows = self._conn.execute(
+                    "SELECT id, name, data FROM profiles WHERE user_id = ?"
+                    " ORDER BY updated_at DESC LIMIT ?",
+                    (user_id, limit),
+                ).fetchall()
+        return [self._row(r) for r in rows]
+
+    def _get(self, user_id, profile_id):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT id, name, data FROM profiles WHERE user_id = ? AND id = ?", (user_id, profile_id)
+            ).fetchone()
+        return self._row(row) if row else None
+
+    def _delete(self, user_id, profile_id):
+        with self._lock:
+            cur = self._conn.execute("DELETE FROM profiles WHERE user_id = ? AND id = ?", (user_id, profile_id))
+        return cur.rowcount > 0
+
+    async def save(self, user_id, name, data):
+        """Создаёт или обновляет профиль с таким именем. Возвращает id."""
+        return await asyncio.to_thread(self._save, user_id, name, data)
+
+    async def search(self, user_id, prefix="", limit=SEARCH_LIMIT):
+        """Профили пользователя по началу имени (пустой префикс — последние изменённые)."""
+        return await asyncio.to_thread(self._search, user_id, prefix, limit)
+
+    async def get(self, user_id, profile_id):
+        return await asyncio.to_thread(self._get, user_id, profile_id)
+
+    async def delete(self, user_id, profile_id):
+        return await asyncio.to_thread(self._delete, user_id, profile_id)
+
+
+profile_store = ProfileStore(PROFILES_PATH)
@@ -0,0 +1,210 @@
+import asyncio
+import logging
+import os
+import signal
+import subprocess
+import sys
+import threading
+from pathlib import Path
+
+from config import (
+    SANDBOX_WORKERS, SANDBOX_MEMORY_MB, SANDBOX_CPU_SECONDS, RENDER_TIMEOUT, CONVERT_TIMEOUT,
+)
+from utils import file_utils, tracing
+from utils.sandbox_worker import read_frame, write_frame
+
+logger = logging.getLogger(__name__)
+
+PROJECT_DIR = Path(__file__).resolve().parent.parent
+
+
+class SandboxError(Exception):
+    """Рендер или конвертация в рабочем процессе не удались; текст — для пользователя."""
+
+
+class SandboxTimeout(SandboxError):
+    pass
+
+
+class SandboxCrashed(SandboxError):
+    pass
+
+
+def _crash_reason(returncode):
+    if returncode is None:
+        return "рабочий процесс перестал отвечать"
+    if os.name != "nt" and returncode == -signal.SIGXCPU:
+        return "превышен лимит процессорного времени"
+    if os.name != "nt" and returncode == -signal.SIGKILL:
+        return "процесс остановлен (вероятно, не хватило памяти)"
+    return f"рабочий процесс завершился с кодом {returncode}"
+
+
+class SandboxWorker:
+    """Один процесс python -m utils.sandbox_worker со своей группой процессов:
+    при убийстве вместе с ним гибнут и запущенные им soffice.
+    """
+
+    def __init__(self, memory_mb):
+        env = dict(os.environ)
+        env["PYTHONPATH"] = os.pathsep.join(filter(None, [str(PROJECT_DIR), env.get("PYTHONPATH")]))
+        self.process = subprocess.Popen(
+            [sys.executable, "-m", "utils.sandbox_worker", str(memory_mb)],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, env=env,
+            start_new_session=os.name != "nt",
+        )
+        self._timed_out = False
+
+    def alive(self):
+        return self.process.poll() is None
+
+    def call(self, task, timeout):
+        """Отправляет задание и ждёт ответ не дольше timeout секунд (блокирующий вызов)."""
+        self._timed_out = False
+        timer = threading.Timer(timeout, self._expire)
+        timer.start()
+        try:
+            write_frame(self.process.stdin, task)
+            reply = read_frame(self.process.stdout)
+        except (OSError, EOFError):
+            reply = None
+        finally:
+            timer.cancel()
+        if reply is None:
+            self.kill()
+            if self._timed_out:
+                raise SandboxTimeout(f"превышено время ожидания ({timeout:.0f} с)")
+            raise SandboxCrashed(_crash_reason(self.process.returncode))
+        return reply
+
+    def _expire(self):
+        self._timed_out = True
+        self.kill()
+
+    def kill(self):
+        if self.process.poll() is None:
+            try:
+                if os.name != "nt":
+                    os.killpg(self.process.pid, signal.SIGKILL)
+                else:
+                    self.process.kill()
+            except ProcessLookupError:
+                pass
+        self.process.wait()
+
+    def close(self, timeout=5):
+        try:
+            self.process.stdin.close()
+            self.process.wait(timeout=timeout)
+        except (OSError, subprocess.TimeoutExpired):
+            self.kill()
+
+
+class SandboxPool:
+    """Пул рабочих процессов для рендера docxtpl и конвертации в PDF.
+
+    Каждый процесс ограничен по памяти (RLIMIT_AS) и процессорному времени на задание
+    (RLIMIT_CPU), а каждое задание — по времени ожидания. Зависший или упавший процесс
+    убивается вместе с дочерними и заменяется новым, а вызывающий получает SandboxError —
+    так один плохой шаблон не кладёт бота. size=0 — старое поведение: потоки бота.
+    """
+
+    def __init__(self, size=SANDBOX_WORKERS, memory_mb=SANDBOX_MEMORY_MB, cpu_seconds=SANDBOX_CPU_SECONDS):
+        self.size = max(0, size)
+        self.memory_mb = memory_mb
+        self.cpu_seconds = cpu_seconds
+        self._idle = None
+        self._workers = set()
+        self._closed = False
+
+    def _spawn(self):
+        worker = SandboxWorker(self.memory_mb)
+        self._workers.add(worker)
+        return worker
+
+    async def start(self):
+        if self._idle is not None or self.size == 0:
+            return
+        self._closed = False
+        self._idle = asyncio.Queue()
+        for _ in range(self.size):
+            self._idle.put_nowait(self._spawn())
+        logger.info("Sandbox started: workers=%d, memory=%d MB, cpu=%d s",
+                    self.size, self.memory_mb, self.cpu_seconds)
+
+    async def stop(self):
+        self._closed = True
+        workers, self._workers = list(self._workers), set()
+        self._idle = None
+        await asyncio.gather(*(asyncio.to_thread(w.close) for w in workers))
+
+    async def call(self, kind, args, timeout, pinned=None):
+        """Выполняет задание kind ("render" | "convert") в свободном процессе.
+        pinned — (slug, запись реестра): отправляется, если у процесса нет этой версии шаблона.
+        """
+        await self.start()
+        worker = await self._idle.get()
+        loop = asyncio.get_running_loop()
+        task = (kind, args, self.cpu_seconds, tracing.active(), None)
+        # процесс возвращается в пул из потока, когда задание действительно закончилось,
+        # даже если ожидающая корутина уже отменена
+        return await asyncio.to_thread(self._execute, loop, self._idle, worker, task, timeout, pinned)
+
+    def _execute(self, loop, idle, worker, task, timeout, pinned=None):
+        try:
+            if not worker.alive():
+                logger.warning("Sandbox worker %d exited (code %s), restarting",
+                               worker.process.pid, worker.process.returncode)
+                worker = self._replace(worker)
+                if worker is None:
+                    raise SandboxCrashed("песочница остановлена")
+            status, result, spans = worker.call(task, timeout)
+            if status == "missing" and pinned is not None:
+                status, result, spans = worker.call(task[:-1] + (pinned,), timeout)
+        except SandboxError as e:
+            if worker is not None:
+                logger.warning("Sandbox worker %d failed on %s: %s", worker.process.pid, task[0], e)
+                worker = self._replace(worker)
+            raise
+        finally:
+            if worker is not None:
+                loop.call_soon_threadsafe(idle.put_nowait, worker)
+        tracing.merge(spans)
+        if status == "error":
+            raise SandboxError(result)
+        if status == "missing":
+            raise SandboxError("версия шаблона недоступна")
+        return result
+
+    def _replace(self, worker):
+        self._workers.discard(worker)
+        if self._closed:
+            return None
+        return self._spawn()
+
+
+sandbox_pool = SandboxPool()
+
+
+async def render_docx(template_slug, context, version_id=None):
+    """Рендер DOCX в песочнице. Ошибки шаблона, таймаут и превышение лимитов — SandboxError."""
+    if sandbox_pool.size == 0:
+        return await asyncio.to_thread(file_utils.render_docx, template_slug, context, version_id)
+    # версию выбирает реестр бота: у рабочего процесса свой реестр, и прежних версий
+    # (с которыми начаты мастера) в нём может не быть — тогда запись уйдёт вместе с заданием
+    entry = file_utils.get_template_entry(template_slug, version_id)
+    return await sandbox_pool.call(
+        "render", (template_slug, context, entry["version_id"]), RENDER_TIMEOUT,
+        pinned=(template_slug, entry),
+    )
+
+
+async def convert_to_pdf(docx_bytes, template_slug=None):
+    """Конвертация в PDF в песочнице. None, если PDF сделать не удалось (DOCX всё равно отправляется)."""
+    if sandbox_pool.size == 0:
+        return await asyncio.to_thread(file_utils.convert_to_pdf, docx_bytes, template_slug)
+    try:
+        return await sandbox_pool.call("convert", (docx_bytes, template_slug), CONVERT_TIMEOUT)
+    except SandboxError as e:
+        logger.warning("PDF conversion for %s failed in sandbox: %s", template_slug, e)
+        return None
@@ -0,0 +1,112 @@
+"""Рабочий процесс песочницы рендера и конвертации (запускается из utils.sandbox).
+
+    python -m utils.sandbox_worker <memory_mb>
+
+Задания читаются из stdin, ответы пишутся в stdout кадрами: 4 байта длины + pickle.
+Модуль не импортирует config.py и бота — только utils.file_utils.
+"""
+import logging
+import os
+import pickle
+import struct
+import sys
+
+try:
+    import resource
+except ImportError:  # Windows: лимиты не поддерживаются, остаётся только таймаут
+    resource = None
+
+_HEADER = struct.Struct("!I")
+
+
+def read_frame(stream):
+    header = stream.read(_HEADER.size)
+    if len(header) < _HEADER.size:
+        return None
+    size = _HEADER.unpack(header)[0]
+    payload = stream.read(size)
+    if len(payload) < size:
+        return None
+    return pickle.loads(payload)
+
+
+def write_frame(stream, obj):
+    payload = pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL)
+    stream.write(_HEADER.pack(len(payload)) + payload)
+    stream.flush()
+
+
+def _limit_memory(memory_mb):
+    """Ограничивает адресное пространство процесса (наследуется и soffice)."""
+    if resource is None or memory_mb <= 0:
+        return
+    _, hard = resource.getrlimit(resource.RLIMIT_AS)
+    limit = memory_mb * 1024 * 1024
+    if hard != resource.RLIM_INFINITY:
+        limit = min(limit, hard)
+    resource.setrlimit(resource.RLIMIT_AS, (limit, hard))
+
+
+def _limit_cpu(cpu_seconds):
+    """Даёт заданию cpu_seconds процессорного времени сверх уже израсходованного.
+    RLIMIT_CPU считается на весь процесс, поэтому мягкий лимит сдвигается перед каждым
+    заданием; при превышении ядро присылает SIGXCPU и процесс завершается.
+    """
+    if resource is None or cpu_seconds <= 0:
+        return
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    soft = int(usage.ru_utime + usage.ru_stime) + 1 + int(cpu_seconds)
+    _, hard = resource.getrlimit(resource.RLIMIT_CPU)
+    if hard != resource.RLIM_INFINITY:
+        soft = min(soft, hard)
+    resource.setrlimit(resource.RLIMIT_CPU, (soft, hard))
+
+
+def main():
+    memory_mb = int(sys.argv[1]) if len(sys.argv) > 1 else 0
+    # stdout занят протоколом: логи и print() рабочего процесса уходят в stderr (лог бота)
+    proto_in = sys.stdin.buffer
+    proto_out = os.fdopen(os.dup(1), "wb")
+    os.dup2(2, 1)
+    logging.basicConfig(
+        level=logging.INFO, format="%(asctime)s sandbox[%(process)d] %(levelname)s %(name)s: %(message)s",
+    )
+
+    _limit_memory(memory_mb)
+    from utils import file_utils, tracing
+
+    tasks = {
+        "render": file_utils.render_docx,
+        "convert": file_utils.convert_to_pdf,
+    }
+    registry = file_utils.template_registry
+    while True:
+        task = read_frame(proto_in)
+        if task is None:
+            return
+        kind, args, cpu_seconds, traced, pinned = task
+        _limit_cpu(cpu_seconds)
+        spans = []
+        try:
+            # свой снимок шаблонов: подхватываем правки так же, как watcher в боте
+            if registry.changed():
+                registry.reload()
+            if pinned is not None:
+                registry.adopt(*pinned)
+            if kind == "render" and not registry.has_version(args[0], args[2]):
+                # версии, с которой начат мастер, здесь нет — бот пришлёт её вместе с заданием
+                write_frame(proto_out, ("missing", None, spans))
+                continue
+            with tracing.capture(traced) as spans:
+                result = tasks[kind](*args)
+            reply = ("ok", result, spans)
+        except MemoryError:
+            reply = ("error", "не хватило памяти (превышен лимит рабочего процесса)", spans)
+        except Exception as e:
+            logging.getLogger(__name__).exception("Sandbox %s task failed", kind)
+            reply = ("error", f"{type(e).__name__}: {e}", spans)
+        write_frame(proto_out, reply)
+
+
+if __name__ == "__main__":
+    main()
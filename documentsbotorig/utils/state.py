@@ -1,6 +1,3 @@
-# хранение состояний пользователей
-user_states = {}
-
 def set_nested_value(data, key, value):
     """Устанавливает значение в словаре по вложенному ключу 'a.b.c'"""
     keys = key.split(".")
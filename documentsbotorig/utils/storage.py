@@ -0,0 +1,104 @@
+import asyncio
+import json
+import sqlite3
+import threading
+from typing import Any, Dict, Mapping, Optional
+
+import msgpack
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseEventIsolation, BaseStorage, DefaultKeyBuilder, StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage, SimpleEventIsolation
+
+from config import FSM_STORAGE, FSM_SQLITE_PATH, REDIS_URL
+
+
+class SQLiteStorage(BaseStorage):
+    """FSM-хранилище в SQLite-файле.
+
+    Состояние переживает перезапуск бота; данные пишутся в msgpack.
+    Запросы выполняются в отдельном потоке, чтобы не блокировать event loop.
+    """
+
+    def __init__(self, path: str, key_builder: Optional[DefaultKeyBuilder] = None):
+        self.key_builder = key_builder or DefaultKeyBuilder(with_destiny=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS fsm ("
+            " key TEXT PRIMARY KEY,"
+            " state TEXT,"
+            " data BLOB"
+            ")"
+        )
+
+    def _execute(self, sql: str, params: tuple = ()):
+        with self._lock:
+            return self._conn.execute(sql, params).fetchone()
+
+    def _write(self, column: str, key: str, value):
+        with self._lock:
+            self._conn.execute(
+                f"INSERT INTO fsm (key, {column}) VALUES (?, ?) "
+                f"ON CONFLICT(key) DO UPDATE SET {column} = excluded.{column}",
+                (key, value),
+            )
+            if value is None:
+                # пустые записи не храним
+                self._conn.execute(
+                    "DELETE FROM fsm WHERE key = ? AND state IS NULL AND data IS NULL", (key,)
+                )
+
+    async def _run(self, sql: str, params: tuple = ()):
+        return await asyncio.to_thread(self._execute, sql, params)
+
+    async def set_state(self, key: StorageKey, state=None) -> None:
+        value = state.state if isinstance(state, State) else state
+        await asyncio.to_thread(self._write, "state", self.key_builder.build(key), value)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        row = await self._run("SELECT state FROM fsm WHERE key = ?", (self.key_builder.build(key),))
+        return row[0] if row else None
+
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+        packed = msgpack.packb(dict(data), use_bin_type=True) if data else None
+        await asyncio.to_thread(self._write, "data", self.key_builder.build(key), packed)
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        row = await self._run("SELECT data FROM fsm WHERE key = ?", (self.key_builder.build(key),))
+        if not row or row[0] is None:
+            return {}
+        return msgpack.unpackb(row[0], raw=False, strict_map_key=False)
+
+    async def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+def create_storage(backend: str = FSM_STORAGE) -> BaseStorage:
+    """Создаёт FSM-хранилище по настройке FSM_STORAGE: sqlite (по умолчанию), redis, memory."""
+    if backend == "memory":
+        return MemoryStorage()
+    if backend == "redis":
+        from aiogram.fsm.storage.redis import RedisStorage
+
+        return RedisStorage.from_url(
+            REDIS_URL,
+            key_builder=DefaultKeyBuilder(with_destiny=True),
+            json_dumps=lambda d: json.dumps(d, ensure_ascii=False, separators=(",", ":")),
+        )
+    return SQLiteStorage(FSM_SQLITE_PATH)
+
+
+def create_event_isolation(storage: BaseStorage, backend: str = FSM_STORAGE) -> BaseEventIsolation:
+    """Изоляция апдейтов одного пользователя: обработчики мастера читают данные, меняют
+    и записывают обратно, поэтому два быстрых апдейта (двойное нажатие, альбом) не должны
+    выполняться одновременно. С Redis блокировка общая для всех копий бота,
+    с SQLite/памятью — внутри процесса (бот запускается одной копией).
+    """
+    if backend == "redis":
+        from aiogram.fsm.storage.redis import RedisEventIsolation
+
+        return RedisEventIsolation(storage.redis, key_builder=storage.key_builder)
+    return SimpleEventIsolation()
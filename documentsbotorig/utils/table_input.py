@@ -0,0 +1,123 @@
+import csv
+import io
+from itertools import islice
+
+from utils.validators import validate_field
+
+# Разделители колонок при вставке таблицы одним сообщением
+TEXT_DELIMITERS = ["\t", ";"]
+MAX_ROWS = 50
+# Файл на 50 строк занимает килобайты — больше не скачиваем и не разбираем
+MAX_FILE_SIZE = 1024 * 1024
+TABLE_FILE_EXTENSIONS = (".xlsx", ".csv", ".tsv", ".txt")
+
+TRUE_WORDS = {"да", "yes", "y", "true", "1", "д"}
+FALSE_WORDS = {"нет", "no", "n", "false", "0", "н"}
+
+
+def looks_like_table(text, items):
+    """Похоже ли сообщение на вставленную таблицу (а не на значение одной ячейки)."""
+    if len(items) < 2:
+        return False
+    first_line = text.strip().splitlines()[0] if text.strip() else ""
+    return any(first_line.count(d) >= len(items) - 1 for d in TEXT_DELIMITERS)
+
+
+def parse_text_rows(text):
+    """Разбивает вставленный блок на строки и колонки (Tab или ';')."""
+    lines = [line for line in text.splitlines() if line.strip()]
+    if not lines:
+        return []
+    delimiter = "\t" if "\t" in lines[0] else ";"
+    return [[cell.strip() for cell in line.split(delimiter)] for line in lines]
+
+
+def check_table_file(filename):
+    """Проверяет расширение загруженного файла; ValueError — формат не поддерживается."""
+    if not (filename or "").lower().endswith(TABLE_FILE_EXTENSIONS):
+        raise ValueError("Поддерживаются файлы .csv и .xlsx")
+
+
+def parse_table_file(filename, content, limit=MAX_ROWS + 2):
+    """Читает строки из загруженного CSV или XLSX файла.
+    Читает не больше limit непустых строк: заголовок, MAX_ROWS строк и ещё одну,
+    чтобы validate_rows заметил превышение, — остаток файла не разбирается.
+    Синхронная, из хендлеров вызывается через asyncio.to_thread.
+    """
+    check_table_file(filename)
+    if (filename or "").lower().endswith(".xlsx"):
+        from openpyxl import load_workbook
+
+        wb = load_workbook(io.BytesIO(content), read_only=True, data_only=True)
+        try:
+            values_rows = (
+                ["" if v is None else str(v).strip() for v in values]
+                for values in wb.active.iter_rows(values_only=True)
+            )
+            return list(islice((cells for cells in values_rows if any(cells)), limit))
+        finally:
+            wb.close()
+    text = content.decode("utf-8-sig", errors="replace")
+    try:
+        dialect = csv.Sniffer().sniff(text[:4096], delimiters=",;\t")
+    except csv.Error:
+        dialect = csv.excel
+    rows = (
+        [cell.strip() for cell in row]
+        for row in csv.reader(io.StringIO(text), dialect)
+        if any(cell.strip() for cell in row)
+    )
+    return list(islice(rows, limit))
+
+
+def _is_header(row, items):
+    names = {str(i.get("label", "")).strip().lower() for i in items}
+    names |= {str(i.get("key", "")).strip().lower() for i in items}
+    return all(cell.strip().lower() in names for cell in row if cell.strip())
+
+
+def validate_rows(raw_rows, items, limit=MAX_ROWS):
+    """Проверяет строки таблицы за один проход.
+    Возвращает (rows, errors): rows — список словарей по ключам колонок,
+    errors — сообщения вида "Строка N: ..." (если есть ошибки, rows пуст).
+    """
+    if raw_rows and _is_header(raw_rows[0], items):
+        raw_rows = raw_rows[1:]
+    if not raw_rows:
+        return [], ["Не найдено ни одной строки"]
+    if len(raw_rows) > limit:
+        return [], [f"Слишком много строк: больше {limit}"]
+
+    rows, errors = [], []
+    for n, cells in enumerate(raw_rows, start=1):
+        if len(cells) != len(items):
+            errors.append(f"Строка {n}: ожидалось колонок {len(items)}, получено {len(cells)}")
+            continue
+        row, row_errors = {}, []
+        for col, value in zip(items, cells):
+            col_type = col.get("type", "string")
+            options = col.get("options")
+            if col_type == "select" and isinstance(options, list) and options:
+                if value not in options:
+                    row_errors.append(f"«{col['label']}» — допустимо: {', '.join(map(str, options))}")
+                    continue
+            elif col_type == "bool":
+                low = value.lower()
+                if low in TRUE_WORDS:
+                    value = "Да"
+                elif low in FALSE_WORDS:
+                    value = "Нет"
+                else:
+                    row_errors.append(f"«{col['label']}» — ожидается Да/Нет")
+                    continue
+            elif not validate_field(value, col_type):
+                row_errors.append(f"«{col['label']}» — неверный формат")
+                continue
+            row[col["key"]] = value
+        if row_errors:
+            errors.append(f"Строка {n}: " + "; ".join(row_errors))
+        else:
+            rows.append(row)
+    if errors:
+        return [], errors
+    return rows, []
@@ -0,0 +1,194 @@
+"""Структурные спаны фаз генерации (render, inject_tables, save, convert_pdf, send).
+
+    with trace(template_slug):          # одна трасса на документ
+        with span("render") as s:
+            ...
+            s.set(bytes=len(data))
+
+Трасса семплируется (TRACE_SAMPLE_RATE, по умолчанию 0.2): для невыбранных span()
+ничего не замеряет и не пишет. Выбранные трассы пишутся одной JSON-строкой в логгер
+"documentsbot.trace" (поля как у OpenTelemetry-спанов: trace_id, span_id, name,
+start, duration_ms, attributes) и попадают в статистику для команды /stats.
+Текущая трасса хранится в ContextVar, поэтому видна и в asyncio.to_thread.
+"""
+import json
+import logging
+import os
+import random
+import threading
+import time
+import uuid
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "0.2"))
+# сколько последних замеров каждой фазы хранить для перцентилей
+STATS_WINDOW = 500
+
+trace_logger = logging.getLogger("documentsbot.trace")
+
+_current_trace = ContextVar("current_trace", default=None)
+
+
+class Span:
+    __slots__ = ("name", "span_id", "start", "duration", "attributes")
+
+    def __init__(self, name, attributes):
+        self.name = name
+        self.span_id = uuid.uuid4().hex[:16]
+        self.start = time.time()
+        self.duration = None
+        self.attributes = attributes
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+
+class _NoopSpan:
+    __slots__ = ()
+
+    def set(self, **attributes):
+        pass
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+class Trace:
+    def __init__(self, template_slug, attributes):
+        self.trace_id = uuid.uuid4().hex
+        self.template_slug = template_slug
+        self.attributes = attributes
+        self.spans = []
+
+
+class PhaseStats:
+    """Скользящее окно длительностей по (шаблон, фаза)."""
+
+    def __init__(self, window=STATS_WINDOW):
+        self._lock = threading.Lock()
+        self._data = defaultdict(lambda: defaultdict(lambda: deque(maxlen=window)))
+
+    def add(self, template_slug, phase, duration):
+        with self._lock:
+            self._data[template_slug][phase].append(duration)
+
+    def summary(self):
+        """{template: {phase: {"count", "p50_ms", "p95_ms"}}}"""
+        with self._lock:
+            snapshot = {t: {p: sorted(v) for p, v in phases.items()} for t, phases in self._data.items()}
+        result = {}
+        for template, phases in snapshot.items():
+            result[template] = {
+                phase: {
+                    "count": len(values),
+                    "p50_ms": _percentile(values, 50) * 1000,
+                    "p95_ms": _percentile(values, 95) * 1000,
+                }
+                for phase, values in phases.items() if values
+            }
+        return result
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+def _percentile(sorted_values, pct):
+    """Перцентиль по методу ближайшего ранга."""
+    rank = max(1, -(-len(sorted_values) * pct // 100))
+    return sorted_values[int(rank) - 1]
+
+
+phase_stats = PhaseStats()
+
+
+@contextmanager
+def trace(template_slug, **attributes):
+    """Открывает трассу генерации одного документа (вложенные вызовы переиспользуют текущую)."""
+    if _current_trace.get() is not None:
+        yield _current_trace.get()
+        return
+    if TRACE_SAMPLE_RATE <= 0 or random.random() >= TRACE_SAMPLE_RATE:
+        # невыбранная трасса: помечаем контекст, чтобы span() был дешёвым no-op
+        token = _current_trace.set(False)
+        try:
+            yield None
+        finally:
+            _current_trace.reset(token)
+        return
+    tr = Trace(template_slug, attributes)
+    token = _current_trace.set(tr)
+    try:
+        yield tr
+    finally:
+        _current_trace.reset(token)
+        _finish(tr)
+
+
+@contextmanager
+def span(name, **attributes):
+    tr = _current_trace.get()
+    if not tr:
+        yield _NOOP_SPAN
+        return
+    s = Span(name, attributes)
+    t0 = time.perf_counter()
+    try:
+        yield s
+    except BaseException as e:
+        s.set(error=type(e).__name__)
+        raise
+    finally:
+        s.duration = time.perf_counter() - t0
+        tr.spans.append(s)
+
+
+def active():
+    """Идёт ли сейчас выбранная (семплированная) трасса."""
+    return bool(_current_trace.get())
+
+
+@contextmanager
+def capture(enabled=True):
+    """Собирает спаны в список без записи в лог и статистику — для рабочих процессов,
+    которые возвращают спаны вызывающей стороне (см. merge)."""
+    spans = []
+    if not enabled:
+        yield spans
+        return
+    tr = Trace(None, {})
+    token = _current_trace.set(tr)
+    try:
+        yield spans
+    finally:
+        _current_trace.reset(token)
+        spans.extend((s.name, s.start, s.duration, s.attributes) for s in tr.spans)
+
+
+def merge(spans):
+    """Добавляет в текущую трассу спаны, собранные через capture() в другом процессе."""
+    tr = _current_trace.get()
+    if not tr:
+        return
+    for name, start, duration, attributes in spans:
+        s = Span(name, attributes)
+        s.start = start
+        s.duration = duration
+        tr.spans.append(s)
+
+
+def _finish(tr):
+    for s in tr.spans:
+        if "error" not in s.attributes:
+            phase_stats.add(tr.template_slug, s.name, s.duration)
+        if trace_logger.isEnabledFor(logging.INFO):
+            trace_logger.info(json.dumps({
+                "trace_id": tr.trace_id,
+                "span_id": s.span_id,
+                "name": s.name,
+                "start": round(s.start, 6),
+                "duration_ms": round(s.duration * 1000, 2),
+                "attributes": {"template": tr.template_slug, **tr.attributes, **s.attributes},
+            }, ensure_ascii=False))
@@ -5,7 +5,6 @@ from logging.config import fileConfig
 
 from alembic import context
 from sqlalchemy import pool
-from sqlalchemy.ext.asyncio import create_async_engine
 
 # --- путь до корня проекта, чтобы импортировать db.models ---
 THIS_DIR = os.path.dirname(__file__)
@@ -13,7 +12,9 @@ PROJECT_ROOT = os.path.abspath(os.path.join(THIS_DIR, os.pardir))
 if PROJECT_ROOT not in sys.path:
     sys.path.insert(0, PROJECT_ROOT)
 
-# Импортируем metadata из моделей
+# Импортируем metadata из моделей и общую фабрику движка
+from config import settings  # noqa: E402
+from db.db import create_engine  # noqa: E402
 from db.models import Base  # noqa: E402
 
 # Alembic Config object
@@ -28,13 +29,8 @@ target_metadata = Base.metadata
 
 
 def get_url() -> str:
-    """Определение URL подключения к БД."""
-    # Берем из переменной окружения (например, DB_URL в .env)
-    url = os.getenv("DB_URL")
-    if url:
-        return url
-    # fallback — читаем из alembic.ini
-    return config.get_main_option("sqlalchemy.url", "sqlite+aiosqlite:///bot.db")
+    """URL подключения к БД — тот же, что у бота (DATABASE_URL / DB_URL / DB_PATH)."""
+    return settings.DATABASE_URL
 
 
 def _is_sqlite(url: str) -> bool:
@@ -56,25 +52,24 @@ def run_migrations_offline() -> None:
         context.run_migrations()
 
 
+def do_run_migrations(connection) -> None:
+    context.configure(
+        connection=connection,
+        target_metadata=target_metadata,
+        compare_type=True,
+        compare_server_default=True,
+        render_as_batch=_is_sqlite(str(connection.engine.url)),
+    )
+    with context.begin_transaction():
+        context.run_migrations()
+
+
 async def run_migrations_online() -> None:
     """Online режим: миграции выполняются в реальной базе (async)."""
-    connectable = create_async_engine(
-        get_url(),
-        pool_pre_ping=True,
-        poolclass=pool.NullPool,
-    )
+    connectable = create_engine(get_url(), poolclass=pool.NullPool)
     async with connectable.connect() as connection:
-        await connection.run_sync(
-            lambda sync_conn: context.configure(
-                connection=sync_conn,
-                target_metadata=target_metadata,
-                compare_type=True,
-                compare_server_default=True,
-                render_as_batch=_is_sqlite(str(sync_conn.engine.url)),
-            )
-        )
-        with context.begin_transaction():
-            context.run_migrations()
+        # конфигурация и сами миграции — синхронный код, выполняем его в run_sync
+        await connection.run_sync(do_run_migrations)
     await connectable.dispose()
 
 
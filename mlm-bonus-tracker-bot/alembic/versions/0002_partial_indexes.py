@@ -0,0 +1,45 @@
+"""partial indexes: бонусы на подтверждении и к выводу, отзывы на модерации
+
+В индекс попадают только строки, которые ищут хендлеры: он маленький и не
+растёт вместе с историей подтверждённых бонусов и одобренных отзывов.
+Условия на статус в запросах (services.bonus_service) передаются литералом,
+чтобы планировщик видел совпадение с условием индекса.
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-19 20:30:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0002'
+down_revision: Union[str, None] = '0001'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+POTENTIAL = sa.text("status = 'potential'")
+CONFIRMED = sa.text("status = 'confirmed'")
+
+
+def upgrade() -> None:
+    # if_not_exists: база могла быть создана init_db() уже с этими индексами
+    op.create_index('ix_bonuses_potential', 'bonuses', ['id'], if_not_exists=True,
+                    postgresql_where=POTENTIAL, sqlite_where=POTENTIAL)
+    op.create_index('ix_bonuses_potential_deal', 'bonuses', ['deal_id'], if_not_exists=True,
+                    postgresql_where=POTENTIAL, sqlite_where=POTENTIAL)
+    op.create_index('ix_bonuses_confirmed_user', 'bonuses', ['user_id', 'id'], if_not_exists=True,
+                    postgresql_where=CONFIRMED, sqlite_where=CONFIRMED)
+    op.create_index('ix_reviews_unapproved', 'reviews', ['id'], if_not_exists=True,
+                    postgresql_where=sa.text('NOT approved'), sqlite_where=sa.text('approved = 0'))
+
+
+def downgrade() -> None:
+    op.drop_index('ix_reviews_unapproved', table_name='reviews')
+    op.drop_index('ix_bonuses_confirmed_user', table_name='bonuses')
+    op.drop_index('ix_bonuses_potential_deal', table_name='bonuses')
+    op.drop_index('ix_bonuses_potential', table_name='bonuses')
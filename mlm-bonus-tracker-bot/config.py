@@ -13,9 +13,26 @@ class Settings:
         self.ADMIN_IDS = [int(x) for x in os.getenv("ADMIN_IDS", "").split(",") if x]
         self.MANAGER_IDS = [int(x) for x in os.getenv("MANAGER_IDS", "").split(",") if x]
 
-        # ✅ Подключение к БД
-        self.DB_PATH = os.getenv("DB_PATH", "db.sqlite3")
-        self.DB_URL = f"sqlite+aiosqlite:///{self.DB_PATH}"
+        # ✅ Подключение к БД — один URL для бота и Alembic:
+        # DATABASE_URL, иначе DB_URL, иначе SQLite-файл DB_PATH
+        self.DB_PATH = os.getenv("DB_PATH", "bot.db")
+        self.DATABASE_URL = (
+            os.getenv("DATABASE_URL")
+            or os.getenv("DB_URL")
+            or f"sqlite+aiosqlite:///{self.DB_PATH}"
+        )
+        self.DB_URL = self.DATABASE_URL  # старое имя
+
+        # SQLite: ожидание блокировки записи, размер mmap и кэша страниц, пул соединений
+        self.SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+        self.SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+        self.SQLITE_CACHE_SIZE_KB = int(os.getenv("SQLITE_CACHE_SIZE_KB", "65536"))
+        self.SQLITE_POOL_SIZE = int(os.getenv("SQLITE_POOL_SIZE", "5"))
+
+        # PostgreSQL (asyncpg): пул соединений
+        self.DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+        self.DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+        self.DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
 
         # ✅ Логи и мониторинг
         self.LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
@@ -33,6 +50,23 @@ class Settings:
         mlm_levels_raw = os.getenv("MLM_LEVELS")
         self.LINE_PAYOUTS = json.loads(mlm_levels_raw) if mlm_levels_raw else {}
 
+        # Откуда читать дерево: closure — индекс user_tree, cte — WITH RECURSIVE по users.sponsor_id
+        self.MLM_TREE_INDEX = os.getenv("MLM_TREE_INDEX", "closure").lower()
+
+        # Сколько секунд держать в памяти статистику структуры партнёра (0 — не кэшировать)
+        self.STRUCTURE_STATS_TTL = int(os.getenv("STRUCTURE_STATS_TTL", "300"))
+
+        # Графики статистики: число процессов для рендера и сколько PNG держать в кэше
+        self.CHART_WORKERS = int(os.getenv("CHART_WORKERS", "1"))
+        self.CHART_CACHE_SIZE = int(os.getenv("CHART_CACHE_SIZE", "256"))
+
+        # Кэш пользователей по tg_id (middlewares.user_cache): TTL в секундах и размер
+        self.USER_CACHE_TTL = int(os.getenv("USER_CACHE_TTL", "30"))
+        self.USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "10000"))
+
+        # Как часто сверять bonus_balances с bonuses (секунды, 0 — не сверять)
+        self.BALANCE_RECONCILE_INTERVAL = int(os.getenv("BALANCE_RECONCILE_INTERVAL", "3600"))
+
         # ✅ Сайт компании
         self.COMPANY_SITE_URL = os.getenv("COMPANY_SITE_URL", "https://prospisaniedolgov.ru/")
 
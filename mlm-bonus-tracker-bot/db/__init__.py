@@ -4,9 +4,11 @@ from .db import get_session, init_db
 from .models import (
     Base,
     User,
+    UserTree,
     Lead,
     Deal,
     Bonus,
+    BonusBalance,
     Payout,
     News,
     Instruction,
@@ -26,9 +28,11 @@ __all__ = [
     "Base",
     # модели
     "User",
+    "UserTree",
     "Lead",
     "Deal",
     "Bonus",
+    "BonusBalance",
     "Payout",
     "News",
     "Instruction",
@@ -1,16 +1,75 @@
 # db.py
-import os
-from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
-from sqlalchemy.orm import declarative_base, sessionmaker
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine, AsyncSession
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
 
-# Базовый класс для всех моделей
-Base = declarative_base()
+from config import settings
+# Базовый класс для всех моделей (общий с db.models, иначе create_all не видит таблиц)
+from db.models import Base
+
+# URL для подключения к базе — единый для бота и Alembic (см. config.Settings)
+DATABASE_URL = settings.DATABASE_URL
+
+
+def _sqlite_pragmas(dbapi_connection, connection_record):
+    """
+    Настройки каждого нового соединения SQLite:
+    WAL — читатели не ждут писателя, synchronous=NORMAL — fsync только на checkpoint,
+    busy_timeout — писатели ждут блокировку, а не падают с "database is locked".
+    """
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute(f"PRAGMA busy_timeout={settings.SQLITE_BUSY_TIMEOUT_MS}")
+    cursor.execute(f"PRAGMA mmap_size={settings.SQLITE_MMAP_SIZE}")
+    cursor.execute(f"PRAGMA cache_size=-{settings.SQLITE_CACHE_SIZE_KB}")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.close()
+
+
+def create_engine(url: str = DATABASE_URL, **kwargs) -> AsyncEngine:
+    """
+    Движок для бота, Alembic и скриптов.
+    SQLite (aiosqlite): прагмы производительности на каждом соединении и небольшой пул.
+    PostgreSQL (asyncpg) и прочие: пул с проверкой и пересозданием соединений.
+    kwargs переопределяют параметры create_async_engine (например, poolclass).
+    """
+    url_obj = make_url(url)
+    if url_obj.get_backend_name() == "sqlite":
+        database = url_obj.database or ""
+        if database in ("", ":memory:") or "mode=memory" in str(url_obj):
+            options = {"poolclass": StaticPool, "connect_args": {"check_same_thread": False}}
+        else:
+            options = {
+                "pool_size": settings.SQLITE_POOL_SIZE,
+                "max_overflow": settings.SQLITE_POOL_SIZE * 2,
+                "connect_args": {"timeout": settings.SQLITE_BUSY_TIMEOUT_MS / 1000},
+            }
+        engine = create_async_engine(url, **_merge(options, kwargs))
+        if options.get("poolclass") is not StaticPool:
+            event.listen(engine.sync_engine, "connect", _sqlite_pragmas)
+        return engine
+
+    options = {
+        "pool_size": settings.DB_POOL_SIZE,
+        "max_overflow": settings.DB_MAX_OVERFLOW,
+        "pool_recycle": settings.DB_POOL_RECYCLE,
+        "pool_pre_ping": True,
+    }
+    return create_async_engine(url, **_merge(options, kwargs))
+
+
+def _merge(options: dict, overrides: dict) -> dict:
+    """Параметры движка + переопределения; при своём poolclass размеры пула не передаём."""
+    if "poolclass" in overrides:
+        options = {k: v for k, v in options.items() if k not in ("pool_size", "max_overflow", "poolclass")}
+    return {**options, **overrides}
 
-# URL для подключения к базе (берём из переменной окружения или используем SQLite по умолчанию)
-DATABASE_URL = os.getenv("DATABASE_URL", "sqlite+aiosqlite:///./bot.db")
 
 # Создаём движок
-engine = create_async_engine(DATABASE_URL, echo=False, future=True)
+engine = create_engine()
 
 # Фабрика сессий
 async_session_factory = sessionmaker(
@@ -0,0 +1,27 @@
+-- 0005_user_tree.sql
+-- Индекс дерева партнёров (closure table по users.sponsor_id)
+
+CREATE TABLE IF NOT EXISTS user_tree (
+    ancestor_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    descendant_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    depth INTEGER NOT NULL,
+    PRIMARY KEY (ancestor_id, descendant_id)
+);
+
+CREATE INDEX IF NOT EXISTS ix_user_tree_ancestor_depth
+    ON user_tree (ancestor_id, depth);
+
+CREATE INDEX IF NOT EXISTS ix_user_tree_descendant_depth
+    ON user_tree (descendant_id, depth);
+
+-- Заполнение для существующей базы: все пары аплайн → даунлайн
+INSERT INTO user_tree (ancestor_id, descendant_id, depth)
+WITH RECURSIVE chain (ancestor_id, descendant_id, depth) AS (
+    SELECT sponsor_id, id, 1 FROM users WHERE sponsor_id IS NOT NULL
+    UNION ALL
+    SELECT c.ancestor_id, u.id, c.depth + 1
+    FROM chain c
+    JOIN users u ON u.sponsor_id = c.descendant_id
+)
+SELECT ancestor_id, descendant_id, depth FROM chain
+ON CONFLICT DO NOTHING;
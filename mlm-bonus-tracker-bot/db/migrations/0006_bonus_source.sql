@@ -0,0 +1,8 @@
+-- 0006_bonus_source.sql
+-- Источник бонуса: сделка, партнёр, который её принёс, и линия получателя
+
+ALTER TABLE bonuses ADD COLUMN IF NOT EXISTS deal_id INTEGER REFERENCES deals(id) ON DELETE SET NULL;
+ALTER TABLE bonuses ADD COLUMN IF NOT EXISTS payer_id INTEGER REFERENCES users(id) ON DELETE SET NULL;
+ALTER TABLE bonuses ADD COLUMN IF NOT EXISTS level INTEGER;
+
+CREATE INDEX IF NOT EXISTS ix_bonuses_deal_id ON bonuses (deal_id);
@@ -0,0 +1,28 @@
+-- 0007_bonus_balances.sql
+-- Балансы бонусов по статусам (поддерживаются приложением, сверяются с bonuses)
+
+DO $$
+BEGIN
+    IF NOT EXISTS (
+        SELECT 1 FROM pg_type t
+        JOIN pg_enum e ON t.oid = e.enumtypid
+        WHERE t.typname = 'bonusstatus'
+          AND e.enumlabel = 'rejected'
+    ) THEN
+        ALTER TYPE bonusstatus ADD VALUE 'rejected';
+    END IF;
+END $$;
+
+CREATE TABLE IF NOT EXISTS bonus_balances (
+    user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    status bonusstatus NOT NULL,
+    amount NUMERIC(12, 2) NOT NULL DEFAULT 0,
+    PRIMARY KEY (user_id, status)
+);
+
+-- Заполняем из уже начисленных бонусов
+INSERT INTO bonus_balances (user_id, status, amount)
+SELECT user_id, status, SUM(amount)
+FROM bonuses
+GROUP BY user_id, status
+ON CONFLICT (user_id, status) DO UPDATE SET amount = EXCLUDED.amount;
@@ -17,6 +17,7 @@ from sqlalchemy import (
     Index,
     Enum,
     Boolean,
+    text,
 )
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, relationship
 
@@ -41,6 +42,7 @@ class BonusStatus(str, enum.Enum):
     potential = "potential"
     confirmed = "confirmed"
     withdrawn = "withdrawn"
+    rejected = "rejected"
 
 
 class DealStatus(str, enum.Enum):
@@ -96,7 +98,9 @@ class User(Base):
     )
 
     deals: Mapped[List["Deal"]] = relationship(back_populates="user", cascade="all,delete-orphan")
-    bonuses: Mapped[List["Bonus"]] = relationship(back_populates="user", cascade="all,delete-orphan")
+    bonuses: Mapped[List["Bonus"]] = relationship(
+        back_populates="user", cascade="all,delete-orphan", foreign_keys="Bonus.user_id"
+    )
     payouts: Mapped[List["Payout"]] = relationship(back_populates="user", cascade="all,delete-orphan")
     materials: Mapped[List["News"]] = relationship(back_populates="author", cascade="all,delete-orphan")
     instructions: Mapped[List["Instruction"]] = relationship(back_populates="author", cascade="all,delete-orphan")
@@ -106,6 +110,26 @@ class User(Base):
 Index("ix_users_role_status_points", User.role, User.status_points)
 
 
+# -----------------------
+# Индекс дерева партнёров
+# -----------------------
+class UserTree(Base):
+    """
+    Closure table по users.sponsor_id: для каждого партнёра — все его аплайны
+    с расстоянием (depth=1 — прямой спонсор). Заполняется в mlm.tree.
+    """
+    __tablename__ = "user_tree"
+
+    ancestor_id: Mapped[int] = mapped_column(ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    descendant_id: Mapped[int] = mapped_column(ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    depth: Mapped[int] = mapped_column(Integer, nullable=False)
+
+
+# даунлайн по уровням (ancestor_id, depth) и цепочка аплайнов (descendant_id, depth)
+Index("ix_user_tree_ancestor_depth", UserTree.ancestor_id, UserTree.depth)
+Index("ix_user_tree_descendant_depth", UserTree.descendant_id, UserTree.depth)
+
+
 # -----------------------
 # Сделки
 # -----------------------
@@ -153,13 +177,40 @@ class Bonus(Base):
     id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
     user_id: Mapped[int] = mapped_column(ForeignKey("users.id", ondelete="CASCADE"), index=True, nullable=False)
 
+    # за что начислен: сделка (или None — новый партнёр), кто её принёс и на какой линии получатель
+    deal_id: Mapped[Optional[int]] = mapped_column(ForeignKey("deals.id", ondelete="SET NULL"), index=True)
+    payer_id: Mapped[Optional[int]] = mapped_column(ForeignKey("users.id", ondelete="SET NULL"))
+    level: Mapped[Optional[int]] = mapped_column(Integer)
+
     amount: Mapped[Decimal] = mapped_column(Numeric(12, 2), nullable=False, default=0)
     status: Mapped[BonusStatus] = mapped_column(Enum(BonusStatus), default=BonusStatus.potential, index=True)
     comment: Mapped[Optional[str]] = mapped_column(Text)
 
     created_at: Mapped[datetime] = mapped_column(DateTime, default=func.now(), nullable=False)
 
-    user: Mapped["User"] = relationship(back_populates="bonuses")
+    user: Mapped["User"] = relationship(back_populates="bonuses", foreign_keys=[user_id])
+
+
+# Частичные индексы (PostgreSQL и SQLite): в индекс попадают только строки,
+# которые ищут — бонусы на подтверждении и подтверждённые к выводу.
+_potential = text("status = 'potential'")
+Index("ix_bonuses_potential", Bonus.id, postgresql_where=_potential, sqlite_where=_potential)
+Index("ix_bonuses_potential_deal", Bonus.deal_id, postgresql_where=_potential, sqlite_where=_potential)
+_confirmed = text("status = 'confirmed'")
+Index("ix_bonuses_confirmed_user", Bonus.user_id, Bonus.id, postgresql_where=_confirmed, sqlite_where=_confirmed)
+
+
+class BonusBalance(Base):
+    """
+    Баланс бонусов пользователя по статусу — материализованная сумма bonuses.amount.
+    Меняется в той же транзакции, что и сами бонусы (services.balance_service),
+    и периодически сверяется с bonuses.
+    """
+    __tablename__ = "bonus_balances"
+
+    user_id: Mapped[int] = mapped_column(ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    status: Mapped[BonusStatus] = mapped_column(Enum(BonusStatus), primary_key=True)
+    amount: Mapped[Decimal] = mapped_column(Numeric(12, 2), nullable=False, default=0)
 
 
 # -----------------------
@@ -230,3 +281,8 @@ class Review(Base):
 
 
 Index("ix_reviews_user_approved", Review.user_id, Review.approved)
+# отзывы на модерации
+Index(
+    "ix_reviews_unapproved", Review.id,
+    postgresql_where=text("NOT approved"), sqlite_where=text("approved = 0"),
+)
@@ -1,10 +1,15 @@
+from typing import Optional
+
 from aiogram import Router, F
+from aiogram.filters import Command
 from aiogram.types import Message, CallbackQuery
 from aiogram.fsm.context import FSMContext
 
 from db import get_session
 from db.models import User, UserRole
 from keyboards.inline import role_select_kb, confirm_kb
+from middlewares.user_cache import user_cache
+from mlm.tree import move_in_tree
 
 from sqlalchemy.future import select
 
@@ -13,11 +18,7 @@ router = Router()
 
 # --- Админ-панель ---
 @router.message(F.text == "🛠 Админ")
-async def admin_panel(message: Message):
-    async with get_session() as session:
-        result = await session.execute(select(User).where(User.id == message.from_user.id))
-        user = result.scalars().first()
-
+async def admin_panel(message: Message, user: Optional[User]):
     if not user or user.role not in [UserRole.admin, UserRole.moderator]:
         return await message.answer("⛔ У вас нет доступа к админ-панели")
 
@@ -59,10 +60,40 @@ async def set_role_callback(call: CallbackQuery):
 
         user.role = UserRole[role]
         await session.commit()
+    user_cache.invalidate(user.tg_id)
 
     await call.message.edit_text(f"✅ Пользователю {user_id} назначена роль: {role}")
 
 
+# --- Перенос партнёра в структуре ---
+@router.message(Command("move_partner"))
+async def move_partner_command(message: Message, user: Optional[User]):
+    """
+    Перенос партнёра со всей веткой под другого спонсора (только для админов).
+    Пример: /move_partner 42 17  (0 вместо спонсора — сделать корнем)
+    """
+    if not user or user.role != UserRole.admin:
+        return await message.answer("⛔ Переносить партнёров может только администратор")
+
+    try:
+        _, partner_id, sponsor_id = message.text.split()
+        partner_id, sponsor_id = int(partner_id), int(sponsor_id) or None
+    except ValueError:
+        return await message.answer("❌ Использование: /move_partner <user_id> <sponsor_id|0>")
+
+    async with get_session() as session:
+        partner = await session.get(User, partner_id)
+        if not partner or (sponsor_id is not None and not await session.get(User, sponsor_id)):
+            return await message.answer("❌ Пользователь не найден")
+        try:
+            await move_in_tree(session, partner_id, sponsor_id)
+        except ValueError as e:
+            return await message.answer(f"❌ {e}")
+
+    target = f"под партнёра {sponsor_id}" if sponsor_id else "в корень структуры"
+    await message.answer(f"✅ Партнёр {partner_id} со всей веткой перенесён {target}")
+
+
 # --- Рассылка ---
 @router.message(F.text.startswith("broadcast:"))
 async def broadcast_prepare(message: Message, state: FSMContext):
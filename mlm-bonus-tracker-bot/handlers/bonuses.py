@@ -1,8 +1,10 @@
+from typing import Optional
+
 from aiogram import Router, F
 from aiogram.types import Message, CallbackQuery
 
 from db import get_session
-from db.models import Bonus, BonusStatus, User, UserRole
+from db.models import BonusStatus, User, UserRole
 from services import bonus_service
 from keyboards.inline import bonus_admin_kb
 
@@ -10,10 +12,13 @@ router = Router()
 
 
 @router.message(F.text == "💰 Бонусы")
-async def list_bonuses(message: Message):
+async def list_bonuses(message: Message, user: Optional[User]):
     """Партнёр смотрит свои бонусы"""
+    if not user:
+        return await message.answer("❌ Вы не зарегистрированы.")
+
     async with get_session() as session:
-        bonuses = await bonus_service.list_user_bonuses(session, message.from_user.id)
+        bonuses = await bonus_service.list_user_bonuses(session, user.id)
 
     if not bonuses:
         return await message.answer("У вас пока нет бонусов.")
@@ -26,23 +31,19 @@ async def list_bonuses(message: Message):
 
 
 @router.message(F.text == "📤 Запросить вывод")
-async def request_payout(message: Message):
+async def request_payout(message: Message, user: Optional[User]):
     """Партнёр запрашивает вывод подтверждённых бонусов"""
+    if not user:
+        return await message.answer("❌ Вы не зарегистрированы.")
+
     async with get_session() as session:
-        totals = await bonus_service.totals_by_status(session, message.from_user.id)
-        if totals.get(BonusStatus.approved, 0) <= 0:
+        totals = await bonus_service.totals_by_status(session, user.id)
+        available = totals.get(BonusStatus.confirmed.value, 0)
+        if available <= 0:
             return await message.answer("❌ У вас нет бонусов для вывода.")
 
-        # Переводим все подтверждённые бонусы в статус 'withdrawn'
-        approved = await session.execute(
-            Bonus.__table__.select().where(
-                Bonus.user_id == message.from_user.id,
-                Bonus.status == BonusStatus.approved,
-            )
-        )
-        bonuses = approved.scalars().all()
-        for b in bonuses:
-            b.status = BonusStatus.withdrawn
+        # Переводим все подтверждённые бонусы в статус 'withdrawn' (вместе с балансом)
+        await bonus_service.withdraw_bonus(session, user.id, available)
         await session.commit()
 
     await message.answer("✅ Запрос на вывод оформлен. Ожидайте перечисления.")
@@ -1,7 +1,8 @@
+from typing import Optional
+
 from aiogram import Router
 from aiogram.filters import CommandStart, Command
 from aiogram.types import Message
-from sqlalchemy import select
 
 from keyboards.reply import (
     main_menu_kb,
@@ -11,6 +12,7 @@ from keyboards.reply import (
 )
 from db import get_session
 from db.models import User, UserRole
+from middlewares.user_cache import user_cache
 
 router = Router(name=__name__)
 
@@ -60,16 +62,13 @@ async def get_role_menu(role: UserRole):
 
 
 @router.message(CommandStart())
-async def on_start(message: Message) -> None:
+async def on_start(message: Message, user: Optional[User]) -> None:
     """При /start создаём пользователя (все — партнёры), показываем меню по роли."""
-    async with get_session() as session:
-        result = await session.execute(
-            select(User).where(User.tg_id == message.from_user.id)
-        )
-        user = result.scalar_one_or_none()
-
-        if not user:
-            # Новый пользователь → сразу партнёр
+    if user:
+        role = user.role
+    else:
+        # Новый пользователь → сразу партнёр
+        async with get_session() as session:
             user = User(
                 tg_id=message.from_user.id,
                 username=message.from_user.username,
@@ -78,23 +77,18 @@ async def on_start(message: Message) -> None:
             )
             session.add(user)
             await session.commit()
-            role = UserRole.partner
-        else:
-            role = user.role
+            await session.refresh(user)
+        user_cache.put(user)
+        role = UserRole.partner
 
     kb = await get_role_menu(role)
     await message.answer(WELCOME_TEXT, reply_markup=kb)
 
 
 @router.message(Command("menu"))
-async def on_menu(message: Message) -> None:
+async def on_menu(message: Message, user: Optional[User]) -> None:
     """Открыть меню повторно с учетом роли."""
-    async with get_session() as session:
-        result = await session.execute(
-            select(User).where(User.tg_id == message.from_user.id)
-        )
-        user = result.scalar_one_or_none()
-        role = user.role if user else UserRole.partner
+    role = user.role if user else UserRole.partner
 
     kb = await get_role_menu(role)
     await message.answer("Главное меню открыто 👇", reply_markup=kb)
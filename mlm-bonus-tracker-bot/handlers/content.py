@@ -1,3 +1,5 @@
+from typing import Optional
+
 from aiogram import Router, types, F
 from aiogram.filters import Command
 from sqlalchemy import select
@@ -33,11 +35,8 @@ async def show_news(message: types.Message):
 
 # --- Админ/контент-менеджер: публикация новости ---
 @router.message(Command("publish_news"))
-async def publish_news(message: types.Message):
-    async with get_session() as session:
-        user = await session.get(User, message.from_user.id)
-
-    if not user or user.role not in (UserRole.ADMIN, UserRole.CONTENT_MANAGER):
+async def publish_news(message: types.Message, user: Optional[User]):
+    if not user or user.role not in (UserRole.admin, UserRole.content):
         await message.answer("⛔ У вас нет прав для публикации новостей.")
         return
 
@@ -49,7 +48,7 @@ async def publish_news(message: types.Message):
 
 # --- Админ/контент-менеджер: обработка текста новости ---
 @router.message(F.text.startswith("NEWS:"))
-async def process_news(message: types.Message):
+async def process_news(message: types.Message, user: Optional[User]):
     """
     Формат ввода: NEWS:<заголовок>\n\n<содержимое>
     """
@@ -60,13 +59,11 @@ async def process_news(message: types.Message):
         await message.answer("⚠️ Неверный формат. Используйте:\nNEWS:<заголовок>\n\n<содержимое>")
         return
 
-    async with get_session() as session:
-        user = await session.get(User, message.from_user.id)
-
-        if not user or user.role not in (UserRole.ADMIN, UserRole.CONTENT_MANAGER):
-            await message.answer("⛔ У вас нет прав для публикации новостей.")
-            return
+    if not user or user.role not in (UserRole.admin, UserRole.content):
+        await message.answer("⛔ У вас нет прав для публикации новостей.")
+        return
 
+    async with get_session() as session:
         news = News(
             title=title.strip(),
             content=content.strip(),
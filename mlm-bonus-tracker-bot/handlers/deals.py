@@ -1,26 +1,25 @@
+from typing import Optional
+
 from aiogram import Router, types, F
 from aiogram.filters import Command
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select
 
 from db import get_session
-from db.models import Lead, Deal, Bonus, User, BonusStatus
-from services.bonus_service import accrue_bonus
+from db.models import Lead, Deal, User
+from services.bonus_service import accrue_bonus, confirm_deal_bonuses
 
 router = Router()
 
 
 @router.message(Command("deals"))
-async def show_deals(message: types.Message):
+async def show_deals(message: types.Message, user: Optional[User]):
     """Показать сделки пользователя"""
-    tg_id = message.from_user.id
+    if not user:
+        await message.answer("❌ Вы не зарегистрированы.")
+        return
 
     async with get_session() as session:
-        user = await session.scalar(select(User).where(User.tg_id == tg_id))
-        if not user:
-            await message.answer("❌ Вы не зарегистрированы.")
-            return
-
         deals = (await session.execute(
             select(Deal).where(Deal.user_id == user.id)
         )).scalars().all()
@@ -36,8 +35,8 @@ async def show_deals(message: types.Message):
 
 
 @router.message(F.text == "📑 Сделки")
-async def deals_menu(message: types.Message):
-    await show_deals(message)
+async def deals_menu(message: types.Message, user: Optional[User]):
+    await show_deals(message, user)
 
 
 async def create_deal_from_lead(session: AsyncSession, lead_id: int, amount: int):
@@ -60,7 +59,8 @@ async def create_deal_from_lead(session: AsyncSession, lead_id: int, amount: int
     # Обновляем статус лида
     lead.status = "deal"
 
-    # Начисляем бонусы партнёру и аплайну
+    # Начисляем бонусы аплайну (нужен deal.id)
+    await session.flush()
     await accrue_bonus(session, lead.user_id, amount, deal.id)
 
     await session.commit()
@@ -75,14 +75,8 @@ async def confirm_deal(session: AsyncSession, deal_id: int):
     if not deal:
         return None
 
-    # Бонусы, привязанные к этой сделке, переводим в "Подтверждено"
-    bonuses = (await session.execute(
-        select(Bonus).where(Bonus.deal_id == deal_id)
-    )).scalars().all()
-
-    for bonus in bonuses:
-        if bonus.status == BonusStatus.PENDING:
-            bonus.status = BonusStatus.APPROVED
+    # Бонусы, привязанные к этой сделке, переводим в "Подтверждено" (вместе с балансом)
+    await confirm_deal_bonuses(session, deal_id)
 
     await session.commit()
     return deal
@@ -1,3 +1,5 @@
+from typing import Optional
+
 from aiogram import Router, F
 from aiogram.types import Message
 from sqlalchemy import select
@@ -24,7 +26,7 @@ async def add_lead(message: Message):
 
 
 @router.message(F.text.startswith("lead:"))
-async def process_lead(message: Message):
+async def process_lead(message: Message, user: Optional[User]):
     """
     Обработка ввода лида от партнёра.
     Формат: lead:Имя,Телефон
@@ -35,13 +37,11 @@ async def process_lead(message: Message):
 
     name, phone = parts[0].strip(), parts[1].strip()
 
-    async with get_session() as session:
-        # проверим, есть ли партнёр в системе
-        result = await session.execute(select(User).where(User.tg_id == message.from_user.id))
-        user = result.scalar_one_or_none()
-        if not user:
-            return await message.answer("❌ Вы не зарегистрированы как партнёр.")
+    # проверим, есть ли партнёр в системе
+    if not user:
+        return await message.answer("❌ Вы не зарегистрированы как партнёр.")
 
+    async with get_session() as session:
         new_lead = Lead(
             name=name,
             phone=phone,
@@ -83,7 +83,8 @@ async def update_lead_status(message: Message):
                 status=DealStatus.confirmed
             )
             session.add(deal)
-            await accrue_bonus(session, lead.user_id, deal.amount)
+            await session.flush()
+            await accrue_bonus(session, lead.user_id, deal.amount, deal.id)
 
         await session.commit()
 
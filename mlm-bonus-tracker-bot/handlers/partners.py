@@ -1,3 +1,5 @@
+from typing import Optional
+
 from aiogram import Router, F, types
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import StatesGroup, State
@@ -31,18 +33,18 @@ async def add_partner_name(message: types.Message, state: FSMContext):
 
 
 @router.message(PartnerForm.waiting_for_phone)
-async def add_partner_phone(message: types.Message, state: FSMContext):
+async def add_partner_phone(message: types.Message, state: FSMContext, user: Optional[User]):
     data = await state.get_data()
     full_name = data["full_name"]
     phone = message.text.strip()
 
-    async with get_session() as session:
-        # Проверяем, существует ли текущий пользователь в системе
-        sponsor = await session.get(User, message.from_user.id)
-        if not sponsor:
-            await message.answer("⚠️ Вы не зарегистрированы в системе.")
-            return
+    # Проверяем, существует ли текущий пользователь в системе
+    sponsor = user
+    if not sponsor:
+        await message.answer("⚠️ Вы не зарегистрированы в системе.")
+        return
 
+    async with get_session() as session:
         # Создаём нового партнёра (без tg_id, пока он сам не зайдёт в бот)
         new_partner = User(
             tg_id=None,
@@ -51,10 +53,7 @@ async def add_partner_phone(message: types.Message, state: FSMContext):
             role=UserRole.partner,
             sponsor_id=sponsor.id  # ✅ связь по дереву
         )
-        session.add(new_partner)
-        await session.commit()  # чтобы был new_partner.id
-
-        # MLM-логика: начисления, обновления статусов
+        # MLM-логика: связь в дереве, начисления, обновления статусов
         await process_new_partner(session, sponsor, new_partner)
 
     await state.clear()
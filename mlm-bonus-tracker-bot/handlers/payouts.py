@@ -1,23 +1,27 @@
+from typing import Optional
+
 from aiogram import Router, types, F
 from aiogram.filters import Command
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 
 from db import get_session, Payout
 from services import bonus_service
-from db.models import BonusStatus
+from db.models import BonusStatus, PayoutStatus, User
 
 router = Router()
 
 # ======================= Пользователь =======================
 
 @router.message(Command("payouts"))
-async def request_payout(message: types.Message):
+async def request_payout(message: types.Message, user: Optional[User]):
     """Показать пользователю сумму доступных бонусов и предложить вывести"""
-    user_id = message.from_user.id
+    if not user:
+        await message.answer("❌ Вы не зарегистрированы.")
+        return
 
     async with get_session() as session:
-        totals = await bonus_service.totals_by_status(session, user_id)
-        available = totals.get(BonusStatus.APPROVED, 0)
+        totals = await bonus_service.totals_by_status(session, user.id)
+        available = totals.get(BonusStatus.confirmed.value, 0)
 
         if available <= 0:
             await message.answer("❌ У вас нет подтверждённых бонусов для вывода.")
@@ -30,25 +34,27 @@ async def request_payout(message: types.Message):
 
 
 @router.message(F.text.regexp(r"^\d+$"))
-async def process_payout_amount(message: types.Message):
+async def process_payout_amount(message: types.Message, user: Optional[User]):
     """Обработка введенной пользователем суммы для вывода"""
-    user_id = message.from_user.id
+    if not user:
+        await message.answer("❌ Вы не зарегистрированы.")
+        return
     amount = int(message.text)
 
     async with get_session() as session:
-        totals = await bonus_service.totals_by_status(session, user_id)
-        available = totals.get(BonusStatus.APPROVED, 0)
+        totals = await bonus_service.totals_by_status(session, user.id)
+        available = totals.get(BonusStatus.confirmed.value, 0)
 
         if amount <= 0 or amount > available:
             await message.answer("❌ Недостаточно средств или некорректная сумма.")
             return
 
         # Создаем заявку на вывод
-        payout = Payout(user_id=user_id, amount=amount, status="pending")
+        payout = Payout(user_id=user.id, amount=amount, status=PayoutStatus.pending)
         session.add(payout)
 
         # Переводим бонусы в статус "withdrawn"
-        await bonus_service.withdraw_bonus(session, user_id, amount)
+        await bonus_service.withdraw_bonus(session, user.id, amount)
 
         await session.commit()
 
@@ -61,7 +67,7 @@ async def process_payout_amount(message: types.Message):
 async def list_pending_payouts(message: types.Message):
     """Админ видит все заявки на вывод"""
     async with get_session() as session:
-        result = await session.execute(Payout.__table__.select().where(Payout.status == "pending"))
+        result = await session.execute(Payout.__table__.select().where(Payout.status == PayoutStatus.pending))
         payouts = result.fetchall()
 
     if not payouts:
@@ -93,14 +99,18 @@ async def approve_payout(callback: types.CallbackQuery):
             await callback.answer("Заявка не найдена", show_alert=True)
             return
 
-        payout.status = "approved"
+        payout.status = PayoutStatus.confirmed
+        # уведомление уходит в Telegram, а payout.user_id — это users.id
+        tg_id = (await session.get(User, payout.user_id)).tg_id
         await session.commit()
 
     await callback.message.edit_text("✅ Заявка одобрена. Деньги будут перечислены пользователю.")
     await callback.answer("Пользователь уведомлен")
 
+    if not tg_id:  # партнёр ещё не заходил в бота
+        return
     await callback.bot.send_message(
-        payout.user_id,
+        tg_id,
         "🎉 Ваша заявка на вывод одобрена!\n\n"
         "Деньги будут перечислены в ближайшее время."
     )
@@ -119,14 +129,17 @@ async def reject_payout(callback: types.CallbackQuery):
 
         # Возвращаем бонусы пользователю
         await bonus_service.restore_bonus(session, payout.user_id, payout.amount)
-        payout.status = "rejected"
+        payout.status = PayoutStatus.rejected
+        tg_id = (await session.get(User, payout.user_id)).tg_id
         await session.commit()
 
     await callback.message.edit_text("❌ Заявка отклонена. Бонусы возвращены пользователю.")
     await callback.answer("Пользователь уведомлен")
 
+    if not tg_id:  # партнёр ещё не заходил в бота
+        return
     await callback.bot.send_message(
-        payout.user_id,
+        tg_id,
         "❌ Ваша заявка на вывод была отклонена.\n\n"
         "Бонусы возвращены на баланс."
     )
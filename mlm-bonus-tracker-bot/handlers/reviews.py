@@ -1,4 +1,6 @@
 import asyncio
+from typing import Optional
+
 from aiogram import Router, F, types
 from aiogram.filters import Command
 from aiogram.fsm.context import FSMContext
@@ -28,15 +30,12 @@ async def start_review(message: types.Message, state: FSMContext):
 
 # Приём текста от пользователя
 @router.message(ReviewForm.waiting_for_text)
-async def process_review(message: types.Message, state: FSMContext):
-    async with get_session() as session:
-        # Найдём пользователя по tg_id
-        result = await session.execute(select(User).where(User.tg_id == message.from_user.id))
-        user = result.scalar_one_or_none()
-        if not user:
-            await message.answer("⚠ Вы не зарегистрированы как партнёр.")
-            return
+async def process_review(message: types.Message, state: FSMContext, user: Optional[User]):
+    if not user:
+        await message.answer("⚠ Вы не зарегистрированы как партнёр.")
+        return
 
+    async with get_session() as session:
         new_review = Review(
             user_id=user.id,
             text=message.text,
@@ -54,12 +53,11 @@ async def process_review(message: types.Message, state: FSMContext):
 
 # Команда для админов и модераторов — список отзывов на модерацию
 @router.message(Command("reviews"))
-async def list_pending_reviews(message: types.Message):
-    async with get_session() as session:
-        user = await session.get(User, message.from_user.id)
-        if not user or user.role not in [UserRole.admin, UserRole.moderator]:
-            return await message.answer("⛔ У вас нет доступа.")
+async def list_pending_reviews(message: types.Message, user: Optional[User]):
+    if not user or user.role not in [UserRole.admin, UserRole.moderator]:
+        return await message.answer("⛔ У вас нет доступа.")
 
+    async with get_session() as session:
         result = await session.execute(
             select(Review).where(Review.approved == False)
         )
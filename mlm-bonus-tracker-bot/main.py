@@ -24,6 +24,9 @@ from handlers import (
     statistics,
 )
 from mlm import tree  # отдельный модуль MLM-логики
+from services.balance_service import reconcile_forever
+from utils import charts
+from middlewares.user_cache import UserCacheMiddleware
 
 
 async def main():
@@ -37,6 +40,7 @@ async def main():
 
     # Инициализация базы данных
     await init_db()
+    await tree.ensure_tree_index()
 
     # Создаём бота
     bot = Bot(
@@ -45,6 +49,11 @@ async def main():
     )
     dp = Dispatcher()
 
+    # Пользователь из базы/кэша — один раз на апдейт (data["user"])
+    user_middleware = UserCacheMiddleware()
+    dp.message.outer_middleware(user_middleware)
+    dp.callback_query.outer_middleware(user_middleware)
+
     # Подключаем роутеры
     dp.include_router(common.router)
     dp.include_router(statistics.router)
@@ -63,8 +72,18 @@ async def main():
 
     logging.info(f"Бот запущен: @{(await bot.me()).username}")
 
+    # Фоновая сверка балансов бонусов
+    reconcile_task = None
+    if settings.BALANCE_RECONCILE_INTERVAL > 0:
+        reconcile_task = asyncio.create_task(reconcile_forever(settings.BALANCE_RECONCILE_INTERVAL))
+
     # Стартуем пуллинг
-    await dp.start_polling(bot)
+    try:
+        await dp.start_polling(bot)
+    finally:
+        if reconcile_task:
+            reconcile_task.cancel()
+        charts.shutdown()
 
 
 if __name__ == "__main__":
@@ -1,9 +1,8 @@
 from aiogram import BaseMiddleware
 from aiogram.types import Message
 from typing import Callable, Dict, Any, Awaitable
-from db import get_session
-from db.models import User, UserRole
-from sqlalchemy.future import select
+from db.models import UserRole
+from middlewares.user_cache import load_user
 
 class RoleMiddleware(BaseMiddleware):
     def __init__(self, allowed_roles: list[UserRole] = None):
@@ -15,9 +14,8 @@ class RoleMiddleware(BaseMiddleware):
         event: Message,
         data: Dict[str, Any]
     ) -> Any:
-        async with get_session() as session:
-            result = await session.execute(select(User).where(User.tg_id == event.from_user.id))
-            user = result.scalars().first()
+        # обычно пользователь уже найден UserCacheMiddleware
+        user = data["user"] if "user" in data else await load_user(event.from_user.id)
 
         if not user:
             await event.answer("❌ Сначала зарегистрируйтесь через /start")
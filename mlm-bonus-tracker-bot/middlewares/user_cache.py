@@ -0,0 +1,83 @@
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject, User as TgUser
+from sqlalchemy import select
+
+from config import settings
+from db import get_session
+from db.models import User
+
+
+class UserCache:
+    """
+    LRU-кэш пользователей по tg_id с коротким TTL.
+
+    Хранит отсоединённые от сессии объекты User — только для чтения (id, роль,
+    status_points, имя). Чтобы изменить пользователя, загрузите его в своей сессии
+    (session.get(User, user.id)) и после commit вызовите invalidate(tg_id) или put().
+    """
+
+    def __init__(self, ttl: float, max_size: int):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._entries: "OrderedDict[int, tuple[float, User]]" = OrderedDict()
+
+    def get(self, tg_id: int) -> Optional[User]:
+        entry = self._entries.get(tg_id)
+        if entry is None:
+            return None
+        expires, user = entry
+        if expires < time.monotonic():
+            del self._entries[tg_id]
+            return None
+        self._entries.move_to_end(tg_id)
+        return user
+
+    def put(self, user: User) -> None:
+        if self.ttl <= 0:
+            return
+        self._entries[user.tg_id] = (time.monotonic() + self.ttl, user)
+        self._entries.move_to_end(user.tg_id)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, tg_id: int) -> None:
+        self._entries.pop(tg_id, None)
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+
+user_cache = UserCache(settings.USER_CACHE_TTL, settings.USER_CACHE_SIZE)
+
+
+async def load_user(tg_id: int) -> Optional[User]:
+    """Пользователь по tg_id: из кэша или одним запросом к базе."""
+    user = user_cache.get(tg_id)
+    if user is None:
+        async with get_session() as session:
+            user = await session.scalar(select(User).where(User.tg_id == tg_id))
+        if user is not None:
+            user_cache.put(user)
+    return user
+
+
+class UserCacheMiddleware(BaseMiddleware):
+    """
+    Внешний middleware для message и callback_query: находит User один раз
+    на апдейт и кладёт его в data["user"] (None — пользователь не зарегистрирован).
+    Хендлеры получают его аргументом `user`.
+    """
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        from_user: Optional[TgUser] = data.get("event_from_user")
+        data["user"] = await load_user(from_user.id) if from_user else None
+        return await handler(event, data)
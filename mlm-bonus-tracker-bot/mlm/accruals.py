@@ -1,23 +1,28 @@
 """
 MLM: начисление бонусов по аплайну.
 
-Синхронизировано с текущими моделями:
-- get_session() из db.__init__
-- User, Bonus, BonusStatus из db.models
-- уровни и суммы читаем из Settings().MLM_LEVELS (если не задано — используем дефолт)
+Движок работает пачками: цепочки аплайнов всех плательщиков берутся одним
+запросом по дереву (mlm.tree), все бонусы вставляются одним bulk INSERT,
+status_points аплайнов увеличиваются одним UPDATE … WHERE id IN (...) на
+каждое значение прироста, потенциальный баланс (bonus_balances) — одним upsert.
+commit делает вызывающий — всё в одной транзакции.
+Суммы по линиям читаем из Settings().LINE_PAYOUTS (MLM_LEVELS в .env), иначе — дефолт.
 """
 
 from __future__ import annotations
 
 import logging
-from typing import List
+from collections import Counter, defaultdict
+from typing import Dict, Iterable, List, Optional, Tuple
 
-from sqlalchemy import select
+from sqlalchemy import insert, update
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from config import Settings
 from db import get_session
 from db.models import User, Bonus, BonusStatus
+from mlm.tree import IN_CHUNK, get_upline_chain, get_upline_chains
+from services.balance_service import adjust_balances
 
 log = logging.getLogger(__name__)
 settings = Settings()
@@ -28,24 +33,83 @@ DEFAULT_LEVELS = {
     6: 500, 7: 400, 8: 300, 9: 200, 10: 100,
 }
 
+# событие начисления: (deal_id | None, payer_id)
+AccrualEvent = Tuple[Optional[int], int]
+
+
+def get_line_payouts() -> Dict[int, int]:
+    """
+    MLM_LEVELS приходит из .env как словарь со строковыми ключами ("1" или "L1").
+    Приводим ключи к int.
+    """
+    result: Dict[int, int] = {}
+    for k, v in (settings.LINE_PAYOUTS or {}).items():
+        try:
+            result[int(str(k).lstrip("Ll"))] = int(v)
+        except (TypeError, ValueError):
+            continue
+    return result or DEFAULT_LEVELS
+
 
 async def _get_uplines(session: AsyncSession, user_id: int, depth: int) -> List[int]:
     """
     Собирает список ID аплайнов сверху вниз (1-й уровень — прямой пригласитель).
-    Останавливается раньше, если цепочка прерывается.
+    Цепочка берётся одним запросом по дереву (mlm.tree).
+    """
+    return [upline_id for _, upline_id in await get_upline_chain(session, user_id, depth)]
+
+
+async def accrue_events(session: AsyncSession, events: Iterable[AccrualEvent], points: int = 1) -> int:
     """
-    uplines: List[int] = []
-    current_id = user_id
+    Начисляет потенциальные бонусы аплайнам за пачку событий (сделок или новых партнёров)
+    и добавляет каждому аплайну points статусных баллов за событие.
 
-    for _ in range(depth):
-        result = await session.execute(select(User).where(User.id == current_id))
-        user = result.scalar_one_or_none()
-        if not user or not user.invited_by:
-            break
-        uplines.append(user.invited_by)
-        current_id = user.invited_by
+    Не коммитит. Возвращает количество созданных записей Bonus.
+    """
+    events = list(events)
+    if not events:
+        return 0
+    line_payouts = get_line_payouts()
+    chains = await get_upline_chains(session, (payer_id for _, payer_id in events), max(line_payouts))
+
+    rows = []
+    gained: Counter = Counter()
+    potential: Counter = Counter()
+    for deal_id, payer_id in events:
+        for level, receiver_id in chains.get(payer_id, ()):
+            amount = line_payouts.get(level)
+            if amount:
+                rows.append({
+                    "user_id": receiver_id,   # получатель бонуса
+                    "deal_id": deal_id,
+                    "payer_id": payer_id,
+                    "level": level,
+                    "amount": amount,
+                    "status": BonusStatus.potential,
+                })
+                potential[(receiver_id, BonusStatus.potential)] += amount
+            gained[receiver_id] += points
+
+    if rows:
+        await session.execute(insert(Bonus), rows)
+        await adjust_balances(session, potential)
+
+    # аплайны с одинаковым приростом — одним UPDATE
+    by_gain = defaultdict(list)
+    for user_id, gain in gained.items():
+        if gain:
+            by_gain[gain].append(user_id)
+    for gain, user_ids in by_gain.items():
+        for i in range(0, len(user_ids), IN_CHUNK):
+            await session.execute(
+                update(User)
+                .where(User.id.in_(user_ids[i:i + IN_CHUNK]))
+                .values(status_points=User.status_points + gain)
+                .execution_options(synchronize_session=False)
+            )
 
-    return uplines
+    log.info("Accrued %s bonuses for %s events (%s uplines)", len(rows), len(events), len(gained))
+    return len(rows)
 
 
 async def accrue_bonuses(deal_id: int, payer_id: int) -> int:
@@ -54,31 +118,8 @@ async def accrue_bonuses(deal_id: int, payer_id: int) -> int:
 
     Возвращает количество созданных записей Bonus.
     """
-    mlm_levels = settings.MLM_LEVELS or DEFAULT_LEVELS
-    created = 0
-
     async with get_session() as session:
-        uplines = await _get_uplines(session, payer_id, depth=len(mlm_levels))
-        for level, receiver_id in enumerate(uplines, start=1):
-            amount = mlm_levels.get(level)
-            if not amount:
-                continue
-
-            bonus = Bonus(
-                deal_id=deal_id,
-                payer_id=payer_id,
-                user_id=receiver_id,   # получатель бонуса
-                level=level,
-                amount=amount,
-                status=BonusStatus.potential,
-            )
-            session.add(bonus)
-            created += 1
-            log.info(
-                "Accrue bonus: deal=%s payer=%s -> receiver=%s level=%s amount=%s",
-                deal_id, payer_id, receiver_id, level, amount,
-            )
-
+        created = await accrue_events(session, [(deal_id, payer_id)])
         await session.commit()
 
     return created
@@ -2,179 +2,409 @@
 
 from __future__ import annotations
 
-from datetime import datetime
-from typing import Dict, List, Optional
+import logging
+import time
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Tuple, Union
 
 from aiogram import Router, types, F
 from aiogram.filters import Command
-from sqlalchemy import select
+from sqlalchemy import delete, func, insert, literal, select, true, union_all, update
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from config import settings
 from db import get_session
-from db.models import User, Bonus, BonusStatus
+from db.models import User, UserTree
 from mlm.status import get_user_status  # ✅ централизованная логика статусов
 
 router = Router()
+log = logging.getLogger(__name__)
 
-# ---------------------- Фоллбэки ----------------------
+# глубина структуры, которую показываем и по которой начисляем
+MAX_DEPTH = 10
+# сколько id передавать в одном IN (...) — лимит параметров SQLite
+IN_CHUNK = 500
 
-DEFAULT_LEVELS = {
-    1: 1000, 2: 900, 3: 800, 4: 700, 5: 600,
-    6: 500, 7: 400, 8: 300, 9: 200, 10: 100,
-}
+UserIds = Union[int, Iterable[int]]
 
+# ---------------------- Запросы по дереву ----------------------
+#
+# Все чтения дерева идут через tree_select(): он отдаёт только (id, level) —
+# из индекса user_tree или рекурсивным CTE по users.sponsor_id (MLM_TREE_INDEX=cte).
+# Полные строки User для обхода дерева не загружаются.
 
-def _get_line_payouts() -> Dict[int, int]:
+def recursive_walk(direction: str, user_id: Optional[UserIds] = None, max_depth: int = MAX_DEPTH):
     """
-    settings.MLM_LEVELS приходит из .env как словарь со строковыми ключами.
-    Приводим ключи к int.
+    WITH RECURSIVE по users.sponsor_id (работает и в SQLite, и в PostgreSQL).
+
+    direction="down" — даунлайн, "up" — аплайны. Колонки CTE: root_id, id, level
+    (level=1 — прямые партнёры / прямой спонсор). user_id может быть списком id;
+    None — обход от всех партнёров сразу (все пары аплайн → даунлайн, для пересборки индекса).
     """
-    if not settings.MLM_LEVELS:
-        return DEFAULT_LEVELS
-    result: Dict[int, int] = {}
-    for k, v in settings.MLM_LEVELS.items():
-        try:
-            result[int(k)] = int(v)
-        except Exception:
-            continue
-    return result if result else DEFAULT_LEVELS
+    if direction == "down":
+        seed = select(User.sponsor_id.label("root_id"), User.id.label("id"), literal(1).label("level"))
+        seed = seed.where(User.sponsor_id.is_not(None) if user_id is None else _match(User.sponsor_id, user_id))
+        walk = seed.cte("tree_walk", recursive=True)
+        step = (
+            select(walk.c.root_id, User.id, walk.c.level + 1)
+            .join(User, User.sponsor_id == walk.c.id)
+        )
+    elif direction == "up":
+        seed = (
+            select(User.id.label("root_id"), User.sponsor_id.label("id"), literal(1).label("level"))
+            .where(User.sponsor_id.is_not(None))
+        )
+        if user_id is not None:
+            seed = seed.where(_match(User.id, user_id))
+        walk = seed.cte("tree_walk", recursive=True)
+        step = (
+            select(walk.c.root_id, User.sponsor_id, walk.c.level + 1)
+            .join(User, User.id == walk.c.id)
+            .where(User.sponsor_id.is_not(None))
+        )
+    else:
+        raise ValueError(f"Unknown direction: {direction}")
+    # ограничение глубины заодно защищает от зацикленных sponsor_id
+    return walk.union_all(step.where(walk.c.level < max_depth))
 
 
-# ---------------------- Бизнес-логика ----------------------
+def tree_select(direction: str, user_id: UserIds, max_depth: int = MAX_DEPTH):
+    """
+    SELECT (root_id, id, level) даунлайна или аплайнов user_id (одного или списка)
+    до max_depth уровней.
+    """
+    if settings.MLM_TREE_INDEX == "cte":
+        walk = recursive_walk(direction, user_id, max_depth)
+        return select(walk.c.root_id, walk.c.id, walk.c.level)
+    if direction == "down":
+        return (
+            select(
+                UserTree.ancestor_id.label("root_id"),
+                UserTree.descendant_id.label("id"),
+                UserTree.depth.label("level"),
+            )
+            .where(_match(UserTree.ancestor_id, user_id), UserTree.depth <= max_depth)
+        )
+    if direction == "up":
+        return (
+            select(
+                UserTree.descendant_id.label("root_id"),
+                UserTree.ancestor_id.label("id"),
+                UserTree.depth.label("level"),
+            )
+            .where(_match(UserTree.descendant_id, user_id), UserTree.depth <= max_depth)
+        )
+    raise ValueError(f"Unknown direction: {direction}")
+
+
+def _match(column, user_id: UserIds):
+    if isinstance(user_id, int):
+        return column == user_id
+    return column.in_(list(user_id))
+
+
+async def get_upline_chain(session: AsyncSession, user_id: int, max_depth: int = MAX_DEPTH) -> List[Tuple[int, int]]:
+    """Цепочка аплайнов [(уровень, user_id), …], 1-й уровень — прямой спонсор."""
+    q = tree_select("up", user_id, max_depth).subquery()
+    result = await session.execute(select(q.c.level, q.c.id).order_by(q.c.level))
+    return [(level, upline_id) for level, upline_id in result.all()]
+
+
+async def get_upline_chains(
+    session: AsyncSession, user_ids: Iterable[int], max_depth: int = MAX_DEPTH
+) -> Dict[int, List[Tuple[int, int]]]:
+    """Цепочки аплайнов сразу для многих партнёров: {user_id: [(уровень, upline_id), …]}."""
+    chains: Dict[int, List[Tuple[int, int]]] = {}
+    ids = list(dict.fromkeys(user_ids))
+    for i in range(0, len(ids), IN_CHUNK):
+        q = tree_select("up", ids[i:i + IN_CHUNK], max_depth).subquery()
+        result = await session.execute(select(q.c.root_id, q.c.level, q.c.id).order_by(q.c.root_id, q.c.level))
+        for root_id, level, upline_id in result.all():
+            chains.setdefault(root_id, []).append((level, upline_id))
+    return chains
+
+
+# ---------------------- Индекс дерева (closure table) ----------------------
+#
+# user_tree хранит все пары (аплайн, даунлайн, расстояние) по users.sponsor_id,
+# поэтому цепочка аплайнов и количество партнёров по уровням — один индексный запрос
+# вместо запроса на каждый уровень. Функции ниже не делают commit: индекс меняется
+# в той же транзакции, что и users.sponsor_id.
+
+async def attach_to_tree(session: AsyncSession, user_id: int, sponsor_id: int) -> None:
+    """Добавляет в индекс нового партнёра (листом) под спонсора."""
+    await session.execute(
+        insert(UserTree).from_select(
+            ["ancestor_id", "descendant_id", "depth"],
+            union_all(
+                select(literal(sponsor_id), literal(user_id), literal(1)),
+                select(UserTree.ancestor_id, literal(user_id), UserTree.depth + 1)
+                .where(UserTree.descendant_id == sponsor_id),
+            ),
+        )
+    )
 
-async def update_partner_status(user: User, session: AsyncSession):
+
+async def move_in_tree(session: AsyncSession, user_id: int, new_sponsor_id: Optional[int]) -> None:
     """
-    Пересчёт статуса партнёра на основе его status_points.
+    Переносит партнёра вместе со всей его веткой под другого спонсора
+    (None — сделать корнем). Меняет users.sponsor_id и индекс в одной транзакции
+    и коммитит; кэш статистики структуры старых и новых аплайнов поправляется
+    только после commit (как в process_new_partner).
     """
-    points = getattr(user, "status_points", 0) or 0
-    user.status = get_user_status(points)
+    old_uplines = await get_upline_chain(session, user_id, MAX_DEPTH)
+    branch = await _branch_profile(session, user_id, depth=MAX_DEPTH - 1)
+
+    subtree = union_all(
+        select(literal(user_id).label("id"), literal(0).label("depth")),
+        select(UserTree.descendant_id, UserTree.depth).where(UserTree.ancestor_id == user_id),
+    ).subquery("subtree")
+
+    if new_sponsor_id is not None:
+        cycle = await session.scalar(
+            select(func.count()).select_from(subtree).where(subtree.c.id == new_sponsor_id)
+        )
+        if cycle:
+            raise ValueError("Нельзя перенести партнёра в его собственную структуру")
+
+    # 1) рвём связи ветки со старыми аплайнами
+    old_ancestors = select(UserTree.ancestor_id).where(UserTree.descendant_id == user_id)
+    await session.execute(
+        delete(UserTree).where(
+            UserTree.descendant_id.in_(select(subtree.c.id)),
+            UserTree.ancestor_id.in_(old_ancestors),
+        )
+    )
+
+    # 2) каждый новый аплайн получает всю ветку
+    if new_sponsor_id is not None:
+        new_ancestors = union_all(
+            select(literal(new_sponsor_id).label("id"), literal(1).label("depth")),
+            select(UserTree.ancestor_id, UserTree.depth + 1).where(UserTree.descendant_id == new_sponsor_id),
+        ).subquery("new_ancestors")
+        await session.execute(
+            insert(UserTree).from_select(
+                ["ancestor_id", "descendant_id", "depth"],
+                select(new_ancestors.c.id, subtree.c.id, new_ancestors.c.depth + subtree.c.depth)
+                .select_from(new_ancestors.join(subtree, true())),
+            )
+        )
+
+    await session.execute(update(User).where(User.id == user_id).values(sponsor_id=new_sponsor_id))
+    new_uplines = await get_upline_chain(session, user_id, MAX_DEPTH)
     await session.commit()
 
+    structure_cache.apply(old_uplines, branch, -1)
+    structure_cache.apply(new_uplines, branch, +1)
 
-async def _get_user(session: AsyncSession, user_id: int) -> Optional[User]:
-    result = await session.execute(select(User).where(User.id == user_id))
-    return result.scalar_one_or_none()
+
+async def rebuild_tree_index(session: AsyncSession) -> int:
+    """
+    Полностью пересобирает user_tree по users.sponsor_id одним
+    INSERT … WITH RECURSIVE. Возвращает число записей.
+    """
+    await session.execute(delete(UserTree))
+    # глубина не больше числа партнёров — защита от циклов
+    max_depth = await session.scalar(select(func.count()).select_from(User)) or 1
+    walk = recursive_walk("down", None, max_depth)
+    result = await session.execute(
+        insert(UserTree).from_select(
+            ["ancestor_id", "descendant_id", "depth"],
+            select(walk.c.root_id, walk.c.id, walk.c.level),
+        )
+    )
+    structure_cache.clear()
+    return result.rowcount
+
+
+async def ensure_tree_index() -> None:
+    """При старте: строит индекс для базы, в которой он ещё не заполнен."""
+    async with get_session() as session:
+        has_index = await session.scalar(select(UserTree.descendant_id).limit(1))
+        has_tree = await session.scalar(select(User.id).where(User.sponsor_id.is_not(None)).limit(1))
+        if has_index is None and has_tree is not None:
+            total = await rebuild_tree_index(session)
+            await session.commit()
+            log.info("MLM tree index rebuilt: %s links", total)
 
 
+# ---------------------- Бизнес-логика ----------------------
+
 async def accrue_bonus(payer_id: int, session: AsyncSession):
     """
-    Начисление потенциальных бонусов аплайнам при событии в нижней ветке.
-    Идём вверх по цепочке invited_by, используя выплаты из MLM_LEVELS.
-    """
-    line_payouts = _get_line_payouts()
-    max_level = max(line_payouts.keys()) if line_payouts else 0
-
-    current_user_id = payer_id
-    level = 1
-
-    while level <= max_level:
-        user = await _get_user(session, current_user_id)
-        if not user or not getattr(user, "invited_by", None):
-            break
-
-        inviter_id = user.invited_by
-        amount = line_payouts.get(level)
-        if amount:
-            session.add(
-                Bonus(
-                    user_id=inviter_id,
-                    payer_id=payer_id,
-                    deal_id=None,
-                    level=level,
-                    amount=amount,
-                    status=BonusStatus.potential,
-                    created_at=datetime.utcnow(),
-                )
-            )
-
-        current_user_id = inviter_id
-        level += 1
+    Начисление потенциальных бонусов аплайнам при событии в нижней ветке
+    (см. mlm.accruals.accrue_events).
+    """
+    from mlm.accruals import accrue_events  # accruals сам импортирует tree
 
+    await accrue_events(session, [(None, payer_id)], points=0)
     await session.commit()
 
 
 async def process_new_partner(session: AsyncSession, sponsor: User, partner: User):
     """
-    Вызывается при добавлении нового партнёра.
-    1) Проставляет связь по дереву (invited_by),
-    2) Начисляет потенциальные бонусы вверх по цепочке,
-    3) Обновляет статусы аплайнов (минимум спонсора).
+    Вызывается при добавлении нового партнёра, всё в одной транзакции:
+    1) Проставляет связь по дереву (sponsor_id) и добавляет партнёра в индекс,
+    2) Начисляет потенциальные бонусы вверх по цепочке (одним INSERT).
+    Статус аплайнов считается из status_points на лету (mlm.status).
+    Закэшированная статистика структуры аплайнов обновляется после commit.
     """
-    # 1) связь
-    if not getattr(partner, "invited_by", None):
-        partner.invited_by = sponsor.id
-        session.add(partner)
-        await session.commit()  # чтобы partner.id точно был
-
-    # 2) бонусы по линии
-    await accrue_bonus(partner.id, session)
-
-    # 3) статусы аплайнов (пересчёт хотя бы спонсора, можно расширить на всю цепочку)
-    current_id = sponsor.id
-    for _ in range(10):  # разумный лимит глубины
-        u = await _get_user(session, current_id)
-        if not u:
-            break
-        await update_partner_status(u, session)
-        if not getattr(u, "invited_by", None):
-            break
-        current_id = u.invited_by
+    from mlm.accruals import accrue_events  # accruals сам импортирует tree
+
+    partner.sponsor_id = sponsor.id
+    session.add(partner)
+    await session.flush()  # чтобы partner.id точно был
+    await attach_to_tree(session, partner.id, sponsor.id)
+    await accrue_events(session, [(None, partner.id)], points=0)
+    uplines = await get_upline_chain(session, partner.id, MAX_DEPTH)
+    branch = await _branch_profile(session, partner.id, depth=0)
+    await session.commit()
+    structure_cache.apply(uplines, branch, +1)
 
 
 # ---------------------- Структура и статистика ----------------------
 
 async def get_downline_by_levels(
-    session: AsyncSession, user_id: int, max_depth: int = 10
-) -> Dict[int, List[User]]:
+    session: AsyncSession, user_id: int, max_depth: int = MAX_DEPTH
+) -> Dict[int, List[int]]:
     """
-    Возвращает словарь {уровень: [список пользователей]} для партнёрской структуры.
+    Возвращает словарь {уровень: [id партнёров]} для партнёрской структуры.
     """
-    levels: Dict[int, List[User]] = {}
-    current_level_ids = [user_id]
-
-    for depth in range(1, max_depth + 1):
-        if not current_level_ids:
-            break
-
-        result = await session.execute(
-            select(User).where(User.invited_by.in_(current_level_ids))
-        )
-        users = result.scalars().all()
-        if not users:
-            break
+    q = tree_select("down", user_id, max_depth).subquery()
+    result = await session.execute(select(q.c.level, q.c.id).order_by(q.c.level))
+    levels: Dict[int, List[int]] = {}
+    for level, partner_id in result.all():
+        levels.setdefault(level, []).append(partner_id)
+    return levels
 
-        levels[depth] = users
-        current_level_ids = [u.id for u in users]
 
-    return levels
+async def get_downline_counts(session: AsyncSession, user_id: int, max_depth: int = MAX_DEPTH) -> Dict[int, int]:
+    """Количество партнёров по уровням {уровень: количество} одним GROUP BY."""
+    q = tree_select("down", user_id, max_depth).subquery()
+    result = await session.execute(
+        select(q.c.level, func.count()).group_by(q.c.level).order_by(q.c.level)
+    )
+    return {level: count for level, count in result.all()}
 
 
 async def get_structure_stats(session: AsyncSession, user_id: int) -> dict:
     """
-    Возвращает статистику структуры:
+    Возвращает статистику структуры (из кэша, если она там есть):
     - total_partners: общее число партнёров внизу
     - levels: глубина структуры
     - by_levels: {уровень: количество}
+    - monthly: {'YYYY-MM': сколько партнёров структуры пришло в этом месяце}
     """
-    downline = await get_downline_by_levels(session, user_id, max_depth=10)
-    total_partners = sum(len(users) for users in downline.values())
-    total_levels = len(downline)
-
-    return {
-        "total_partners": total_partners,
-        "levels": total_levels,
-        "by_levels": {level: len(users) for level, users in downline.items()},
+    stats = structure_cache.get(user_id)
+    if stats is not None:
+        return stats
+
+    from services.statistics_service import get_network_growth  # statistics_service сам импортирует tree
+
+    by_levels = await get_downline_counts(session, user_id, max_depth=MAX_DEPTH)
+    monthly = await get_network_growth(session, user_id, since=None) if by_levels else {}
+    stats = {
+        "total_partners": sum(by_levels.values()),
+        "levels": len(by_levels),
+        "by_levels": by_levels,
+        "monthly": monthly,
     }
+    structure_cache.put(user_id, stats)
+    return stats
+
+
+# ---------------------- Кэш статистики структуры ----------------------
+#
+# Статистика структуры хранится в памяти процесса STRUCTURE_STATS_TTL секунд.
+# Добавление и перенос партнёра не сбрасывают кэш аплайнов, а поправляют его:
+# ветка (сам партнёр и его даунлайн) описывается счётчиками {(глубина, месяц): n},
+# и каждому закэшированному аплайну на расстоянии a они добавляются (или вычитаются)
+# на уровни a + глубина. TTL подстраховывает от изменений, сделанных в обход
+# process_new_partner / move_in_tree (другой процесс, ручная правка базы).
+
+Branch = Dict[Tuple[int, str], int]
+
+
+async def _branch_profile(session: AsyncSession, user_id: int, depth: int) -> Branch:
+    """Счётчики {(глубина, месяц регистрации): количество} для партнёра и его даунлайна до depth."""
+    from services.statistics_service import month_expr
+
+    members = select(literal(user_id).label("id"), literal(0).label("level"))
+    if depth > 0:
+        tree = tree_select("down", user_id, depth).subquery()
+        members = union_all(members, select(tree.c.id, tree.c.level))
+    members = members.subquery("branch")
+    month = month_expr(session, User.created_at).label("month")
+    result = await session.execute(
+        select(members.c.level, month, func.count())
+        .join(User, User.id == members.c.id)
+        .group_by(members.c.level, month)
+    )
+    return {(level, m): count for level, m, count in result.all()}
+
+
+class StructureStatsCache:
+    def __init__(self, ttl: float, max_size: int = 10_000):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._entries: "OrderedDict[int, Tuple[float, dict]]" = OrderedDict()
+
+    def get(self, user_id: int) -> Optional[dict]:
+        entry = self._entries.get(user_id)
+        if entry is None:
+            return None
+        expires, stats = entry
+        if expires < time.monotonic():
+            del self._entries[user_id]
+            return None
+        self._entries.move_to_end(user_id)
+        return _copy_stats(stats)
+
+    def put(self, user_id: int, stats: dict) -> None:
+        if self.ttl <= 0:
+            return
+        self._entries[user_id] = (time.monotonic() + self.ttl, _copy_stats(stats))
+        self._entries.move_to_end(user_id)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def apply(self, uplines: List[Tuple[int, int]], branch: Branch, sign: int) -> None:
+        """Добавляет (sign=+1) или убирает (-1) ветку из статистики аплайнов [(расстояние, id)]."""
+        for distance, upline_id in uplines:
+            entry = self._entries.get(upline_id)
+            if entry is None:
+                continue
+            stats = entry[1]
+            by_levels, monthly = stats["by_levels"], stats["monthly"]
+            for (depth, month), count in branch.items():
+                level = distance + depth
+                if level > MAX_DEPTH:
+                    continue
+                by_levels[level] = by_levels.get(level, 0) + sign * count
+                monthly[month] = monthly.get(month, 0) + sign * count
+            stats["by_levels"] = {lvl: n for lvl, n in sorted(by_levels.items()) if n > 0}
+            stats["monthly"] = {m: n for m, n in sorted(monthly.items()) if n > 0}
+            stats["total_partners"] = sum(stats["by_levels"].values())
+            stats["levels"] = len(stats["by_levels"])
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+
+def _copy_stats(stats: dict) -> dict:
+    return {**stats, "by_levels": dict(stats["by_levels"]), "monthly": dict(stats["monthly"])}
+
+
+structure_cache = StructureStatsCache(settings.STRUCTURE_STATS_TTL)
 
 
 # ---------------------- Хендлеры для бота ----------------------
 
 @router.message(F.text == "📊 Моя структура")
-async def my_structure(message: types.Message):
+async def my_structure(message: types.Message, user: Optional[User]):
     """Партнёр смотрит статистику своей структуры."""
     async with get_session() as session:
-        stats = await get_structure_stats(session, message.from_user.id)
+        stats = await get_structure_stats(session, user.id) if user else None
 
     if not stats or stats["total_partners"] == 0:
         await message.answer("У вас пока нет структуры.")
@@ -189,16 +419,13 @@ async def my_structure(message: types.Message):
 
 
 @router.message(Command("status"))
-async def my_status(message: types.Message):
+async def my_status(message: types.Message, user: Optional[User]):
     """Показать текущий статус партнёра."""
-    async with get_session() as session:
-        user = await session.get(User, message.from_user.id)
-
     if not user:
         await message.answer("❌ Вы не зарегистрированы в системе.")
         return
 
     await message.answer(
-        f"Ваш текущий статус: <b>{user.status or 'Нет статуса'}</b>",
+        f"Ваш текущий статус: <b>{get_user_status(user.status_points)}</b>",
         parse_mode="HTML",
     )
@@ -0,0 +1,97 @@
+"""
+Нагрузочный тест SQLite под конкурентные хендлеры (много записей).
+
+    python scripts/db_benchmark.py                      # default vs tuned, временный файл
+    python scripts/db_benchmark.py --handlers 50 --ops 40
+
+Каждый «хендлер» в цикле делает то же, что бот при регистрации лида и начислении:
+находит пользователя по tg_id, добавляет лид, увеличивает status_points и коммитит,
+а каждая пятая операция только читает (список лидов). Сравниваются движок
+с настройками по умолчанию (default) и db.db.create_engine (tuned: WAL, прагмы, пул).
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir)))
+
+from sqlalchemy import select, update  # noqa: E402
+from sqlalchemy.exc import OperationalError  # noqa: E402
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine  # noqa: E402
+from sqlalchemy.orm import sessionmaker  # noqa: E402
+
+from db.db import create_engine  # noqa: E402
+from db.models import Base, Lead, User  # noqa: E402
+
+USERS = 1000
+
+
+async def _prepare(engine):
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+        await conn.execute(User.__table__.insert(), [{"tg_id": 10_000 + i, "status_points": 0} for i in range(USERS)])
+
+
+async def _handler(factory, ops, latencies, errors):
+    for i in range(ops):
+        tg_id = 10_000 + random.randrange(USERS)
+        t0 = time.perf_counter()
+        try:
+            async with factory() as session:
+                user_id = await session.scalar(select(User.id).where(User.tg_id == tg_id))
+                if i % 5 == 4:
+                    (await session.execute(select(Lead).where(Lead.user_id == user_id).limit(20))).all()
+                else:
+                    session.add(Lead(user_id=user_id, name="bench", phone=f"+7{tg_id}"))
+                    await session.execute(
+                        update(User).where(User.id == user_id).values(status_points=User.status_points + 1)
+                    )
+                    await session.commit()
+        except OperationalError:
+            errors.append(1)
+            continue
+        latencies.append(time.perf_counter() - t0)
+
+
+async def run(profile, handlers, ops):
+    path = os.path.join(tempfile.mkdtemp(prefix="dbbench_"), "bench.db")
+    url = f"sqlite+aiosqlite:///{path}"
+    engine = create_async_engine(url) if profile == "default" else create_engine(url)
+    await _prepare(engine)
+    factory = sessionmaker(engine, expire_on_commit=False, class_=AsyncSession)
+
+    latencies, errors = [], []
+    t0 = time.perf_counter()
+    await asyncio.gather(*(_handler(factory, ops, latencies, errors) for _ in range(handlers)))
+    elapsed = time.perf_counter() - t0
+    await engine.dispose()
+
+    latencies.sort()
+    p95 = latencies[int(len(latencies) * 0.95) - 1] if latencies else 0
+    print(
+        f"{profile:8} ops/s={len(latencies) / elapsed:8.0f}  "
+        f"p50={statistics.median(latencies) * 1000 if latencies else 0:7.1f} ms  "
+        f"p95={p95 * 1000:7.1f} ms  errors={len(errors)}"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--handlers", type=int, default=20, help="одновременных хендлеров")
+    parser.add_argument("--ops", type=int, default=50, help="операций на хендлер")
+    parser.add_argument("--profile", choices=["default", "tuned", "both"], default="both")
+    args = parser.parse_args()
+
+    profiles = ["default", "tuned"] if args.profile == "both" else [args.profile]
+    for profile in profiles:
+        asyncio.run(run(profile, args.handlers, args.ops))
+
+
+if __name__ == "__main__":
+    main()
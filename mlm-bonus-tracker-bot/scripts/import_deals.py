@@ -0,0 +1,72 @@
+"""
+Импорт подтверждённых сделок из CSV с начислением MLM-бонусов.
+
+    python scripts/import_deals.py deals.csv
+    python scripts/import_deals.py deals.csv --delimiter ";" --batch 5000
+
+Колонки: user_id (users.id партнёра), amount, created_at (необязательно, ISO 8601 —
+пустое значение означает «сейчас»). Каждая пачка вставляется одним INSERT, бонусы
+аплайнам начисляются пакетно (services.deal_service.import_deals) и коммитятся вместе со сделками.
+"""
+
+import argparse
+import asyncio
+import csv
+import os
+import sys
+import time
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir)))
+
+from db import get_session  # noqa: E402
+from services.deal_service import import_deals  # noqa: E402
+
+
+def read_deals(path, delimiter):
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        for line_no, row in enumerate(csv.DictReader(f, delimiter=delimiter), start=2):
+            try:
+                created_at = (row.get("created_at") or "").strip()
+                deal = {
+                    "user_id": int(row["user_id"]),
+                    "amount": Decimal(row["amount"].strip().replace(",", ".")),
+                    "created_at": datetime.fromisoformat(created_at) if created_at else None,
+                }
+            except (KeyError, ValueError, InvalidOperation) as e:
+                raise SystemExit(f"{path}:{line_no}: некорректная строка {row!r} ({e!r})")
+            yield deal
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("path", help="CSV-файл со сделками")
+    parser.add_argument("--delimiter", default=",")
+    parser.add_argument("--batch", type=int, default=5000, help="сделок в одной транзакции")
+    args = parser.parse_args()
+
+    deals, bonuses = 0, 0
+    started = time.perf_counter()
+    batch = []
+
+    async def flush():
+        nonlocal deals, bonuses
+        async with get_session() as session:
+            bonuses += await import_deals(session, batch)
+        deals += len(batch)
+        batch.clear()
+
+    for deal in read_deals(args.path, args.delimiter):
+        batch.append(deal)
+        if len(batch) >= args.batch:
+            await flush()
+    if batch:
+        await flush()
+
+    print(f"Импортировано сделок: {deals}, начислено бонусов: {bonuses} "
+          f"за {time.perf_counter() - started:.1f} с")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,149 @@
+"""
+Баланс бонусов по статусам (таблица bonus_balances).
+
+Каждое изменение bonuses.status / новые бонусы сопровождаются adjust_balances()
+в той же транзакции, поэтому чтение баланса — выборка до четырёх строк по
+первичному ключу (user_id, status) вместо GROUP BY по всем бонусам.
+reconcile_balances() периодически сверяет баланс с bonuses и исправляет расхождения
+(под блокировкой строк баланса — параллельные начисления не теряются).
+"""
+
+import asyncio
+import logging
+from collections import defaultdict
+from decimal import Decimal
+from typing import Dict, Iterable, List, Mapping, Tuple
+
+from sqlalchemy import func, select, tuple_, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from db import get_session
+from db.models import Bonus, BonusBalance, BonusStatus
+
+log = logging.getLogger(__name__)
+
+BalanceKey = Tuple[int, BonusStatus]
+
+_UPSERT_INSERTS = {"sqlite": sqlite.insert, "postgresql": postgresql.insert}
+
+
+def _insert(session: AsyncSession):
+    dialect = session.bind.dialect.name
+    if dialect not in _UPSERT_INSERTS:
+        raise RuntimeError(f"bonus_balances: unsupported dialect {dialect}")
+    return _UPSERT_INSERTS[dialect](BonusBalance)
+
+
+def _upsert_increment(session: AsyncSession):
+    stmt = _insert(session)
+    return stmt.on_conflict_do_update(
+        index_elements=[BonusBalance.user_id, BonusBalance.status],
+        set_={"amount": BonusBalance.amount + stmt.excluded.amount},
+    )
+
+
+async def adjust_balances(session: AsyncSession, deltas: Mapping[BalanceKey, Decimal]) -> None:
+    """Прибавляет суммы к балансам {(user_id, status): delta} одним upsert. Не коммитит."""
+    rows = [
+        {"user_id": user_id, "status": status, "amount": amount}
+        for (user_id, status), amount in deltas.items() if amount
+    ]
+    if rows:
+        await session.execute(_upsert_increment(session), rows)
+
+
+async def move_balances(
+    session: AsyncSession,
+    moved: Iterable[Tuple[int, Decimal]],
+    from_status: BonusStatus,
+    to_status: BonusStatus,
+) -> None:
+    """Переносит суммы [(user_id, amount)] бонусов, сменивших статус from_status → to_status."""
+    deltas: Dict[BalanceKey, Decimal] = defaultdict(Decimal)
+    for user_id, amount in moved:
+        deltas[(user_id, from_status)] -= Decimal(amount)
+        deltas[(user_id, to_status)] += Decimal(amount)
+    await adjust_balances(session, deltas)
+
+
+async def get_balances(session: AsyncSession, user_id: int) -> Dict[str, Decimal]:
+    """Баланс пользователя {status: сумма} по всем статусам (отсутствующие — 0)."""
+    result = await session.execute(
+        select(BonusBalance.status, BonusBalance.amount).where(BonusBalance.user_id == user_id)
+    )
+    balances = {status.value: amount or Decimal(0) for status, amount in result.all()}
+    for s in BonusStatus:
+        balances.setdefault(s.value, Decimal(0))
+    return balances
+
+
+async def _mismatched(session: AsyncSession) -> List[BalanceKey]:
+    """Ключи (user_id, status), где bonus_balances расходится с суммами по bonuses."""
+    actual = {
+        (user_id, status): total
+        for user_id, status, total in (await session.execute(
+            select(Bonus.user_id, Bonus.status, func.sum(Bonus.amount)).group_by(Bonus.user_id, Bonus.status)
+        )).all()
+    }
+    stored = {
+        (user_id, status): amount
+        for user_id, status, amount in (await session.execute(
+            select(BonusBalance.user_id, BonusBalance.status, BonusBalance.amount)
+        )).all()
+    }
+    return [
+        key for key in actual.keys() | stored.keys()
+        if Decimal(stored.get(key) or 0) != Decimal(actual.get(key) or 0)
+    ]
+
+
+async def reconcile_balances(session: AsyncSession) -> int:
+    """
+    Сверяет bonus_balances с суммами по bonuses и исправляет расхождения.
+    Возвращает число исправленных записей.
+
+    Расхождения ищутся без блокировок, но исправляются только после блокировки этих строк
+    баланса (FOR UPDATE), и сумма пересчитывается уже следующим запросом: в READ COMMITTED
+    он видит всё, что закоммитили начисления и выводы до блокировки, а остальные ждут нас
+    и прибавят свои дельты поверх. Сумма, прочитанная до блокировки, в баланс не пишется.
+    """
+    keys = await _mismatched(session)
+    await session.commit()
+    if not keys:
+        return 0
+
+    in_keys = tuple_(BonusBalance.user_id, BonusBalance.status).in_(keys)
+    # строк, которых нет, не заблокировать: сначала создаём их с нулём
+    await session.execute(
+        _insert(session).on_conflict_do_nothing(index_elements=[BonusBalance.user_id, BonusBalance.status]),
+        [{"user_id": user_id, "status": status, "amount": Decimal(0)} for user_id, status in keys],
+    )
+    await session.execute(select(BonusBalance.user_id).where(in_keys).with_for_update())
+
+    total = (
+        select(func.coalesce(func.sum(Bonus.amount), 0))
+        .where(Bonus.user_id == BonusBalance.user_id, Bonus.status == BonusBalance.status)
+        .scalar_subquery()
+    )
+    result = await session.execute(
+        update(BonusBalance).where(in_keys, BonusBalance.amount != total).values(amount=total)
+    )
+    await session.commit()
+    fixed = result.rowcount
+    if fixed:
+        log.warning("bonus_balances reconciled: %s rows fixed", fixed)
+    return fixed
+
+
+async def reconcile_forever(interval: float) -> None:
+    """Фоновая задача: сверка балансов раз в interval секунд."""
+    while True:
+        try:
+            async with get_session() as session:
+                await reconcile_balances(session)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            log.exception("bonus_balances reconciliation failed")
+        await asyncio.sleep(interval)
@@ -1,29 +1,23 @@
+from decimal import Decimal
 from typing import List, Optional, Dict
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, func, update
+from sqlalchemy import bindparam, select, update
 
-from db.models import Bonus, User, BonusStatus
-from mlm.tree import accrue_bonus as tree_accrue_bonus, update_partner_status
+from db.models import Bonus, BonusStatus
+from mlm.accruals import accrue_events
+from services.balance_service import get_balances, move_balances
 
 
 # ---------------------- Начисление бонусов ----------------------
 
-async def accrue_bonus(session: AsyncSession, user_id: int, amount: int = 0):
+async def accrue_bonus(session: AsyncSession, user_id: int, amount: int = 0, deal_id: Optional[int] = None):
     """
     Обёртка для начисления бонусов при подтверждении сделки.
-    - amount оставлен для совместимости.
-    - вызывает accrue_bonus из mlm.tree (начисление по линиям).
-    - обновляет статус партнёра (Бронза → Серебро → Золото и т.д.).
+    - amount оставлен для совместимости (суммы — по линиям из MLM_LEVELS).
+    - начисляет бонусы аплайнам и статусные баллы одной пачкой (mlm.accruals).
+    - не коммитит: сделка и начисления сохраняются вызывающим одной транзакцией.
     """
-    user = await session.get(User, user_id)
-    if not user:
-        return
-
-    # Пересчёт статуса партнёра
-    await update_partner_status(user, session)
-
-    # Начисление бонусов по дереву
-    await tree_accrue_bonus(user_id, session)
+    return await accrue_events(session, [(deal_id, user_id)])
 
 
 # ---------------------- Операции с бонусами ----------------------
@@ -39,25 +33,23 @@ async def list_user_bonuses(session: AsyncSession, user_id: int, limit: int = 50
     return list(res.scalars().all())
 
 
-async def totals_by_status(session: AsyncSession, user_id: int) -> Dict[str, int]:
-    q = (
-        select(Bonus.status, func.coalesce(func.sum(Bonus.amount), 0))
-        .where(Bonus.user_id == user_id)
-        .group_by(Bonus.status)
-    )
-    res = await session.execute(q)
-    rows = res.all()
-    totals = {status.value: int(total or 0) for status, total in rows}
-    # гарантируем наличие всех ключей
-    for s in BonusStatus:
-        totals.setdefault(s.value, 0)
-    return totals
+async def totals_by_status(session: AsyncSession, user_id: int) -> Dict[str, Decimal]:
+    """Суммы бонусов пользователя по статусам — из bonus_balances (O(1), без GROUP BY)."""
+    return await get_balances(session, user_id)
+
+
+def _status_is(status: BonusStatus):
+    """
+    Условие на статус с литералом вместо параметра: так планировщик (и PostgreSQL
+    с подготовленными запросами asyncpg, и SQLite) видит, что подходит частичный индекс.
+    """
+    return Bonus.status == bindparam(None, status, type_=Bonus.status.type, literal_execute=True)
 
 
 async def list_pending_bonuses(session: AsyncSession, limit: int = 100) -> List[Bonus]:
     q = (
         select(Bonus)
-        .where(Bonus.status == BonusStatus.PENDING)
+        .where(_status_is(BonusStatus.potential))
         .order_by(Bonus.id.desc())
         .limit(limit)
     )
@@ -65,85 +57,71 @@ async def list_pending_bonuses(session: AsyncSession, limit: int = 100) -> List[
     return list(res.scalars().all())
 
 
-async def approve_bonus(session: AsyncSession, bonus_id: int) -> Optional[Bonus]:
+async def _set_status(session: AsyncSession, where, from_status: BonusStatus, to_status: BonusStatus) -> List[Bonus]:
+    """
+    Меняет статус бонусов одним UPDATE … RETURNING и переносит суммы между балансами
+    в той же транзакции. Возвращает изменённые бонусы.
+    """
     q = (
         update(Bonus)
-        .where(Bonus.id == bonus_id, Bonus.status == BonusStatus.PENDING)
-        .values(status=BonusStatus.APPROVED)
+        .where(*where, _status_is(from_status))
+        .values(status=to_status)
         .returning(Bonus)
     )
-    res = await session.execute(q)
+    bonuses = list((await session.scalars(q)).all())
+    await move_balances(session, [(b.user_id, b.amount) for b in bonuses], from_status, to_status)
+    return bonuses
+
+
+async def approve_bonus(session: AsyncSession, bonus_id: int) -> Optional[Bonus]:
+    bonuses = await _set_status(session, [Bonus.id == bonus_id], BonusStatus.potential, BonusStatus.confirmed)
     await session.commit()
-    row = res.fetchone()
-    return row[0] if row else None
+    return bonuses[0] if bonuses else None
 
 
 async def reject_bonus(session: AsyncSession, bonus_id: int) -> Optional[Bonus]:
-    q = (
-        update(Bonus)
-        .where(Bonus.id == bonus_id, Bonus.status == BonusStatus.PENDING)
-        .values(status=BonusStatus.REJECTED)
-        .returning(Bonus)
-    )
-    res = await session.execute(q)
+    bonuses = await _set_status(session, [Bonus.id == bonus_id], BonusStatus.potential, BonusStatus.rejected)
     await session.commit()
-    row = res.fetchone()
-    return row[0] if row else None
+    return bonuses[0] if bonuses else None
 
 
-# ---------------------- Вывод бонусов ----------------------
+async def confirm_deal_bonuses(session: AsyncSession, deal_id: int) -> int:
+    """Переводит потенциальные бонусы сделки в подтверждённые (без commit). Возвращает их число."""
+    bonuses = await _set_status(session, [Bonus.deal_id == deal_id], BonusStatus.potential, BonusStatus.confirmed)
+    return len(bonuses)
 
-async def withdraw_bonus(session: AsyncSession, user_id: int, amount: int) -> int:
-    """
-    Списывает бонусы у пользователя на сумму `amount` (переводит из approved в withdrawn).
-    Возвращает фактически списанную сумму.
-    """
-    q = (
-        select(Bonus)
-        .where(Bonus.user_id == user_id, Bonus.status == BonusStatus.APPROVED)
-        .order_by(Bonus.id.asc())
-    )
-    res = await session.execute(q)
-    bonuses = res.scalars().all()
 
-    remaining = amount
-    withdrawn = 0
+# ---------------------- Вывод бонусов ----------------------
 
-    for b in bonuses:
-        if remaining <= 0:
+async def _pick(session: AsyncSession, user_id: int, status: BonusStatus, amount: Decimal, order) -> List[int]:
+    """id бонусов в статусе status, которые покрывают сумму amount (в порядке order)."""
+    res = await session.execute(
+        select(Bonus.id, Bonus.amount).where(Bonus.user_id == user_id, _status_is(status)).order_by(order)
+    )
+    ids, covered = [], Decimal(0)
+    for bonus_id, bonus_amount in res.all():
+        if covered >= amount:
             break
-        take = min(b.amount, remaining)
-        b.status = BonusStatus.WITHDRAWN
-        withdrawn += take
-        remaining -= take
-
-    await session.commit()
-    return withdrawn
+        ids.append(bonus_id)
+        covered += bonus_amount
+    return ids
 
 
-async def restore_bonus(session: AsyncSession, user_id: int, amount: int) -> int:
+async def withdraw_bonus(session: AsyncSession, user_id: int, amount: Decimal) -> Decimal:
     """
-    Возвращает пользователю бонусы (переводит из withdrawn обратно в approved).
-    Используется при отклонении заявки на вывод.
+    Списывает бонусы у пользователя на сумму `amount` (переводит из confirmed в withdrawn).
+    Возвращает фактически списанную сумму.
     """
-    q = (
-        select(Bonus)
-        .where(Bonus.user_id == user_id, Bonus.status == BonusStatus.WITHDRAWN)
-        .order_by(Bonus.id.desc())
-    )
-    res = await session.execute(q)
-    bonuses = res.scalars().all()
+    ids = await _pick(session, user_id, BonusStatus.confirmed, amount, Bonus.id.asc())
+    bonuses = await _set_status(session, [Bonus.id.in_(ids)], BonusStatus.confirmed, BonusStatus.withdrawn) if ids else []
+    return min(Decimal(amount), sum((b.amount for b in bonuses), Decimal(0)))
 
-    remaining = amount
-    restored = 0
 
-    for b in bonuses:
-        if remaining <= 0:
-            break
-        take = min(b.amount, remaining)
-        b.status = BonusStatus.APPROVED
-        restored += take
-        remaining -= take
-
-    await session.commit()
-    return restored
+async def restore_bonus(session: AsyncSession, user_id: int, amount: Decimal) -> Decimal:
+    """
+    Возвращает пользователю бонусы (переводит из withdrawn обратно в confirmed).
+    Используется при отклонении заявки на вывод.
+    """
+    ids = await _pick(session, user_id, BonusStatus.withdrawn, amount, Bonus.id.desc())
+    bonuses = await _set_status(session, [Bonus.id.in_(ids)], BonusStatus.withdrawn, BonusStatus.confirmed) if ids else []
+    return min(Decimal(amount), sum((b.amount for b in bonuses), Decimal(0)))
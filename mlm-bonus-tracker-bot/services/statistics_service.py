@@ -0,0 +1,91 @@
+"""
+Статистика партнёра: все подсчёты (COUNT, SUM, GROUP BY по месяцам) делает база.
+
+Строки сделок, выплат и партнёров в Python не загружаются, поэтому стоимость
+запросов не растёт вместе с историей партнёра. Личная статистика и KPI собираются
+одним запросом из скалярных подзапросов, рост сети — одним GROUP BY по дереву.
+"""
+
+from datetime import datetime
+from typing import Dict, Optional
+
+from sqlalchemy import func, select, true
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import aliased
+
+from db.models import BonusBalance, BonusStatus, Deal, DealStatus, Payout, PayoutStatus, User
+from mlm.tree import MAX_DEPTH, tree_select
+
+
+def month_expr(session: AsyncSession, column):
+    """Выражение 'YYYY-MM' для колонки даты в диалекте текущей базы."""
+    if session.bind.dialect.name == "postgresql":
+        return func.to_char(func.date_trunc("month", column), "YYYY-MM")
+    return func.strftime("%Y-%m", column)
+
+
+def _sum(column, *where):
+    return select(func.coalesce(func.sum(column), 0)).where(*where).scalar_subquery()
+
+
+def _count(column, *where):
+    return select(func.count(column)).where(*where).scalar_subquery()
+
+
+def _balance(status: BonusStatus):
+    return _sum(BonusBalance.amount, BonusBalance.user_id == User.id, BonusBalance.status == status)
+
+
+async def get_personal_stats(session: AsyncSession, user_id: int) -> Optional[Dict]:
+    """
+    Личная статистика партнёра (users.id) одним запросом:
+    user_id, status_points, personal_sales, invited_count, potential, confirmed, withdrawn.
+    None — пользователя нет в базе.
+    """
+    invited = aliased(User)
+    q = select(
+        User.id.label("user_id"),
+        User.status_points,
+        _sum(Deal.amount, Deal.user_id == User.id, Deal.status == DealStatus.confirmed).label("personal_sales"),
+        _count(invited.id, invited.sponsor_id == User.id).label("invited_count"),
+        _balance(BonusStatus.potential).label("potential"),
+        _balance(BonusStatus.confirmed).label("confirmed"),
+        _balance(BonusStatus.withdrawn).label("withdrawn"),
+    ).where(User.id == user_id)
+    row = (await session.execute(q)).mappings().first()
+    return dict(row) if row else None
+
+
+async def get_kpi(session: AsyncSession, user_id: int, since: datetime) -> Optional[Dict]:
+    """
+    KPI партнёра (users.id) с даты since одним запросом: deals_count, deals_sum, payouts_count, payouts_sum.
+    None — пользователя нет в базе.
+    """
+    deals = (Deal.user_id == User.id, Deal.created_at >= since, Deal.status == DealStatus.confirmed)
+    payouts = (Payout.user_id == User.id, Payout.created_at >= since, Payout.status == PayoutStatus.confirmed)
+    q = select(
+        _count(Deal.id, *deals).label("deals_count"),
+        _sum(Deal.amount, *deals).label("deals_sum"),
+        _count(Payout.id, *payouts).label("payouts_count"),
+        _sum(Payout.amount, *payouts).label("payouts_sum"),
+    ).where(User.id == user_id)
+    row = (await session.execute(q)).mappings().first()
+    return dict(row) if row else None
+
+
+async def get_network_growth(
+    session: AsyncSession, user_id: int, since: Optional[datetime] = None, max_depth: int = MAX_DEPTH
+) -> Dict[str, int]:
+    """Новые партнёры в структуре по месяцам {'YYYY-MM': количество} с даты since (None — за всё время)."""
+    tree = tree_select("down", user_id, max_depth).subquery()
+    month = month_expr(session, User.created_at).label("month")
+    q = (
+        select(month, func.count())
+        .select_from(tree)
+        .join(User, User.id == tree.c.id)
+        .where(User.created_at >= since if since is not None else true())
+        .group_by(month)
+        .order_by(month)
+    )
+    return {m: count for m, count in (await session.execute(q)).all()}
+
@@ -0,0 +1,80 @@
+"""
+Построение графиков статистики в отдельных процессах.
+
+matplotlib рисует долго и держит CPU, поэтому PNG рендерится в пуле процессов
+(ProcessPoolExecutor) через объектный API Figure + FigureCanvasAgg, без глобального
+состояния pyplot. matplotlib импортируется только в рабочем процессе, при первом
+графике, — старт бота его не ждёт. Готовые PNG кэшируются по (user_id, хэш данных):
+повторное нажатие с теми же данными не рисует график заново.
+"""
+
+import asyncio
+import hashlib
+import io
+import json
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Optional, Tuple
+
+from config import settings
+
+_executor: Optional[ProcessPoolExecutor] = None
+_png_cache: "OrderedDict[Tuple[int, str], bytes]" = OrderedDict()
+
+
+def _render_growth_png(months, values) -> bytes:
+    """Рисует график роста сети (выполняется в рабочем процессе)."""
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+    fig = Figure(figsize=(6, 4))
+    FigureCanvasAgg(fig)
+    ax = fig.add_subplot()
+    ax.plot(months, values, marker="o")
+    ax.tick_params(axis="x", labelrotation=45)
+    for label in ax.get_xticklabels():
+        label.set_horizontalalignment("right")
+    ax.set_title("Рост сети по месяцам")
+    ax.set_xlabel("Месяц")
+    ax.set_ylabel("Новые партнёры")
+    fig.tight_layout()
+
+    buf = io.BytesIO()
+    fig.savefig(buf, format="png")
+    return buf.getvalue()
+
+
+def _get_executor() -> ProcessPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(max_workers=settings.CHART_WORKERS)
+    return _executor
+
+
+def shutdown() -> None:
+    """Останавливает пул процессов (при остановке бота)."""
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+
+async def growth_chart(user_id: int, monthly: Dict[str, int]) -> bytes:
+    """PNG графика роста сети {'YYYY-MM': количество} — из кэша или из пула процессов."""
+    months = sorted(monthly)
+    values = [monthly[m] for m in months]
+    digest = hashlib.sha1(json.dumps([months, values]).encode()).hexdigest()
+    key = (user_id, digest)
+
+    png = _png_cache.get(key)
+    if png is not None:
+        _png_cache.move_to_end(key)
+        return png
+
+    loop = asyncio.get_running_loop()
+    png = await loop.run_in_executor(_get_executor(), _render_growth_png, months, values)
+
+    _png_cache[key] = png
+    while len(_png_cache) > settings.CHART_CACHE_SIZE:
+        _png_cache.popitem(last=False)
+    return png